@@ -0,0 +1,91 @@
+"""
+Benchmark of the chunking strategies in processing/chunking.py.
+
+For each strategy reports chunking throughput (chunks/s, pages/s), chunk count and
+token sizes, and retrieval hit rate@k. A query hits when one of the top-k chunks
+(cosine over chunk embeddings) contains its answer text. Without --queries, queries
+are made from random corpus sentences (their middle words) and the answer is the
+query text itself.
+
+    python -m benchmarks.chunking_benchmark --corpus manual.pdf
+    python -m benchmarks.chunking_benchmark --corpus pages.txt --queries eval.jsonl --k 5
+"""
+import argparse
+import json
+import random
+import time
+
+import numpy as np
+
+from llm.ModelEmbedding import get_embedding_model_service
+from processing.chunking import CHUNK_STRATEGIES, Chunker, split_sentences
+from processing.document_processor import extract_text_from_pdf
+
+
+def load_pages(path: str):
+    if path.lower().endswith(".pdf"):
+        return extract_text_from_pdf(path)
+    with open(path, encoding="utf-8") as f:
+        # Plain text corpus: pages separated by form feeds (or one page per file)
+        return [page for page in f.read().lower().split("\f") if page.strip()]
+
+
+def synthetic_queries(pages, count: int, seed: int = 0):
+    rng = random.Random(seed)
+    sentences = [page[start:end] for page in pages for start, end in split_sentences(page)]
+    sentences = [sentence for sentence in sentences if len(sentence.split()) >= 8]
+    queries = []
+    for sentence in rng.sample(sentences, min(count, len(sentences))):
+        words = sentence.split()
+        middle = " ".join(words[len(words) // 5: len(words) - len(words) // 5])
+        queries.append({"query": middle, "answer": middle})
+    return queries
+
+
+def run_benchmark(pages, queries, k: int = 5, max_tokens: int = 256, overlap_tokens: int = 32):
+    embedding_model = get_embedding_model_service()
+    query_embeddings = np.asarray(embedding_model.embed_batch([q["query"] for q in queries]), dtype=np.float32)
+    query_embeddings /= np.maximum(np.linalg.norm(query_embeddings, axis=1, keepdims=True), 1e-12)
+
+    report = {}
+    for strategy in CHUNK_STRATEGIES:
+        chunker = Chunker(embedding_model, strategy=strategy, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        start = time.perf_counter()
+        chunks = [chunk for page in pages for chunk in chunker.chunk(page)[0]]
+        elapsed = time.perf_counter() - start
+
+        chunk_embeddings = np.asarray(embedding_model.embed_batch(chunks), dtype=np.float32)
+        chunk_embeddings /= np.maximum(np.linalg.norm(chunk_embeddings, axis=1, keepdims=True), 1e-12)
+        top = np.argsort(-(query_embeddings @ chunk_embeddings.T), axis=1)[:, :k]
+        hits = sum(any(query["answer"] in chunks[index] for index in row) for query, row in zip(queries, top))
+
+        sizes = embedding_model.count_tokens_batch(chunks)
+        report[strategy] = {
+            "chunks": len(chunks),
+            "chunks_per_s": len(chunks) / elapsed if elapsed else None,
+            "pages_per_s": len(pages) / elapsed if elapsed else None,
+            "mean_tokens": float(np.mean(sizes)) if sizes else 0.0,
+            "max_tokens": max(sizes, default=0),
+            f"hit_rate@{k}": hits / len(queries) if queries else None
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chunking strategy benchmark")
+    parser.add_argument("--corpus", required=True, help="PDF file, or text file with pages separated by form feeds")
+    parser.add_argument("--queries", default=None, help='JSONL of {"query": ..., "answer": ...}')
+    parser.add_argument("--num_queries", type=int, default=200, help="Synthetic queries when --queries is not given")
+    parser.add_argument("--k", type=int, default=5, help="Top-k chunks checked for the answer")
+    parser.add_argument("--max_tokens", type=int, default=256, help="Chunk token budget")
+    parser.add_argument("--overlap_tokens", type=int, default=32, help="Overlap between consecutive chunks")
+    args = parser.parse_args()
+
+    corpus_pages = load_pages(args.corpus)
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            eval_queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        eval_queries = synthetic_queries(corpus_pages, args.num_queries)
+    print(json.dumps(run_benchmark(corpus_pages, eval_queries, args.k, args.max_tokens, args.overlap_tokens),
+                     indent=2))
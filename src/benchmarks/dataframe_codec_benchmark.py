@@ -0,0 +1,87 @@
+"""
+Size and speed of the DataFrame cache codec (database/dataframe_codec.py) against pickle.
+
+Uses a synthetic fact table shaped like FACTDOANHTHU (year/month, foreign keys, product
+codes, quantities, revenue), or an existing cache entry with --key. For pickle and each
+codec compression reports payload size, encode time, full decode time and the decode time
+of a 3-column projection, each the best of --repeat runs.
+
+    python -m benchmarks.dataframe_codec_benchmark --rows 2000000
+    python -m benchmarks.dataframe_codec_benchmark --key "duythaitest_db_FACTDOANHTHU" --columns NAM THANG DOANHSO
+"""
+import argparse
+import json
+import pickle
+import time
+
+import numpy as np
+import pandas as pd
+
+from database.dataframe_codec import decode_dataframe, encode_dataframe
+
+COMPRESSIONS = ("zstd", "lz4", "uncompressed")
+
+
+def synthetic_fact_table(rows: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    products = np.array([f"SP{i:05d}" for i in range(5000)], dtype=object)
+    return pd.DataFrame({
+        "NAM": rng.integers(2021, 2026, rows).astype(np.int16),
+        "THANG": rng.integers(1, 13, rows).astype(np.int8),
+        "NHANVIEN_FK": rng.integers(1, 3000, rows),
+        "GSBH_FK": rng.integers(1, 300, rows),
+        "DDKD_FK": rng.integers(1, 1500, rows),
+        "MA_SANPHAM": products[rng.integers(0, len(products), rows)],
+        "SOLUONG": rng.integers(1, 500, rows),
+        "DOANHSO": rng.gamma(2.0, 1_500_000, rows).round(0),
+        "KENH": pd.Categorical(rng.choice(["GT", "MT", "ONLINE"], rows)),
+    }).convert_dtypes()
+
+
+def _best_of(repeat: int, fn):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def run_benchmark(df: pd.DataFrame, columns, repeat: int = 3):
+    report = {"rows": len(df), "columns": len(df.columns), "projection": list(columns)}
+
+    encode_s, payload = _best_of(repeat, lambda: pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL))
+    decode_s, _ = _best_of(repeat, lambda: pickle.loads(payload))
+    report["pickle"] = {"bytes": len(payload), "encode_s": encode_s, "decode_s": decode_s,
+                        "projected_decode_s": _best_of(repeat, lambda: pickle.loads(payload)[list(columns)])[0]}
+
+    for compression in COMPRESSIONS:
+        encode_s, payload = _best_of(repeat, lambda: encode_dataframe(df, compression=compression))
+        decoded_check = decode_dataframe(payload)
+        report[compression] = {
+            "bytes": len(payload),
+            "encode_s": encode_s,
+            "decode_s": _best_of(repeat, lambda: decode_dataframe(payload))[0],
+            "decode_zero_copy_s": _best_of(repeat, lambda: decode_dataframe(payload, zero_copy=True))[0],
+            "projected_decode_s": _best_of(repeat, lambda: decode_dataframe(payload, columns=columns))[0],
+            "roundtrip_equal": bool(decoded_check.equals(df)),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DataFrame codec vs pickle benchmark")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Rows of the synthetic fact table")
+    parser.add_argument("--key", default=None, help="Benchmark an existing Redis cache entry instead")
+    parser.add_argument("--columns", nargs="+", default=["NAM", "THANG", "DOANHSO"], help="Projected columns")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.key:
+        from database.redis_connection import r
+
+        frame = decode_dataframe(r.get(args.key))
+    else:
+        frame = synthetic_fact_table(args.rows)
+    print(json.dumps(run_benchmark(frame, args.columns, args.repeat), indent=2))
@@ -0,0 +1,245 @@
+"""
+In-memory stand-in for a Typesense server, for offline benchmarks.
+
+FakeTypesenseStore holds collections as dicts. It is exposed twice:
+  - `FakeTypesenseStore.sync_client()` returns a TypesenseClient whose `.client` is a
+    fake of the `typesense` library object, so every TypesenseClient method (chatbot
+    creation, imports, catalog, exports) runs unchanged on top of it;
+  - `FakeAsyncTypesenseClient` implements the AsyncTypesenseClient methods used on the
+    query path.
+
+Only the query features this code base issues are supported: `q`/`query_by` text match,
+`vector_query` (cosine, `k`), `filter_by` clauses joined with `&&` (`f:=v`, `f:[a..b]`,
+`f:[v1,v2]`), `sort_by`, `include_fields`/`exclude_fields`, `per_page`/`page`/`limit`/`offset`.
+"""
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from typesense.exceptions import ObjectNotFound
+
+from database.typesense_declare import TypesenseClient
+
+VECTOR_QUERY = re.compile(r"(\w+):\(\[(.*)\],\s*k:(\d+)\)")
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def _strip(value: str) -> str:
+    value = value.strip()
+    return value[1:-1] if len(value) >= 2 and value[0] == value[-1] == "`" else value
+
+
+def _parse_filter(filter_by: Optional[str]):
+    clauses = []
+    for clause in (filter_by or "").split("&&"):
+        if not clause.strip():
+            continue
+        field, value = clause.strip().split(":", 1)
+        value = value[1:] if value.startswith("=") else value
+        if value.startswith("[") and ".." in value:
+            low, high = value[1:-1].split("..")
+            clauses.append((field, "range", (float(low), float(high))))
+        elif value.startswith("["):
+            clauses.append((field, "in", {_strip(item) for item in value[1:-1].split(",")}))
+        else:
+            clauses.append((field, "eq", _strip(value)))
+    return clauses
+
+
+def _matches(doc: Dict[str, Any], clauses) -> bool:
+    for field, op, value in clauses:
+        actual = doc.get(field)
+        if op == "range":
+            if actual is None or not value[0] <= float(actual) <= value[1]:
+                return False
+        elif op == "in":
+            if str(actual) not in value:
+                return False
+        elif str(actual) != value:
+            return False
+    return True
+
+
+def _project(doc: Dict[str, Any], params: Dict[str, Any]) -> Dict[str, Any]:
+    if params.get("include_fields"):
+        fields = params["include_fields"].split(",")
+        return {key: doc[key] for key in fields if key in doc}
+    excluded = set((params.get("exclude_fields") or "").split(","))
+    return {key: value for key, value in doc.items() if key not in excluded}
+
+
+class FakeDocument:
+    def __init__(self, collection: "FakeCollection", doc_id: str):
+        self.collection = collection
+        self.doc_id = doc_id
+
+    def retrieve(self):
+        if self.doc_id not in self.collection.docs:
+            raise ObjectNotFound(self.doc_id)
+        return dict(self.collection.docs[self.doc_id])
+
+    def update(self, data):
+        self.retrieve()
+        self.collection.docs[self.doc_id].update(data)
+        return dict(self.collection.docs[self.doc_id])
+
+    def delete(self):
+        return self.collection.docs.pop(self.doc_id)
+
+
+class FakeDocuments:
+    def __init__(self, collection: "FakeCollection"):
+        self.collection = collection
+
+    def __getitem__(self, doc_id: str) -> FakeDocument:
+        return FakeDocument(self.collection, doc_id)
+
+    def create(self, doc):
+        self.collection.docs[str(doc["id"])] = dict(doc)
+        return doc
+
+    def upsert(self, doc):
+        return self.create(doc)
+
+    def import_(self, docs, params=None):
+        action = (params or {}).get("action", "create")
+        for doc in docs:
+            if action in ("update", "emplace") and doc["id"] in self.collection.docs:
+                self.collection.docs[doc["id"]].update(doc)
+            else:
+                self.collection.docs[str(doc["id"])] = dict(doc)
+        return [{"success": True} for _ in docs]
+
+    def export(self, params=None):
+        params = params or {}
+        clauses = _parse_filter(params.get("filter_by"))
+        return "\n".join(json.dumps(_project(doc, params), ensure_ascii=False)
+                         for doc in self.collection.docs.values() if _matches(doc, clauses))
+
+    def delete(self, params):
+        clauses = _parse_filter(params.get("filter_by"))
+        doomed = [doc_id for doc_id, doc in self.collection.docs.items() if _matches(doc, clauses)]
+        for doc_id in doomed:
+            del self.collection.docs[doc_id]
+        return {"num_deleted": len(doomed)}
+
+    def search(self, params):
+        return self.collection.search(params)
+
+
+class FakeCollection:
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.documents = FakeDocuments(self)
+
+    def retrieve(self):
+        return {**self.schema, "num_documents": len(self.docs)}
+
+    def update(self, schema_change):
+        self.schema["fields"] = self.schema.get("fields", []) + schema_change.get("fields", [])
+        return self.schema
+
+    def search(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        candidates = [doc for doc in self.docs.values() if _matches(doc, _parse_filter(params.get("filter_by")))]
+        hits = []
+        vector_query = VECTOR_QUERY.match(params.get("vector_query", ""))
+        if vector_query:
+            field, values, k = vector_query.groups()
+            query = np.asarray([float(x) for x in values.split(",")], dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scored = []
+            for doc in candidates:
+                vector = np.asarray(doc[field], dtype=np.float32)
+                scored.append((1.0 - float(vector @ query) / max(float(np.linalg.norm(vector)), 1e-12), doc))
+            scored.sort(key=lambda item: item[0])
+            hits = [{"document": doc, "vector_distance": distance} for distance, doc in scored[:int(k)]]
+        elif params.get("q", "*") != "*":
+            query_tokens = set(TOKEN.findall(params["q"].lower()))
+            fields = params.get("query_by", "text").split(",")
+            doc_tokens = {doc["id"]: set(TOKEN.findall(" ".join(str(doc.get(f, "")) for f in fields).lower()))
+                          for doc in candidates}
+            total = max(len(candidates), 1)
+            idf = {token: math.log(1 + total / (1 + sum(token in tokens for tokens in doc_tokens.values())))
+                   for token in query_tokens}
+            for doc in candidates:
+                score = sum(idf[token] for token in query_tokens & doc_tokens[doc["id"]])
+                if score > 0:
+                    hits.append({"document": doc, "text_match": int(score * 1000)})
+            hits.sort(key=lambda hit: -hit["text_match"])
+        else:
+            hits = [{"document": doc} for doc in candidates]
+            for key, direction in reversed([part.split(":") for part in params.get("sort_by", "").split(",") if part]):
+                hits.sort(key=lambda hit: hit["document"].get(key, 0), reverse=direction == "desc")
+
+        found = len(hits)
+        if "limit" in params or "offset" in params:
+            offset = int(params.get("offset", 0))
+            hits = hits[offset:offset + int(params.get("limit", 10))]
+        else:
+            per_page = int(params.get("per_page", 10))
+            page = int(params.get("page", 1))
+            hits = hits[(page - 1) * per_page: page * per_page]
+        return {"found": found, "hits": [{**hit, "document": _project(hit["document"], params)} for hit in hits]}
+
+
+class FakeCollections:
+    def __init__(self, store: "FakeTypesenseStore"):
+        self.store = store
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        if name not in self.store.collections:
+            raise ObjectNotFound(name)
+        return self.store.collections[name]
+
+    def create(self, schema):
+        self.store.collections[schema["name"]] = FakeCollection(dict(schema))
+        return schema
+
+    def retrieve(self):
+        return [collection.retrieve() for collection in self.store.collections.values()]
+
+
+class FakeTypesenseStore:
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = {}
+        self.client = type("FakeTypesenseLibClient", (), {})()
+        self.client.collections = FakeCollections(self)
+
+    def sync_client(self, embedding_dim: int) -> TypesenseClient:
+        """A real TypesenseClient wired to this store instead of a server."""
+        client = TypesenseClient.__new__(TypesenseClient)
+        client.embedding_dim = embedding_dim
+        client.client = self.client
+        return client
+
+
+class FakeAsyncTypesenseClient:
+    """Same methods as AsyncTypesenseClient, answered from a FakeTypesenseStore."""
+
+    def __init__(self, store: FakeTypesenseStore):
+        self.store = store
+
+    async def search(self, collection_name: str, search_parameters: Dict[str, Any]) -> Dict[str, Any]:
+        return self.store.client.collections[collection_name].search(search_parameters)
+
+    async def retrieve_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+        return self.store.collections[collection_name].docs.get(document_id)
+
+    async def multi_search(self, queries: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            return {"results": [self.store.client.collections[search["collection"]].search(search)
+                                for search in queries.get("searches", [])]}
+        except Exception as e:
+            return {"error": str(e)}
+
+    async def multi_search_many(self, queries_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [await self.multi_search(queries) for queries in queries_list]
+
+    async def health(self) -> bool:
+        return True
+
+    async def aclose(self) -> None:
+        pass
@@ -0,0 +1,258 @@
+"""
+Offline end-to-end retrieval benchmark of the RAG query path.
+
+Builds a Vietnamese corpus (synthetic product sheets, or the PDFs given with --pdf),
+indexes it through helper_rag.process_and_index_pdf into an in-memory Typesense
+stand-in (benchmarks/fake_typesense.py) or a local Typesense server (--typesense-url),
+then replays a labelled query set through helper_rag.process_rag_query with a stub LLM.
+
+Reports as JSON: recall@k and MRR of the retrieved hits against the labelled page,
+how often the answer text reaches the LLM context, indexing time, and p50/p95 latency
+of each query stage (auth, embed, search, rerank, context, llm) and of the whole query.
+Redis must be reachable (retrieval config, collection versions); the search cache and
+the local vector index are off unless enabled, so runs measure the retrieval path itself.
+
+    python -m benchmarks.rag_retrieval_benchmark --docs 5 --pages 20 --queries 200
+    python -m benchmarks.rag_retrieval_benchmark --mode hybrid --top-k 10 --output run.json
+    python -m benchmarks.rag_retrieval_benchmark --pdf a.pdf b.pdf --queries-file labelled.jsonl
+    python -m benchmarks.rag_retrieval_benchmark --typesense-url http://localhost:8108 --typesense-api-key xyz
+
+Labelled query files are JSONL: {"query": ..., "file_name": ..., "page_num": ..., "answer": ...}
+(page_num is 1-based like the indexed chunks; "answer" is optional).
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import unicodedata
+import uuid
+from urllib.parse import urlparse
+
+import fitz
+import numpy as np
+from fastapi import UploadFile
+
+from benchmarks.fake_typesense import FakeAsyncTypesenseClient, FakeTypesenseStore
+from config import settings
+from database import local_vector_index, typesense_search
+from database.typesense_async import AsyncTypesenseClient
+from database.typesense_declare import TypesenseClient
+from rag_components.retrieval_config import save_retrieval_config
+from typing_class.rag_type import QueryRequest, RetrievalConfig
+from utils import helper_rag
+from utils.trace_context import rag_trace_var
+
+GROUPS = ["máy lọc nước", "nồi cơm điện", "quạt điều hòa", "bếp từ", "máy sấy tóc", "ấm siêu tốc"]
+CITIES = ["Hà Nội", "Đà Nẵng", "Hải Phòng", "Cần Thơ", "Bình Dương", "Đồng Nai"]
+FILLER = ("Sản phẩm được kiểm tra chất lượng theo tiêu chuẩn của công ty trước khi xuất xưởng. "
+          "Khách hàng vui lòng đọc kỹ hướng dẫn sử dụng và giữ lại phiếu bảo hành. ")
+QUESTIONS = [
+    ("Giá bán lẻ của {code} là bao nhiêu?", "price"),
+    ("{code} được bảo hành bao lâu?", "warranty"),
+    ("{code} sản xuất ở đâu?", "city"),
+]
+K_VALUES = (1, 3, 5, 10)
+
+
+class StubAnswerChain:
+    """Stands in for the final-answer LLM chain: returns the start of the context instantly."""
+
+    async def ainvoke(self, inputs):
+        return inputs["knowledge_chunk"][:200]
+
+
+def _fold(text: str) -> str:
+    # The built-in PDF font has no Vietnamese glyphs: drop diacritics unless a font file is given
+    return unicodedata.normalize("NFKD", text.replace("đ", "d").replace("Đ", "D")).encode("ascii", "ignore").decode()
+
+
+def synthetic_corpus(num_docs: int, pages_per_doc: int, items_per_page: int, seed: int = 0):
+    """Product sheets: one paragraph of facts per product code, with filler text between them."""
+    rng = random.Random(seed)
+    documents, facts = [], []
+    for doc_index in range(num_docs):
+        file_name = f"catalog_{doc_index:03d}.pdf"
+        pages = []
+        for page_index in range(pages_per_doc):
+            paragraphs = []
+            for item in range(items_per_page):
+                code = f"SP{doc_index:02d}{page_index:03d}{item}"
+                fact = {
+                    "code": code,
+                    "price": f"{rng.randint(5, 90) * 100000:,}".replace(",", "."),
+                    "warranty": f"{rng.choice([6, 12, 18, 24, 36])} tháng",
+                    "city": rng.choice(CITIES),
+                    "file_name": file_name,
+                    "page_num": page_index + 1,
+                }
+                facts.append(fact)
+                paragraphs.append(
+                    f"Sản phẩm {code} thuộc nhóm {rng.choice(GROUPS)}, giá bán lẻ {fact['price']} đồng, "
+                    f"được bảo hành {fact['warranty']} và sản xuất tại nhà máy {fact['city']}. " + FILLER
+                )
+            pages.append("\n\n".join(paragraphs))
+        documents.append((file_name, pages))
+    return documents, facts
+
+
+def synthetic_queries(facts, count: int, fold: bool, seed: int = 0):
+    rng = random.Random(seed)
+    queries = []
+    for fact in rng.sample(facts, min(count, len(facts))):
+        template, field = rng.choice(QUESTIONS)
+        answer = fact[field]
+        queries.append({
+            "query": _fold(template.format(code=fact["code"])) if fold else template.format(code=fact["code"]),
+            "file_name": fact["file_name"],
+            "page_num": fact["page_num"],
+            "answer": (_fold(answer) if fold else answer).lower(),
+        })
+    return queries
+
+
+def write_pdf(path: str, pages, font_file: str = None) -> None:
+    with fitz.open() as doc:
+        for text in pages:
+            page = doc.new_page()
+            rect = page.rect + (50, 50, -50, -50)
+            if font_file:
+                page.insert_textbox(rect, text, fontsize=10, fontname="F0", fontfile=font_file)
+            else:
+                page.insert_textbox(rect, _fold(text), fontsize=10)
+        doc.save(path)
+
+
+def _percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None}
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95))}
+
+
+def _rank_of(hits, query):
+    for rank, doc in enumerate(hits, start=1):
+        if doc.get("title") == query["file_name"] and int(doc.get("page_num", -1)) == int(query["page_num"]):
+            return rank
+    return None
+
+
+async def run_benchmark(args) -> dict:
+    if args.typesense_url:
+        url = urlparse(args.typesense_url)
+        sync_client = TypesenseClient(host=url.hostname, port=url.port or 8108, protocol=url.scheme or "http",
+                                      api_key=args.typesense_api_key, embedding_dim=settings.EMBEDDING_DIMENSION)
+        async_client = AsyncTypesenseClient(
+            nodes=[{"host": url.hostname, "port": url.port or 8108, "protocol": url.scheme or "http"}],
+            api_key=args.typesense_api_key)
+        backend = "typesense"
+    else:
+        store = FakeTypesenseStore()
+        sync_client = store.sync_client(settings.EMBEDDING_DIMENSION)
+        async_client = FakeAsyncTypesenseClient(store)
+        backend = "fake"
+
+    # Measure the retrieval path itself, not the caches in front of it
+    typesense_search.SEARCH_CACHE_ENABLED = args.search_cache
+    local_vector_index.LOCAL_INDEX_ENABLED = args.local_index
+    helper_rag.get_final_answer_chain = lambda use_cloud: StubAnswerChain()
+
+    fold = not args.font
+    if args.pdf:
+        pdf_paths = args.pdf
+        with open(args.queries_file, encoding="utf-8") as f:
+            queries = [json.loads(line) for line in f if line.strip()]
+    else:
+        documents, facts = synthetic_corpus(args.docs, args.pages, args.items_per_page, args.seed)
+        queries = synthetic_queries(facts, args.queries, fold, args.seed)
+        workdir = tempfile.mkdtemp(prefix="rag_bench_")
+        pdf_paths = []
+        for file_name, pages in documents:
+            path = os.path.join(workdir, file_name)
+            write_pdf(path, pages, args.font)
+            pdf_paths.append(path)
+
+    chatbot_name = f"bench_{uuid.uuid4().hex[:8]}"
+    meta = sync_client.create_chatbot(chatbot_name, "retrieval benchmark")
+    save_retrieval_config(chatbot_name, RetrievalConfig(mode=args.mode, fusion=args.fusion, alpha=args.alpha))
+
+    try:
+        index_start = time.perf_counter()
+        num_chunks = 0
+        for path in pdf_paths:
+            with open(path, "rb") as f:
+                upload = UploadFile(file=io.BytesIO(f.read()), filename=os.path.basename(path))
+            result = await helper_rag.process_and_index_pdf(chatbot_name, upload, sync_client)
+            num_chunks += result["num_chunks"]
+        index_seconds = time.perf_counter() - index_start
+
+        stages, totals, ranks, context_hits = {}, [], [], 0
+        for query in queries:
+            trace = {}
+            token = rag_trace_var.set(trace)
+            start = time.perf_counter()
+            try:
+                response = await helper_rag.process_rag_query(QueryRequest(query=query["query"], top_k=args.top_k),
+                                                              meta["api_key"], async_client)
+            finally:
+                rag_trace_var.reset(token)
+            totals.append((time.perf_counter() - start) * 1000)
+            for stage, ms in trace.get("stages", {}).items():
+                stages.setdefault(stage, []).append(ms)
+            ranks.append(_rank_of(trace.get("hits", []), query))
+            if query.get("answer") and query["answer"] in response.get("context", "").lower():
+                context_hits += 1
+
+        found = [rank for rank in ranks if rank is not None]
+        answered = [query for query in queries if query.get("answer")]
+        return {
+            "config": {
+                "backend": backend, "mode": args.mode, "fusion": args.fusion, "alpha": args.alpha,
+                "top_k": args.top_k, "embedding_model": getattr(settings, "EMBEDDING_MODEL", None),
+                "documents": len(pdf_paths), "queries": len(queries),
+                "search_cache": args.search_cache, "local_index": args.local_index,
+            },
+            "indexing": {"seconds": index_seconds, "chunks": num_chunks,
+                         "chunks_per_s": num_chunks / index_seconds if index_seconds else None},
+            "retrieval": {
+                **{f"recall@{k}": sum(rank <= k for rank in found) / len(queries) for k in K_VALUES},
+                "mrr": sum(1.0 / rank for rank in found) / len(queries),
+                "context_answer_rate": context_hits / len(answered) if answered else None,
+            },
+            "latency_ms": {"total": _percentiles(totals),
+                           **{stage: _percentiles(values) for stage, values in stages.items()}},
+        }
+    finally:
+        sync_client.delete_chatbot(chatbot_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline RAG retrieval benchmark")
+    parser.add_argument("--docs", type=int, default=5, help="Synthetic documents")
+    parser.add_argument("--pages", type=int, default=20, help="Pages per synthetic document")
+    parser.add_argument("--items-per-page", type=int, default=4, help="Products described per page")
+    parser.add_argument("--queries", type=int, default=200, help="Synthetic labelled queries")
+    parser.add_argument("--pdf", nargs="*", default=None, help="Sampled corpus: PDFs to index instead")
+    parser.add_argument("--queries-file", default=None, help="Labelled JSONL queries (required with --pdf)")
+    parser.add_argument("--font", default=None, help="TTF with Vietnamese glyphs; without it text is ASCII-folded")
+    parser.add_argument("--mode", choices=["vector", "hybrid"], default="vector", help="Retrieval mode")
+    parser.add_argument("--fusion", choices=["rrf", "weighted"], default="rrf", help="Hybrid fusion")
+    parser.add_argument("--alpha", type=float, default=0.5, help="Hybrid vector weight")
+    parser.add_argument("--top-k", type=int, default=10, help="QueryRequest.top_k")
+    parser.add_argument("--search-cache", action="store_true", help="Keep the vector search result cache on")
+    parser.add_argument("--local-index", action="store_true", help="Keep the in-process vector index on")
+    parser.add_argument("--typesense-url", default=None, help="Use a local Typesense server instead of the fake")
+    parser.add_argument("--typesense-api-key", default="xyz", help="API key of that server")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="Also write the JSON report to this file")
+    args = parser.parse_args()
+    if args.pdf and not args.queries_file:
+        parser.error("--pdf needs --queries-file")
+
+    report = asyncio.run(run_benchmark(args))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
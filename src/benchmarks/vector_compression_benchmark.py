@@ -0,0 +1,94 @@
+"""
+Recall-vs-latency benchmark for vector compression profiles.
+
+Exports the embeddings of a chatbot collection (or loads them from a .npy
+file), uses exact cosine top-k on the full vectors as ground truth and
+reports, for each profile, recall@k, mean/p95 search latency, index size
+and vector_query payload size.
+
+    python -m benchmarks.vector_compression_benchmark --collection chatbot_master
+    python -m benchmarks.vector_compression_benchmark --embeddings sample.npy --dims 256 384 512
+"""
+import argparse
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+
+from database.vector_profile import VectorProfile, encode_vector_query
+
+
+def _load_collection_embeddings(collection_name: str) -> np.ndarray:
+    from database.typesense_declare import get_typesense_instance_service
+
+    client = get_typesense_instance_service()
+    exported = client.client.collections[collection_name].documents.export({"include_fields": "embedding"})
+    vectors = [json.loads(line)["embedding"] for line in exported.splitlines() if line.strip()]
+    return np.asarray(vectors, dtype=np.float32)
+
+
+def _top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    scores = queries @ corpus.T
+    top = np.argpartition(-scores, kth=min(k, corpus.shape[0] - 1), axis=1)[:, :k]
+    order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(top, order, axis=1)
+
+
+def run_benchmark(embeddings: np.ndarray, dims: List[int], methods: List[str], k: int = 10,
+                  num_queries: int = 200, seed: int = 0) -> Dict:
+    rng = np.random.default_rng(seed)
+    query_idx = rng.choice(len(embeddings), size=min(num_queries, len(embeddings)), replace=False)
+    # Perturb the sampled chunks so a query is close to, but not identical with, its source chunk
+    noise = rng.normal(scale=0.01, size=(len(query_idx), embeddings.shape[1])).astype(np.float32)
+    raw_queries = embeddings[query_idx] + noise
+
+    baseline = VectorProfile.fit(embeddings, method="none", normalize=True)
+    base_corpus = baseline.transform(embeddings)
+    base_queries = baseline.transform(raw_queries)
+    ground_truth = _top_k(base_corpus, base_queries, k)
+
+    results = []
+    configs = [("none", embeddings.shape[1])] + [(m, d) for m in methods for d in dims]
+    for method, dim in configs:
+        profile = VectorProfile.fit(embeddings, method=method, dim=dim, normalize=True)
+        corpus = profile.transform(embeddings)
+        queries = profile.transform(raw_queries)
+
+        latencies = []
+        found = []
+        for query in queries:
+            start = time.perf_counter()
+            found.append(_top_k(corpus, query[None, :], k)[0])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+        recall = np.mean([len(set(f) & set(g)) / k for f, g in zip(found, ground_truth)])
+        results.append({
+            "method": method,
+            "dim": int(profile.output_dim),
+            f"recall@{k}": float(recall),
+            "latency_ms_mean": float(np.mean(latencies)),
+            "latency_ms_p95": float(np.percentile(latencies, 95)),
+            "index_mb": corpus.nbytes / 1024 / 1024,
+            "query_payload_chars": len(encode_vector_query(queries[0])),
+            "legacy_payload_chars": len(",".join(str(x) for x in raw_queries[0].tolist()))
+        })
+    return {"num_chunks": int(len(embeddings)), "num_queries": int(len(query_idx)), "k": k, "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall vs latency of vector compression profiles")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--collection", help="Chatbot collection to export embeddings from")
+    source.add_argument("--embeddings", help="Path to a .npy matrix of embeddings")
+    parser.add_argument("--dims", type=int, nargs="+", default=[256, 384, 512], help="Target dimensions")
+    parser.add_argument("--methods", nargs="+", default=["truncate", "pca"], choices=["truncate", "pca"])
+    parser.add_argument("--k", type=int, default=10, help="Top-k used for recall")
+    parser.add_argument("--queries", type=int, default=200, help="Number of sampled queries")
+    args = parser.parse_args()
+
+    if args.collection:
+        matrix = _load_collection_embeddings(args.collection)
+    else:
+        matrix = np.load(args.embeddings).astype(np.float32)
+    print(json.dumps(run_benchmark(matrix, args.dims, args.methods, args.k, args.queries), indent=2))
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from config import settings
+from database.dataframe_codec import decode_dataframe
+from database.redis_connection import get_async_redis, r
+
+logger = logging.getLogger(__name__)
+
+DATAFRAME_VERSION_KEY_PREFIX = "dataframe_version:"
+# Memory budget of the process-local cache of decoded DataFrames
+DATAFRAME_L1_MAX_BYTES = getattr(settings, "DATAFRAME_L1_MAX_BYTES", 1024 ** 3)
+# Redis keys decoded into the L1 cache at startup, e.g. the FACTDOANHTHU cache key
+DATAFRAME_PREWARM_KEYS = getattr(settings, "DATAFRAME_PREWARM_KEYS", [])
+
+_MISSING = object()
+
+
+def _version_key(key: str) -> str:
+    return f"{DATAFRAME_VERSION_KEY_PREFIX}{key}"
+
+
+def _frame_bytes(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, (tuple, list)):
+        return sum(_frame_bytes(item) for item in value)
+    return 0
+
+
+def put_dataframe(key: str, payload: bytes, ex: Optional[int] = None) -> int:
+    """Writes an encoded DataFrame payload and bumps its version in one transaction; returns the new version."""
+    pipe = r.pipeline(transaction=True)
+    pipe.set(key, payload, ex=ex)
+    pipe.incr(_version_key(key))
+    return int(pipe.execute()[1])
+
+
+def bump_dataframe_version(key: str) -> None:
+    """Invalidates every process's L1 copy of a key (after deleting or rewriting it outside put_dataframe)."""
+    try:
+        r.incr(_version_key(key))
+    except Exception as e:
+        logger.warning(f"Could not bump the version of '{key}': {e}")
+
+
+class DataFrameCache:
+    """
+    Process-local LRU cache of decoded DataFrames (L1) in front of the Redis payloads (L2).
+
+    Each entry remembers the version of its Redis key (`dataframe_version:<key>`, bumped
+    by every write through put_dataframe/bump_dataframe_version), so a hit costs one small
+    GET instead of transferring and decoding the payload. Entries also remember when the
+    payload expires in Redis (its TTL when loaded) and are not served past that, so data
+    written with a TTL to bound its staleness is reloaded. Entries are evicted least recently
+    used first once their pandas memory use exceeds `max_bytes`. Cached frames are shared
+    between requests: callers must not modify them in place (copy first).
+    """
+
+    def __init__(self, max_bytes: int = DATAFRAME_L1_MAX_BYTES):
+        self.max_bytes = max_bytes
+        # (key, variant) -> (version, value, size, monotonic expiry or None)
+        self._entries: "OrderedDict[Tuple[str, Optional[Tuple]], Tuple[int, Any, int, Optional[float]]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _current_version(self, key: str) -> Optional[int]:
+        try:
+            version = r.get(_version_key(key))
+        except Exception as e:
+            logger.warning(f"Could not read the version of '{key}': {e}")
+            return None
+        return int(version) if version else 0
+
+    async def _acurrent_version(self, key: str) -> Optional[int]:
+        try:
+            version = await get_async_redis().get(_version_key(key))
+        except Exception as e:
+            logger.warning(f"Could not read the version of '{key}': {e}")
+            return None
+        return int(version) if version else 0
+
+    @staticmethod
+    def _deadline(ttls: Sequence[int]) -> Optional[float]:
+        """Monotonic expiry from the PTTLs (ms) of the payload keys: -1 = no expiry, -2 = key absent."""
+        remaining = [ttl for ttl in ttls if ttl >= 0]
+        if remaining:
+            return time.monotonic() + min(remaining) / 1000
+        return None
+
+    def _expires_at(self, ttl_keys: Sequence[str]) -> Optional[float]:
+        try:
+            pipe = r.pipeline(transaction=False)
+            for ttl_key in ttl_keys:
+                pipe.pttl(ttl_key)
+            return self._deadline(pipe.execute())
+        except Exception as e:
+            logger.warning(f"Could not read the TTL of {list(ttl_keys)}: {e}")
+            return None
+
+    async def _aexpires_at(self, ttl_keys: Sequence[str]) -> Optional[float]:
+        try:
+            async with get_async_redis().pipeline(transaction=False) as pipe:
+                for ttl_key in ttl_keys:
+                    pipe.pttl(ttl_key)
+                return self._deadline(await pipe.execute())
+        except Exception as e:
+            logger.warning(f"Could not read the TTL of {list(ttl_keys)}: {e}")
+            return None
+
+    def _lookup(self, cache_key) -> Any:
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return _MISSING
+            if entry[3] is not None and time.monotonic() >= entry[3]:
+                # The payload has expired in Redis: this copy is as stale as the writer allowed
+                self._bytes -= self._entries.pop(cache_key)[2]
+                return _MISSING
+            self._entries.move_to_end(cache_key)
+            return entry
+
+    def _store(self, cache_key, version: int, value: Any, expires_at: Optional[float] = None) -> None:
+        size = _frame_bytes(value)
+        if size > self.max_bytes:
+            logger.info(f"Not caching '{cache_key[0]}' in L1: {size} bytes exceeds the {self.max_bytes} byte budget")
+            return
+        with self._lock:
+            previous = self._entries.pop(cache_key, None)
+            if previous is not None:
+                self._bytes -= previous[2]
+            self._entries[cache_key] = (version, value, size, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                evicted_key, (_, _, evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                logger.info(f"Evicted '{evicted_key[0]}' from the DataFrame L1 cache ({evicted_size} bytes)")
+
+    def get_or_load(self, key: str, loader: Callable[[], Optional[Any]], variant: Optional[Tuple] = None,
+                    ttl_keys: Optional[Sequence[str]] = None) -> Optional[Any]:
+        """
+        The cached value of `key` while its Redis version is unchanged and its payload has not
+        expired, else `loader()` (None = absent). `variant` distinguishes several values cached
+        for one key (e.g. column projections); `ttl_keys` (default `key`) hold the payload whose
+        TTL bounds the entry.
+        """
+        cache_key = (key, variant)
+        version = self._current_version(key)
+        entry = self._lookup(cache_key)
+        # Redis unreachable: the local copy is the best we have
+        if entry is not _MISSING and (version is None or entry[0] == version):
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = loader()
+        if value is not None and version is not None:
+            self._store(cache_key, version, value, self._expires_at(ttl_keys or (key,)))
+        return value
+
+    def get(self, key: str, decode: Callable[..., Any] = decode_dataframe,
+            columns: Optional[Sequence[str]] = None) -> Optional[Any]:
+        """
+        The decoded value of a Redis key, or None when Redis has no payload for it.
+        `decode(payload)` (or `decode(payload, columns=...)`) turns the payload into the value.
+        """
+        def _load():
+            payload = r.get(key)
+            if payload is None:
+                return None
+            return decode(payload, columns=columns) if columns is not None else decode(payload)
+
+        return self.get_or_load(key, _load, tuple(columns) if columns is not None else None)
+
+    async def aget_or_load(self, key: str, loader: Callable[[], Awaitable[Optional[Any]]],
+                           variant: Optional[Tuple] = None, ttl_keys: Optional[Sequence[str]] = None) -> Optional[Any]:
+        """get_or_load for the event loop: the version GET uses the asyncio pool and `loader` is awaited."""
+        cache_key = (key, variant)
+        version = await self._acurrent_version(key)
+        entry = self._lookup(cache_key)
+        if entry is not _MISSING and (version is None or entry[0] == version):
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        value = await loader()
+        if value is not None and version is not None:
+            self._store(cache_key, version, value, await self._aexpires_at(ttl_keys or (key,)))
+        return value
+
+    async def aget(self, key: str, decode: Callable[..., Any] = decode_dataframe,
+                   columns: Optional[Sequence[str]] = None) -> Optional[Any]:
+        """Async get: the payload is fetched on the asyncio pool and decoded in a worker thread."""
+        async def _load():
+            payload = await get_async_redis().get(key)
+            if payload is None:
+                return None
+            if columns is not None:
+                return await asyncio.to_thread(decode, payload, columns=columns)
+            return await asyncio.to_thread(decode, payload)
+
+        return await self.aget_or_load(key, _load, tuple(columns) if columns is not None else None)
+
+    def put(self, key: str, value: Any, payload: bytes, ex: Optional[int] = None) -> None:
+        """Writes a value to Redis (as its encoded payload) and keeps the decoded value in L1."""
+        version = put_dataframe(key, payload, ex)
+        self.invalidate(key)
+        self._store((key, None), version, value, time.monotonic() + ex if ex else None)
+
+    def invalidate(self, key: str) -> None:
+        with self._lock:
+            for cache_key in [cache_key for cache_key in self._entries if cache_key[0] == key]:
+                self._bytes -= self._entries.pop(cache_key)[2]
+
+    def prewarm(self, keys: Iterable[str], decode: Callable[..., Any] = decode_dataframe,
+                load: Optional[Callable[[str], Optional[Any]]] = None) -> None:
+        """Loads each key through `load(key)` (a loader backed by this cache) or else self.get(key, decode)."""
+        for key in keys:
+            try:
+                value = load(key) if load is not None else self.get(key, decode)
+                if value is None:
+                    logger.warning(f"Pre-warm: no cached payload for '{key}'")
+                else:
+                    logger.info(f"Pre-warmed '{key}' into the DataFrame L1 cache")
+            except Exception as e:
+                logger.warning(f"Could not pre-warm '{key}': {e}")
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+
+_dataframe_cache_instance: Optional[DataFrameCache] = None
+
+
+def get_dataframe_cache_service() -> DataFrameCache:
+    """
+    Returns the singleton instance of the DataFrameCache.
+    """
+    global _dataframe_cache_instance
+    if _dataframe_cache_instance is None:
+        _dataframe_cache_instance = DataFrameCache()
+    return _dataframe_cache_instance
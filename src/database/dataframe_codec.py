@@ -0,0 +1,249 @@
+"""
+Binary codec for DataFrames cached in Redis.
+
+Payload layout: MAGIC (4 bytes) | header length (uint32 LE) | JSON header | frame bodies.
+The header lists every frame with its offset, length, row count, column names and dtypes,
+plus JSON "extras" (e.g. the permission dict cached with an Excel workbook). Each frame
+body is an Arrow IPC file with zstd/lz4-compressed buffers, so a reader can decompress
+only the columns it asks for. With `zero_copy=True` the DataFrame columns are views of the
+Arrow buffers (of the payload itself when uncompressed) and therefore read-only; the default
+builds ordinary writable blocks. Frames Arrow cannot represent (mixed-type object columns)
+fall back to pickle.
+
+Payloads without MAGIC are legacy `pickle.dumps` values and are still decoded;
+`python -m database.dataframe_codec migrate` rewrites them in place.
+"""
+import argparse
+import json
+import logging
+import pickle
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+from config import settings
+from database.redis_connection import CustomEncoder, r
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"DFA1"
+_HEADER_LENGTH = struct.Struct("<I")
+# "zstd", "lz4" or "uncompressed" (larger, but decoded without copying the buffers)
+DATAFRAME_CODEC_COMPRESSION = getattr(settings, "DATAFRAME_CODEC_COMPRESSION", "zstd")
+# Rows per Arrow record batch
+DATAFRAME_CODEC_BATCH_ROWS = getattr(settings, "DATAFRAME_CODEC_BATCH_ROWS", 256 * 1024)
+
+# Frame names of the Excel workbook tuple cached by get_excel_data_with_cache
+EXCEL_DATA_FRAME = "data"
+EXCEL_MASTER_FRAME = "master"
+
+
+def is_encoded(payload: Optional[bytes]) -> bool:
+    return bool(payload) and payload[:len(MAGIC)] == MAGIC
+
+
+def _encode_frame(df: pd.DataFrame, compression: str) -> Tuple[bytes, str]:
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        logger.warning(f"DataFrame not representable in Arrow ({e}); storing this frame with pickle")
+        return pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL), "pickle"
+    sink = pa.BufferOutputStream()
+    options = pa.ipc.IpcWriteOptions(compression=None if compression == "uncompressed" else compression)
+    with pa.ipc.new_file(sink, table.schema, options=options) as writer:
+        writer.write_table(table, max_chunksize=DATAFRAME_CODEC_BATCH_ROWS)
+    return sink.getvalue().to_pybytes(), "arrow"
+
+
+def encode_frames(frames: Dict[str, Optional[pd.DataFrame]], extras: Optional[Dict[str, Any]] = None,
+                  compression: str = DATAFRAME_CODEC_COMPRESSION) -> bytes:
+    """Serialises named DataFrames (None allowed) and JSON-able extras into one payload."""
+    header = {"frames": {}, "extras": extras or {}}
+    bodies = []
+    offset = 0
+    for name, df in frames.items():
+        if df is None:
+            header["frames"][name] = None
+            continue
+        body, body_format = _encode_frame(df, compression)
+        header["frames"][name] = {
+            "format": body_format,
+            "offset": offset,
+            "length": len(body),
+            "rows": int(len(df)),
+            "columns": [str(column) for column in df.columns],
+            "dtypes": {str(column): str(dtype) for column, dtype in df.dtypes.items()},
+        }
+        bodies.append(body)
+        offset += len(body)
+    header_bytes = json.dumps(header, cls=CustomEncoder, ensure_ascii=False).encode("utf-8")
+    return b"".join([MAGIC, _HEADER_LENGTH.pack(len(header_bytes)), header_bytes, *bodies])
+
+
+def read_header(payload: bytes) -> Dict[str, Any]:
+    """Frame descriptions and extras, without decoding any frame."""
+    (length,) = _HEADER_LENGTH.unpack_from(payload, len(MAGIC))
+    start = len(MAGIC) + _HEADER_LENGTH.size
+    header = json.loads(bytes(payload[start:start + length]).decode("utf-8"))
+    header["_body_start"] = start + length
+    return header
+
+
+def _decode_frame(buffer: pa.Buffer, meta: Dict[str, Any], columns: Optional[Sequence[str]],
+                  zero_copy: bool) -> pd.DataFrame:
+    body = buffer.slice(meta["offset"], meta["length"])
+    if meta["format"] == "pickle":
+        df = pickle.loads(body.to_pybytes())
+        return df[list(columns)] if columns is not None else df
+
+    options = None
+    if columns is not None:
+        positions = {name: i for i, name in enumerate(meta["columns"])}
+        missing = [column for column in columns if column not in positions]
+        if missing:
+            raise KeyError(f"Columns not in cached frame: {missing}")
+        # Only the requested fields are read (and decompressed)
+        options = pa.ipc.IpcReadOptions(included_fields=sorted(positions[column] for column in columns))
+    table = pa.ipc.open_file(pa.BufferReader(body), options=options).read_all()
+    df = table.to_pandas(split_blocks=True, self_destruct=True) if zero_copy else table.to_pandas()
+    return df[list(columns)] if columns is not None else df
+
+
+def decode_frames(payload: bytes, columns: Optional[Dict[str, Sequence[str]]] = None,
+                  names: Optional[Sequence[str]] = None,
+                  zero_copy: bool = False) -> Tuple[Dict[str, Optional[pd.DataFrame]], Dict[str, Any]]:
+    """
+    Decodes a payload into ({frame name: DataFrame or None}, extras).
+    `names` limits which frames are decoded; `columns` maps frame names to the columns to read.
+    """
+    header = read_header(payload)
+    buffer = pa.py_buffer(payload).slice(header["_body_start"])
+    frames = {}
+    for name, meta in header["frames"].items():
+        if names is not None and name not in names:
+            continue
+        frames[name] = None if meta is None else _decode_frame(buffer, meta, (columns or {}).get(name), zero_copy)
+    return frames, header["extras"]
+
+
+def encode_dataframe(df: pd.DataFrame, compression: str = DATAFRAME_CODEC_COMPRESSION) -> bytes:
+    return encode_frames({EXCEL_DATA_FRAME: df}, compression=compression)
+
+
+def decode_dataframe(payload: bytes, columns: Optional[Sequence[str]] = None, zero_copy: bool = False) -> pd.DataFrame:
+    """A cached DataFrame, optionally only some of its columns; legacy pickle payloads are accepted."""
+    if not is_encoded(payload):
+        df = pickle.loads(payload)
+        return df[list(columns)] if columns is not None else df
+    frames, _ = decode_frames(payload, {EXCEL_DATA_FRAME: columns} if columns is not None else None,
+                              names=[EXCEL_DATA_FRAME], zero_copy=zero_copy)
+    return frames[EXCEL_DATA_FRAME]
+
+
+def encode_excel_result(result: Tuple) -> bytes:
+    """Encodes the (data_df, master_df, permission, description, error) tuple of _read_excel_file_data."""
+    data_df, master_df, permission, description, error = result
+    return encode_frames({EXCEL_DATA_FRAME: data_df, EXCEL_MASTER_FRAME: master_df},
+                         {"permission": permission, "description": description, "error": error})
+
+
+def decode_excel_result(payload: bytes) -> Tuple:
+    if not is_encoded(payload):
+        return pickle.loads(payload)
+    frames, extras = decode_frames(payload)
+    return (frames[EXCEL_DATA_FRAME], frames[EXCEL_MASTER_FRAME], extras.get("permission", {}),
+            extras.get("description", ""), extras.get("error"))
+
+
+# ---- Migration of existing keys ----
+def _legacy_to_payload(value: Any) -> Optional[bytes]:
+    if isinstance(value, pd.DataFrame):
+        return encode_dataframe(value)
+    if isinstance(value, tuple) and len(value) == 5 and isinstance(value[0], (pd.DataFrame, type(None))):
+        return encode_excel_result(value)
+    return None
+
+
+def _is_legacy_arrow_serialized(payload: bytes) -> bool:
+    """
+    True for values written by the removed `pa.serialize(...).to_buffer()`: int32 object counts
+    padded to 16 bytes, followed by an Arrow IPC stream (checked by reading its schema).
+    """
+    if len(payload) < 24:
+        return False
+    counts = struct.unpack_from("<4i", payload, 0)
+    if any(count < 0 or count > 1_000_000 for count in counts):
+        return False
+    try:
+        pa.ipc.open_stream(pa.py_buffer(payload).slice(16))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError, OSError):
+        return False
+    return True
+
+
+def migrate_keys(patterns: List[str], dry_run: bool = False) -> Dict[str, int]:
+    """
+    Re-encodes pickled DataFrame values under the given key patterns, keeping their TTL.
+    The patterns are broad (`*_*_*`), so anything not positively identified as a cached
+    DataFrame (lists, counters, JSON, ...) is left alone; only values written by the removed
+    pa.serialize are deleted, to be rebuilt from the source on the next read.
+    """
+    from database.dataset_partitions import is_bookkeeping_key
+
+    counts = {"migrated": 0, "already_encoded": 0, "deleted": 0, "skipped": 0, "bytes_before": 0, "bytes_after": 0}
+    for pattern in patterns:
+        for key in r.scan_iter(match=pattern, count=500):
+            if is_bookkeeping_key(key) or r.type(key) != b"string":
+                continue
+            payload = r.get(key)
+            if payload is None:
+                continue
+            if is_encoded(payload):
+                counts["already_encoded"] += 1
+                continue
+            try:
+                new_payload = _legacy_to_payload(pickle.loads(payload))
+            except Exception:
+                if _is_legacy_arrow_serialized(payload):
+                    logger.warning(f"Deleting {key!r}: written by the removed pa.serialize, rebuilt on the next read")
+                    if not dry_run:
+                        r.delete(key)
+                    counts["deleted"] += 1
+                else:
+                    counts["skipped"] += 1
+                continue
+            if new_payload is None:
+                counts["skipped"] += 1
+                continue
+            counts["bytes_before"] += len(payload)
+            counts["bytes_after"] += len(new_payload)
+            if not dry_run:
+                ttl_ms = r.pttl(key)
+                r.set(key, new_payload, px=ttl_ms if ttl_ms and ttl_ms > 0 else None)
+            counts["migrated"] += 1
+            logger.info(f"Migrated {key!r}: {len(payload)} -> {len(new_payload)} bytes")
+    return counts
+
+
+def default_migration_patterns() -> List[str]:
+    from database.redis_connection import REDIS_KEY_PREFIX
+
+    patterns = [settings.DATAFRAME_CACHE_DEFINE.format(collection="*", type="*", full_path="*"),
+                f"{REDIS_KEY_PREFIX}*"]
+    gsbh_key = getattr(settings, "OPC_DB_GSBH_CACHE_NAME", None)
+    if gsbh_key:
+        patterns.append(gsbh_key)
+    return patterns
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DataFrame cache codec maintenance")
+    parser.add_argument("action", choices=["migrate"], help="migrate: re-encode pickled DataFrame cache entries")
+    parser.add_argument("--pattern", action="append", default=None,
+                        help="Key pattern to migrate (repeatable; default: all DataFrame cache keys)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would change")
+    args = parser.parse_args()
+
+    print(json.dumps(migrate_keys(args.pattern or default_migration_patterns(), args.dry_run), indent=2))
@@ -0,0 +1,369 @@
+"""
+Partitioned storage of large cached datasets (fact tables synced from the SQL server).
+
+A dataset too large for one Redis value (512 MB limit), or worth reading piecewise, is
+stored as one payload per (NAM, THANG) partition and column group, plus a JSON manifest:
+
+    dataset_manifest:<key>                    -> {"generation", "columns", "dtypes",
+                                                  "column_groups", "partitions": [{nam, thang, rows}]}
+    <key>:v<generation>:part:<nam>-<thang>:g<i> -> encode_dataframe(NAM, THANG + columns of group i)
+
+Every group repeats the (constant, so nearly free once compressed) time columns. A rewrite
+writes a new generation, then swaps the manifest and bumps `dataframe_version:<key>` in one
+transaction, then deletes the previous generation; readers that raced the swap retry once.
+load_dataframe reads only the partitions in the requested time range and the column groups
+holding the requested columns, fetched with pipelined MGETs; aload_dataframe / aget_dataset
+do the same on the asyncio Redis pool. Keys without a manifest are plain encode_dataframe
+values and are loaded (and filtered) the same way.
+"""
+import argparse
+import asyncio
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+
+from config import settings
+from database.dataframe_cache import DATAFRAME_VERSION_KEY_PREFIX, get_dataframe_cache_service
+from database.dataframe_codec import decode_dataframe, encode_dataframe, is_encoded, read_header, EXCEL_DATA_FRAME
+from database.redis_connection import CustomEncoder, get_async_redis, r
+
+logger = logging.getLogger(__name__)
+
+DATASET_MANIFEST_KEY_PREFIX = "dataset_manifest:"
+DATASET_TIME_COLUMNS = ("NAM", "THANG")
+# Non-time columns per column group
+DATASET_COLUMN_GROUP_SIZE = getattr(settings, "DATASET_COLUMN_GROUP_SIZE", 8)
+# Datasets with at least this many rows (and NAM/THANG columns) are stored partitioned
+DATASET_PARTITION_MIN_ROWS = getattr(settings, "DATASET_PARTITION_MIN_ROWS", 200_000)
+# Explicit column groups per dataset key, e.g. {"<key>": [["NHANVIEN_FK", "GSBH_FK"], ["DOANHSO", "SOLUONG"]]};
+# columns not listed are grouped by DATASET_COLUMN_GROUP_SIZE
+DATASET_COLUMN_GROUPS = getattr(settings, "DATASET_COLUMN_GROUPS", {})
+# Partition payloads per MGET / SET round trip
+DATASET_PIPELINE_BATCH = getattr(settings, "DATASET_PIPELINE_BATCH", 16)
+
+# ((from_nam, from_thang), (to_nam, to_thang)), both ends inclusive; either end may be None
+TimeRange = Tuple[Optional[Tuple[int, int]], Optional[Tuple[int, int]]]
+
+
+def manifest_key(key: str) -> str:
+    return f"{DATASET_MANIFEST_KEY_PREFIX}{key}"
+
+
+def is_bookkeeping_key(redis_key) -> bool:
+    """Manifest and version keys share the DataFrame key namespace but hold no DataFrame payload."""
+    name = redis_key.decode("utf-8", "replace") if isinstance(redis_key, bytes) else str(redis_key)
+    return name.startswith(DATASET_MANIFEST_KEY_PREFIX) or name.startswith(DATAFRAME_VERSION_KEY_PREFIX)
+
+
+def partition_key(key: str, generation: int, partition: Dict[str, Any], group: int) -> str:
+    return f"{key}:v{generation}:part:{partition['nam']}-{partition['thang']}:g{group}"
+
+
+def _manifest_partition_keys(key: str, manifest: Dict[str, Any]) -> List[str]:
+    return [partition_key(key, manifest["generation"], partition, group)
+            for partition in manifest["partitions"] for group in range(len(manifest["column_groups"]))]
+
+
+def read_manifest(key: str) -> Optional[Dict[str, Any]]:
+    raw = r.get(manifest_key(key))
+    return json.loads(raw) if raw else None
+
+
+async def aread_manifest(key: str) -> Optional[Dict[str, Any]]:
+    raw = await get_async_redis().get(manifest_key(key))
+    return json.loads(raw) if raw else None
+
+
+def should_partition(df: pd.DataFrame) -> bool:
+    return len(df) >= DATASET_PARTITION_MIN_ROWS and all(column in df.columns for column in DATASET_TIME_COLUMNS)
+
+
+def column_groups(key: str, columns: Sequence[str]) -> List[List[str]]:
+    """Non-time columns split into groups: the configured ones first, the rest in order by DATASET_COLUMN_GROUP_SIZE."""
+    remaining = [column for column in columns if column not in DATASET_TIME_COLUMNS]
+    groups = []
+    for configured in DATASET_COLUMN_GROUPS.get(key, []):
+        group = [column for column in configured if column in remaining]
+        if group:
+            groups.append(group)
+            remaining = [column for column in remaining if column not in group]
+    size = max(1, DATASET_COLUMN_GROUP_SIZE)
+    groups.extend(remaining[i:i + size] for i in range(0, len(remaining), size))
+    # A table of only NAM/THANG still needs one group to carry its rows
+    return groups or [[]]
+
+
+def _time_value(value) -> Optional[int]:
+    return None if pd.isna(value) else int(value)
+
+
+def store_partitioned(key: str, df: pd.DataFrame, ex: Optional[int] = None) -> int:
+    """Writes `df` as a new generation of partitions and swaps the manifest; returns the new dataframe version."""
+    previous = read_manifest(key)
+    generation = previous["generation"] + 1 if previous else 1
+    time_columns = list(DATASET_TIME_COLUMNS)
+    groups = column_groups(key, [str(column) for column in df.columns])
+    partitions = []
+
+    pipe = r.pipeline(transaction=False)
+    pending = 0
+    for (nam, thang), part in df.groupby(time_columns, dropna=False, sort=True):
+        partition = {"nam": _time_value(nam), "thang": _time_value(thang), "rows": int(len(part))}
+        part = part.reset_index(drop=True)
+        for index, group in enumerate(groups):
+            pipe.set(partition_key(key, generation, partition, index), encode_dataframe(part[time_columns + group]), ex=ex)
+            pending += 1
+            if pending >= DATASET_PIPELINE_BATCH:
+                pipe.execute()
+                pending = 0
+        partitions.append(partition)
+    if pending:
+        pipe.execute()
+
+    manifest = {
+        "generation": generation,
+        "columns": [str(column) for column in df.columns],
+        "dtypes": {str(column): str(dtype) for column, dtype in df.dtypes.items()},
+        "column_groups": groups,
+        "partitions": partitions,
+    }
+    swap = r.pipeline(transaction=True)
+    swap.set(manifest_key(key), json.dumps(manifest, cls=CustomEncoder), ex=ex)
+    # The single-value copy of the dataset, if any, is superseded
+    swap.delete(key)
+    swap.incr(f"{DATAFRAME_VERSION_KEY_PREFIX}{key}")
+    version = int(swap.execute()[-1])
+
+    if previous:
+        _delete_keys(_manifest_partition_keys(key, previous))
+    logger.info(f"Stored '{key}' as {len(partitions)} partitions x {len(groups)} column groups (generation {generation})")
+    return version
+
+
+def store_dataset(key: str, df: pd.DataFrame, ex: Optional[int] = None) -> None:
+    """Caches a dataset partitioned when it is large and time-indexed, else as one value (also kept in L1)."""
+    if should_partition(df):
+        store_partitioned(key, df, ex)
+        get_dataframe_cache_service().invalidate(key)
+    else:
+        # A smaller rewrite of a formerly partitioned dataset: the manifest would shadow the single value
+        delete_partitions(key)
+        get_dataframe_cache_service().put(key, df, encode_dataframe(df), ex=ex)
+
+
+def dataset_exists(key: str) -> bool:
+    return bool(r.exists(manifest_key(key), key))
+
+
+def _delete_keys(keys: List[str]) -> None:
+    for i in range(0, len(keys), 500):
+        r.delete(*keys[i:i + 500])
+
+
+def delete_partitions(key: str) -> None:
+    """Removes the manifest and partitions of a dataset (not its single-value copy)."""
+    manifest = read_manifest(key)
+    if manifest is None:
+        return
+    r.delete(manifest_key(key))
+    _delete_keys(_manifest_partition_keys(key, manifest))
+
+
+def _in_range(nam: Optional[int], thang: Optional[int], time_range: Optional[TimeRange]) -> bool:
+    if time_range is None:
+        return True
+    if nam is None or thang is None:
+        return False
+    start, end = time_range
+    return (start is None or (nam, thang) >= tuple(start)) and (end is None or (nam, thang) <= tuple(end))
+
+
+def _filter_time_range(df: pd.DataFrame, time_range: Optional[TimeRange]) -> pd.DataFrame:
+    if time_range is None:
+        return df
+    if not all(column in df.columns for column in DATASET_TIME_COLUMNS):
+        logger.warning("Time range ignored: the dataset has no NAM/THANG columns")
+        return df
+    nam, thang = df[DATASET_TIME_COLUMNS[0]], df[DATASET_TIME_COLUMNS[1]]
+    period = nam.astype("Float64") * 12 + thang.astype("Float64")
+    start, end = time_range
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= period >= start[0] * 12 + start[1]
+    if end is not None:
+        mask &= period <= end[0] * 12 + end[1]
+    return df[mask.fillna(False).astype(bool)].reset_index(drop=True)
+
+
+def _mget(keys: List[str]) -> List[Optional[bytes]]:
+    pipe = r.pipeline(transaction=False)
+    for i in range(0, len(keys), DATASET_PIPELINE_BATCH):
+        pipe.mget(keys[i:i + DATASET_PIPELINE_BATCH])
+    return [payload for batch in pipe.execute() for payload in batch]
+
+
+async def _amget(keys: List[str]) -> List[Optional[bytes]]:
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        for i in range(0, len(keys), DATASET_PIPELINE_BATCH):
+            pipe.mget(keys[i:i + DATASET_PIPELINE_BATCH])
+        batches = await pipe.execute()
+    return [payload for batch in batches for payload in batch]
+
+
+def _empty_frame(manifest: Dict[str, Any], columns: Sequence[str]) -> pd.DataFrame:
+    frame = {}
+    for column in columns:
+        try:
+            frame[column] = pd.Series(dtype=manifest["dtypes"].get(column, "object"))
+        except TypeError:
+            frame[column] = pd.Series(dtype="object")
+    return pd.DataFrame(frame)
+
+
+class _PartitionPlan:
+    """The partitions and column groups (and their Redis keys) a projection / time range needs."""
+
+    def __init__(self, key: str, manifest: Dict[str, Any], columns: Optional[Sequence[str]],
+                 time_range: Optional[TimeRange]):
+        self.manifest = manifest
+        self.wanted = list(columns) if columns is not None else manifest["columns"]
+        unknown = [column for column in self.wanted if column not in manifest["columns"]]
+        if unknown:
+            raise KeyError(f"Columns not in cached dataset '{key}': {unknown}")
+        groups = [(index, [column for column in group if column in self.wanted])
+                  for index, group in enumerate(manifest["column_groups"])]
+        self.groups = [(index, group) for index, group in groups if group] or [(0, [])]
+        self.partitions = [partition for partition in manifest["partitions"]
+                           if _in_range(partition["nam"], partition["thang"], time_range)]
+        self.keys = [partition_key(key, manifest["generation"], partition, index)
+                     for partition in self.partitions for index, _ in self.groups]
+
+    def decode(self, payloads: List[Optional[bytes]]) -> Optional[pd.DataFrame]:
+        """The projected dataset, or None when a partition is missing."""
+        if not self.partitions:
+            return _empty_frame(self.manifest, self.wanted)
+        if any(payload is None for payload in payloads):
+            return None
+        time_columns = list(DATASET_TIME_COLUMNS)
+        frames = []
+        for p in range(len(self.partitions)):
+            pieces = []
+            for g, (_, group) in enumerate(self.groups):
+                payload = payloads[p * len(self.groups) + g]
+                # The time columns are read once per partition
+                pieces.append(decode_dataframe(payload, columns=(time_columns if g == 0 else []) + group))
+            frames.append(pd.concat(pieces, axis=1) if len(pieces) > 1 else pieces[0])
+        df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+        # Per-partition categoricals with different categories concatenate to object
+        for column in self.wanted:
+            dtype = self.manifest["dtypes"].get(column)
+            if dtype and str(df[column].dtype) != dtype:
+                try:
+                    df[column] = df[column].astype(dtype)
+                except (TypeError, ValueError):
+                    pass
+        return df[self.wanted]
+
+
+def _payload_columns(payload: bytes) -> Optional[List[str]]:
+    if not is_encoded(payload):
+        return None
+    meta = read_header(payload)["frames"].get(EXCEL_DATA_FRAME)
+    return meta["columns"] if meta else None
+
+
+def _decode_single(payload: bytes, columns: Optional[Sequence[str]], time_range: Optional[TimeRange]) -> pd.DataFrame:
+    if columns is None:
+        return _filter_time_range(decode_dataframe(payload), time_range)
+    needed = list(columns)
+    available = _payload_columns(payload)
+    if time_range is not None and available is not None:
+        needed += [column for column in DATASET_TIME_COLUMNS if column in available and column not in needed]
+    if available is None:
+        # Legacy pickle: decoded whole anyway
+        df = decode_dataframe(payload)
+        needed += [column for column in DATASET_TIME_COLUMNS
+                   if time_range is not None and column in df.columns and column not in needed]
+        df = df[needed]
+    else:
+        df = decode_dataframe(payload, columns=needed)
+    return _filter_time_range(df, time_range)[list(columns)]
+
+
+def load_dataframe(key: str, columns: Optional[Sequence[str]] = None,
+                   time_range: Optional[TimeRange] = None) -> Optional[pd.DataFrame]:
+    """
+    The cached dataset under `key`, restricted to `columns` (default all) and to the NAM/THANG
+    `time_range` (inclusive), or None when it is not cached.
+    """
+    for attempt in range(2):
+        # A partitioned dataset has no single value (store_partitioned deletes it): one round trip for both
+        raw_manifest, payload = r.mget([manifest_key(key), key])
+        if raw_manifest is None:
+            return None if payload is None else _decode_single(payload, columns, time_range)
+        plan = _PartitionPlan(key, json.loads(raw_manifest), columns, time_range)
+        df = plan.decode(_mget(plan.keys) if plan.keys else [])
+        if df is not None:
+            return df
+        # Partitions gone: a newer generation replaced them (retry) or they expired
+        logger.warning(f"Partitions of '{key}' generation {plan.manifest['generation']} missing (attempt {attempt + 1})")
+    return None
+
+
+async def aload_dataframe(key: str, columns: Optional[Sequence[str]] = None,
+                          time_range: Optional[TimeRange] = None) -> Optional[pd.DataFrame]:
+    """load_dataframe for the event loop: Redis I/O on the asyncio pool, decoding in a worker thread."""
+    for attempt in range(2):
+        raw_manifest, payload = await get_async_redis().mget([manifest_key(key), key])
+        if raw_manifest is None:
+            return None if payload is None else await asyncio.to_thread(_decode_single, payload, columns, time_range)
+        plan = _PartitionPlan(key, json.loads(raw_manifest), columns, time_range)
+        payloads = await _amget(plan.keys) if plan.keys else []
+        df = await asyncio.to_thread(plan.decode, payloads)
+        if df is not None:
+            return df
+        logger.warning(f"Partitions of '{key}' generation {plan.manifest['generation']} missing (attempt {attempt + 1})")
+    return None
+
+
+def _variant(columns: Optional[Sequence[str]], time_range: Optional[TimeRange]) -> Optional[Tuple]:
+    if columns is None and time_range is None:
+        return None
+    return (tuple(columns) if columns is not None else None,
+            tuple(tuple(end) if end is not None else None for end in time_range) if time_range is not None else None)
+
+
+def get_dataset(key: str, columns: Optional[Sequence[str]] = None,
+                time_range: Optional[TimeRange] = None) -> Optional[pd.DataFrame]:
+    """load_dataframe behind the process-local DataFrame cache."""
+    return get_dataframe_cache_service().get_or_load(
+        key, lambda: load_dataframe(key, columns, time_range), _variant(columns, time_range),
+        ttl_keys=(key, manifest_key(key)))
+
+
+async def aget_dataset(key: str, columns: Optional[Sequence[str]] = None,
+                       time_range: Optional[TimeRange] = None) -> Optional[pd.DataFrame]:
+    """aload_dataframe behind the process-local DataFrame cache."""
+    return await get_dataframe_cache_service().aget_or_load(
+        key, lambda: aload_dataframe(key, columns, time_range), _variant(columns, time_range),
+        ttl_keys=(key, manifest_key(key)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partitioned dataset cache maintenance")
+    parser.add_argument("action", choices=["repartition", "manifest"],
+                        help="repartition: rewrite a single-value cached dataset as partitions; manifest: print it")
+    parser.add_argument("key", help="Dataset cache key")
+    parser.add_argument("--ex", type=int, default=getattr(settings, "REDIS_EXPIRE_TIME", None), help="TTL in seconds")
+    args = parser.parse_args()
+
+    if args.action == "manifest":
+        print(json.dumps(read_manifest(args.key), indent=2))
+    else:
+        payload = r.get(args.key)
+        if payload is None:
+            raise SystemExit(f"No single-value dataset cached under '{args.key}'")
+        print(f"New version: {store_partitioned(args.key, decode_dataframe(payload), args.ex)}")
@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import settings
+from database.redis_connection import r
+from database.search_cache import get_collection_version
+
+logger = logging.getLogger(__name__)
+
+LOCAL_INDEX_ENABLED = getattr(settings, "LOCAL_INDEX_ENABLED", True)
+LOCAL_INDEX_DIR = getattr(settings, "LOCAL_INDEX_DIR", "./local_index")
+# Collections up to this many chunks are indexed automatically and searched in-process
+LOCAL_INDEX_MAX_CHUNKS = getattr(settings, "LOCAL_INDEX_MAX_CHUNKS", 2000)
+# Minimum seconds between two refresh attempts of the same collection
+LOCAL_INDEX_REFRESH_INTERVAL = getattr(settings, "LOCAL_INDEX_REFRESH_INTERVAL", 30)
+# After a failed Typesense search, queries go to the local index for this long before retrying Typesense
+TYPESENSE_RETRY_AFTER_SECONDS = getattr(settings, "TYPESENSE_RETRY_AFTER_SECONDS", 10)
+
+LOCAL_INDEX_FIELDS = ("id", "doc_uuid", "text", "title", "page_num", "chunk_num")
+
+
+class LocalVectorIndex:
+    """
+    Brute-force cosine index over a memory-mapped float16 matrix (one L2-normalised row per chunk).
+
+    Files in `<LOCAL_INDEX_DIR>/<collection>/`: `embeddings.f16` (rows) and `meta.json`
+    (collection version at build time, dimension, chunk documents without embeddings).
+    `vector_search` returns the same shape as TypesenseClient.vector_search.
+    """
+
+    def __init__(self, collection_name: str, version: int, matrix: np.ndarray, docs: List[Dict[str, Any]]):
+        self.collection_name = collection_name
+        self.version = version
+        self.matrix = matrix
+        self.docs = docs
+
+    @property
+    def size(self) -> int:
+        return len(self.docs)
+
+    @staticmethod
+    def directory(collection_name: str) -> str:
+        return os.path.join(LOCAL_INDEX_DIR, collection_name)
+
+    @classmethod
+    def build(cls, typesense_client: Any, collection_name: str) -> "LocalVectorIndex":
+        """Exports the collection from Typesense and writes a new index atomically."""
+        version = get_collection_version(collection_name) or 0
+        exported = typesense_client.client.collections[collection_name].documents.export(
+            {"include_fields": ",".join(LOCAL_INDEX_FIELDS + ("embedding",))})
+        docs, rows = [], []
+        for line in exported.splitlines():
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            rows.append(doc.pop("embedding"))
+            docs.append(doc)
+
+        matrix = np.asarray(rows, dtype=np.float32).reshape(len(rows), -1)
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        target = cls.directory(collection_name)
+        staging = f"{target}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(staging, exist_ok=True)
+        matrix.astype(np.float16).tofile(os.path.join(staging, "embeddings.f16"))
+        with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"version": version, "dim": int(matrix.shape[1]), "docs": docs}, f, ensure_ascii=False)
+        shutil.rmtree(target, ignore_errors=True)
+        os.replace(staging, target)
+        logger.info(f"Built local vector index for '{collection_name}': {len(docs)} chunks, version {version}")
+        return cls.load(collection_name)
+
+    @classmethod
+    def load(cls, collection_name: str) -> Optional["LocalVectorIndex"]:
+        directory = cls.directory(collection_name)
+        meta_path = os.path.join(directory, "meta.json")
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if not meta["docs"]:
+            matrix = np.zeros((0, meta["dim"]), dtype=np.float16)
+        else:
+            matrix = np.memmap(os.path.join(directory, "embeddings.f16"), dtype=np.float16, mode="r",
+                               shape=(len(meta["docs"]), meta["dim"]))
+        return cls(collection_name, meta["version"], matrix, meta["docs"])
+
+    def search(self, query_embedding: Sequence[float], k: int) -> List[Dict[str, Any]]:
+        """Top-k hits as Typesense-style dicts: {"document": ..., "vector_distance": 1 - cosine}."""
+        if not self.size:
+            return []
+        query = np.array(query_embedding, dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        # float16 has no BLAS path: upcast the memory-mapped rows block by block
+        scores = np.empty(self.size, dtype=np.float32)
+        for start in range(0, self.size, 8192):
+            block = np.asarray(self.matrix[start:start + 8192], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+        k = min(k, self.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [{"document": self.docs[index], "vector_distance": float(1.0 - scores[index])} for index in top]
+
+    def keyword_search(self, query_text: str, k: int) -> List[Dict[str, Any]]:
+        """Top-k chunks by the number of distinct query words in their text, as {"document": ..., "text_match": n}."""
+        words = set(re.findall(r"\w+", query_text.lower()))
+        if not words or not self.size:
+            return []
+        scores = [len(words.intersection(re.findall(r"\w+", doc.get("text", "").lower()))) for doc in self.docs]
+        top = sorted((index for index, score in enumerate(scores) if score), key=lambda index: -scores[index])[:k]
+        return [{"document": self.docs[index], "text_match": scores[index]} for index in top]
+
+    def vector_search(self, chatbot_name: str, vector: List[float], limit: int = 10) -> Dict[str, Any]:
+        start = time.perf_counter()
+        hits = self.search(vector, limit)
+        return {"found": len(hits), "hits": hits, "search_time_ms": int((time.perf_counter() - start) * 1000)}
+
+
+class LocalIndexManager:
+    """
+    Keeps local indexes in sync with Typesense and decides when they are used.
+
+    - Collections with at most LOCAL_INDEX_MAX_CHUNKS chunks are indexed automatically and,
+      when the index matches the current collection version, searched locally.
+    - Any collection with an index on disk (small ones, or larger ones built with the
+      `build_local_index` CLI action) is searched locally while Typesense is failing.
+    - Stale indexes are rebuilt in a background thread; the collection version bumped by
+      every write (database/search_cache.py) tells when an index is stale.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, Optional[LocalVectorIndex]] = {}
+        self._last_refresh: Dict[str, float] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self._typesense_failed_at: Optional[float] = None
+
+    def get(self, collection_name: str) -> Optional[LocalVectorIndex]:
+        if collection_name not in self._indexes:
+            self._indexes[collection_name] = LocalVectorIndex.load(collection_name)
+        return self._indexes[collection_name]
+
+    async def aget(self, collection_name: str) -> Optional[LocalVectorIndex]:
+        """get for the event loop: the first lookup reads meta.json in a worker thread."""
+        if collection_name in self._indexes:
+            return self._indexes[collection_name]
+        return await asyncio.to_thread(self.get, collection_name)
+
+    # ---- Typesense health, fed by search outcomes ----
+    def mark_typesense_failed(self) -> None:
+        self._typesense_failed_at = time.monotonic()
+
+    def mark_typesense_ok(self) -> None:
+        self._typesense_failed_at = None
+
+    def typesense_unavailable(self) -> bool:
+        return (self._typesense_failed_at is not None
+                and time.monotonic() - self._typesense_failed_at < TYPESENSE_RETRY_AFTER_SECONDS)
+
+    # ---- Selection ----
+    def primary_index(self, collection_name: str, version: Optional[int]) -> Optional[LocalVectorIndex]:
+        """The index to search instead of Typesense, or None (a refresh is scheduled if it is stale)."""
+        if not LOCAL_INDEX_ENABLED:
+            return None
+        index = self.get(collection_name)
+        fresh = index is not None and version is not None and index.version == version
+        if not fresh:
+            self.refresh_async(collection_name)
+        if index is None:
+            return None
+        if self.typesense_unavailable():
+            # Typesense is down: a stale answer beats none
+            return index
+        return index if fresh and index.size <= LOCAL_INDEX_MAX_CHUNKS else None
+
+    def fallback_index(self, collection_name: str) -> Optional[LocalVectorIndex]:
+        """Any index of the collection, possibly stale; used when a Typesense search has failed."""
+        return self.get(collection_name) if LOCAL_INDEX_ENABLED else None
+
+    async def aprimary_index(self, collection_name: str, version: Optional[int]) -> Optional[LocalVectorIndex]:
+        if LOCAL_INDEX_ENABLED:
+            await self.aget(collection_name)
+        return self.primary_index(collection_name, version)
+
+    async def afallback_index(self, collection_name: str) -> Optional[LocalVectorIndex]:
+        return await self.aget(collection_name) if LOCAL_INDEX_ENABLED else None
+
+    # ---- Sync ----
+    def refresh(self, collection_name: str, force: bool = False) -> Optional[LocalVectorIndex]:
+        """Rebuilds the index from a Typesense export if the collection is small or already has an index."""
+        from database.typesense_declare import get_typesense_instance_service
+
+        typesense_client = get_typesense_instance_service()
+        lock_key = f"local_index_lock:{collection_name}"
+        # One worker process rebuilds at a time; the others load the result from disk
+        if not r.set(lock_key, os.getpid(), nx=True, ex=300):
+            return self.get(collection_name)
+        try:
+            if not force and self.get(collection_name) is None:
+                num_documents = typesense_client.client.collections[collection_name].retrieve().get("num_documents", 0)
+                if num_documents > LOCAL_INDEX_MAX_CHUNKS:
+                    return None
+            index = LocalVectorIndex.build(typesense_client, collection_name)
+            self._indexes[collection_name] = index
+            return index
+        finally:
+            r.delete(lock_key)
+
+    def refresh_async(self, collection_name: str) -> None:
+        index = self._indexes.get(collection_name)
+        # Large (fallback-only) indexes are a full export each time; rebuild them less often
+        interval = LOCAL_INDEX_REFRESH_INTERVAL * (10 if index is not None and index.size > LOCAL_INDEX_MAX_CHUNKS else 1)
+        with self._lock:
+            now = time.monotonic()
+            last = self._last_refresh.get(collection_name)
+            if collection_name in self._refreshing or (last is not None and now - last < interval):
+                return
+            self._refreshing.add(collection_name)
+            self._last_refresh[collection_name] = now
+
+        def _run():
+            try:
+                # Another process may already have written a fresher index
+                self._indexes[collection_name] = LocalVectorIndex.load(collection_name)
+                index = self._indexes[collection_name]
+                if index is None or index.version != get_collection_version(collection_name):
+                    self.refresh(collection_name)
+            except Exception as e:
+                logger.warning(f"Could not refresh local vector index for '{collection_name}': {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(collection_name)
+
+        threading.Thread(target=_run, name=f"local-index-{collection_name}", daemon=True).start()
+
+
+_local_index_manager_instance: Optional[LocalIndexManager] = None
+
+
+def get_local_index_service() -> LocalIndexManager:
+    """
+    Returns the singleton instance of the LocalIndexManager.
+    """
+    global _local_index_manager_instance
+    if _local_index_manager_instance is None:
+        _local_index_manager_instance = LocalIndexManager()
+    return _local_index_manager_instance
@@ -1,20 +1,75 @@
 import json
+import logging
+from typing import Optional
 
 import numpy as np
 import redis
+import redis.asyncio as aioredis
 import pandas as pd
-import pyarrow as pa
 import os
 
+from config import settings
+
+logger = logging.getLogger(__name__)
 
 # This works because of the "ports: - 6379:6379" mapping
-r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=False)
+REDIS_HOST = getattr(settings, "REDIS_HOST", "localhost")
+REDIS_PORT = getattr(settings, "REDIS_PORT", 6379)
+REDIS_DB = getattr(settings, "REDIS_DB", 0)
+# Connections of the asyncio pool; requests beyond it wait up to REDIS_POOL_TIMEOUT seconds
+REDIS_MAX_CONNECTIONS = getattr(settings, "REDIS_MAX_CONNECTIONS", 50)
+REDIS_POOL_TIMEOUT = getattr(settings, "REDIS_POOL_TIMEOUT", 5)
+# Idle connections are PINGed before reuse when unused for this many seconds
+REDIS_HEALTH_CHECK_INTERVAL = getattr(settings, "REDIS_HEALTH_CHECK_INTERVAL", 30)
+REDIS_SOCKET_TIMEOUT = getattr(settings, "REDIS_SOCKET_TIMEOUT", 10)
+
+# Synchronous client: scripts, worker threads and code already running off the event loop.
+# Async handlers use get_async_redis() instead. Nothing connects until the first command.
+r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=False,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL, socket_timeout=REDIS_SOCKET_TIMEOUT)
+
+_async_redis_instance: Optional[aioredis.Redis] = None
 
-try:
-    r.ping()
-    print("Successfully connected to Redis running via Docker Compose!")
-except redis.exceptions.ConnectionError as e:
-    print(f"Could not connect to Redis: {e}")
+
+def get_async_redis() -> aioredis.Redis:
+    """
+    Returns the singleton asyncio Redis client of the request path.
+    Backed by a BlockingConnectionPool of REDIS_MAX_CONNECTIONS connections with health checks;
+    it binds to the event loop that first uses it (the server's loop).
+    """
+    global _async_redis_instance
+    if _async_redis_instance is None:
+        pool = aioredis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            decode_responses=False,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=REDIS_POOL_TIMEOUT,
+            health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+            socket_timeout=REDIS_SOCKET_TIMEOUT,
+            socket_keepalive=True
+        )
+        _async_redis_instance = aioredis.Redis(connection_pool=pool)
+    return _async_redis_instance
+
+
+async def close_async_redis() -> None:
+    global _async_redis_instance
+    if _async_redis_instance is not None:
+        await _async_redis_instance.aclose(close_connection_pool=True)
+        _async_redis_instance = None
+
+
+async def check_redis_connection() -> bool:
+    """Startup check replacing the former import-time ping."""
+    try:
+        await get_async_redis().ping()
+        logger.info(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+        return True
+    except redis.exceptions.RedisError as e:
+        logger.error(f"Could not connect to Redis: {e}")
+        return False
 
 
 # Define a prefix for all our DataFrame keys to keep things organized
@@ -33,6 +88,8 @@ def delete_dataframe_from_cache(file_path: str):
         # The .delete() command returns the number of keys that were deleted.
         # It will be 1 if the key existed and was deleted, 0 otherwise.
         num_deleted = r.delete(redis_key)
+        from database.dataframe_cache import bump_dataframe_version
+        bump_dataframe_version(redis_key)
 
         if num_deleted > 0:
             print(f"SUCCESS: Deleted cached DataFrame for '{file_path}' (key: '{redis_key}')")
@@ -42,6 +99,7 @@ def delete_dataframe_from_cache(file_path: str):
     except redis.exceptions.ConnectionError as e:
         print(f"Redis connection error: {e}. Could not delete key.")
 
+
 def flush_redis_database():
     """
     Deletes ALL keys in the current Redis database.
@@ -65,6 +123,8 @@ def get_dataframe_with_cache(file_path: str) -> pd.DataFrame:
     """
     Retrieves a DataFrame, using Redis as a cache to avoid re-reading the Excel file.
     """
+    from database.dataframe_codec import decode_dataframe, encode_dataframe, is_encoded
+
     # Create a unique key for this file in Redis
     redis_key = f"{REDIS_KEY_PREFIX}{os.path.basename(file_path)}"
 
@@ -72,20 +132,20 @@ def get_dataframe_with_cache(file_path: str) -> pd.DataFrame:
         # 1. Check for the key in Redis
         cached_df_bytes = r.get(redis_key)
 
-        if cached_df_bytes:
+        # Entries written by the removed pa.serialize are not readable anymore: treat them as misses
+        if cached_df_bytes and is_encoded(cached_df_bytes):
             # 2. CACHE HIT: If it exists, deserialize it and return
             print(f"CACHE HIT for '{file_path}'")
-            # PyArrow's deserialize function is perfect for this
-            df = pa.deserialize(cached_df_bytes)
+            df = decode_dataframe(cached_df_bytes)
             return df
         else:
             # 3. CACHE MISS: If it doesn't exist, read the file
             print(f"CACHE MISS for '{file_path}'. Reading from Excel file...")
             df = pd.read_excel(file_path)
 
-            # 4. Serialize the DataFrame using PyArrow and save to Redis
+            # 4. Serialize the DataFrame with the Arrow IPC codec and save to Redis
             print(f"Storing '{file_path}' in Redis cache...")
-            df_bytes = pa.serialize(df).to_buffer().to_pybytes()
+            df_bytes = encode_dataframe(df)
 
             # We also set an expiration time (TTL) of 1 day (86400 seconds)
             # This is good practice to prevent stale data. Adjust as needed.
@@ -99,6 +159,7 @@ def get_dataframe_with_cache(file_path: str) -> pd.DataFrame:
         df = pd.read_excel(file_path)
         return df
 
+
 class CustomEncoder(json.JSONEncoder):
     """
     Custom JSON encoder to handle special types from pandas and numpy,
@@ -130,4 +191,4 @@ def add_data_to_redis(key: str, value: str):
         r.set(key, value)
         print(f"Added key '{key}' with value '{value}' to Redis.")
     except redis.exceptions.ConnectionError as e:
-        print(f"Redis connection error: {e}. Could not add key-value pair.")
\ No newline at end of file
+        print(f"Redis connection error: {e}. Could not add key-value pair.")
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from config import settings
+from database.redis_connection import get_async_redis, r
+
+logger = logging.getLogger(__name__)
+
+COLLECTION_VERSION_KEY_PREFIX = "collection_version:"
+SEARCH_CACHE_KEY_PREFIX = "vector_search:"
+SEARCH_CACHE_ENABLED = getattr(settings, "SEARCH_CACHE_ENABLED", True)
+# Only bounds Redis memory: entries of an old collection version are never read again
+SEARCH_CACHE_TTL = getattr(settings, "SEARCH_CACHE_TTL", 24 * 3600)
+# Decimal places kept when hashing a query embedding
+SEARCH_CACHE_PRECISION = getattr(settings, "SEARCH_CACHE_PRECISION", 4)
+CHUNK_CACHE_SIZE = getattr(settings, "CHUNK_CACHE_SIZE", 5000)
+
+
+def bump_collection_version(collection_name: str) -> None:
+    """Marks a collection as changed; every cached search result for it becomes unreachable."""
+    try:
+        r.incr(f"{COLLECTION_VERSION_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not bump the version of '{collection_name}': {e}")
+
+
+def get_collection_version(collection_name: str) -> Optional[int]:
+    """Current version of a collection, or None when Redis is unavailable (cache bypassed)."""
+    try:
+        version = r.get(f"{COLLECTION_VERSION_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not read the version of '{collection_name}': {e}")
+        return None
+    return int(version) if version else 0
+
+
+async def aget_collection_version(collection_name: str) -> Optional[int]:
+    """get_collection_version on the asyncio Redis pool."""
+    try:
+        version = await get_async_redis().get(f"{COLLECTION_VERSION_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not read the version of '{collection_name}': {e}")
+        return None
+    return int(version) if version else 0
+
+
+def search_cache_key(collection_name: str, version: int, query_embedding: Sequence[float], top_k: int) -> str:
+    quantised = np.round(np.asarray(query_embedding, dtype=np.float32), SEARCH_CACHE_PRECISION)
+    digest = hashlib.sha1(quantised.tobytes()).hexdigest()
+    return f"{SEARCH_CACHE_KEY_PREFIX}{collection_name}:{version}:{digest}:{top_k}"
+
+
+async def aget_cached_hits(key: str) -> Optional[List[Tuple[str, float]]]:
+    """Cached (chunk id, vector distance) pairs, or None on a miss."""
+    try:
+        payload = await get_async_redis().get(key)
+    except Exception as e:
+        logger.warning(f"Search cache unavailable: {e}")
+        return None
+    return [tuple(pair) for pair in json.loads(payload)] if payload else None
+
+
+async def aput_cached_hits(key: str, hits: List[Dict]) -> None:
+    pairs = [[hit["document"]["id"], hit.get("vector_distance")] for hit in hits]
+    try:
+        await get_async_redis().set(key, json.dumps(pairs, separators=(",", ":")), ex=SEARCH_CACHE_TTL)
+    except Exception as e:
+        logger.warning(f"Could not store search results: {e}")
+
+
+class ChunkCache:
+    """
+    In-process LRU of chunk documents (without embeddings), keyed by
+    (collection, collection version, chunk id) so a re-indexed chunk is never served stale.
+    """
+
+    def __init__(self, max_size: int = CHUNK_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[tuple, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, collection_name: str, version: int, ids: Sequence[str]) -> Dict[str, Dict]:
+        found = {}
+        with self._lock:
+            for chunk_id in ids:
+                doc = self._items.get((collection_name, version, chunk_id))
+                if doc is not None:
+                    self._items.move_to_end((collection_name, version, chunk_id))
+                    found[chunk_id] = doc
+        return found
+
+    def put_many(self, collection_name: str, version: int, docs: Sequence[Dict]) -> None:
+        with self._lock:
+            for doc in docs:
+                key = (collection_name, version, doc["id"])
+                self._items[key] = doc
+                self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+
+chunk_cache = ChunkCache()
@@ -1,4 +1,3 @@
-import pickle
 import time
 
 import pandas as pd
@@ -8,6 +7,8 @@ from sqlalchemy import create_engine, text
 from config import settings
 from context_engine.master_db_description import FACT_DOANH_THU_DESCRIPTION
 from database.redis_connection import r
+from database.dataset_partitions import dataset_exists, get_dataset, store_dataset
+from processing.dataset_selector import MASTER_DESCRIPTIONS_VERSION_KEY
 
 
 DB_ENGINE = create_engine(
@@ -180,9 +181,9 @@ def sql_query_builder(collection_name, table_name, data, save_master=True):
         full_path=table_name,
         type="db"
     )
-    cached_result_bytes = r.get(redis_key)
-    if not cached_result_bytes:
-        r.set(redis_key, pickle.dumps(data), ex=settings.REDIS_EXPIRE_TIME)
+    # Large fact tables are stored as NAM/THANG x column-group partitions (Redis caps a value at 512 MB)
+    if not dataset_exists(redis_key):
+        store_dataset(redis_key, data, ex=settings.REDIS_EXPIRE_TIME)
 
     if save_master:
         master_description = settings.MASTER_DESCRIPTION_DEFINE.format(
@@ -191,7 +192,11 @@ def sql_query_builder(collection_name, table_name, data, save_master=True):
             full_path=table_name,
             description=FACT_DOANH_THU_DESCRIPTION
         )
-        r.rpush(settings.LIST_MASTER_DATA_DESCRIPTION, master_description)
+        # Runs from sync scripts (sync client); the append and the version bump share one MULTI
+        pipe = r.pipeline(transaction=True)
+        pipe.rpush(settings.LIST_MASTER_DATA_DESCRIPTION, master_description)
+        pipe.incr(MASTER_DESCRIPTIONS_VERSION_KEY)
+        pipe.execute()
 
     return
 
@@ -202,10 +207,9 @@ def load_and_cache_database_server(collection_name, table_name, save_master) ->
         type="db"
     )
     print("We go to redis key: ", redis_key)
-    cached_result_bytes = r.get(redis_key)
+    result = get_dataset(redis_key)
 
-    if cached_result_bytes:
-        result = pickle.loads(cached_result_bytes)
+    if result is not None:
         print(f"Cache hit for key: {redis_key}. Loading data from Redis cache.")
         result[:1000].to_excel('dimnhanvien.xlsx', index=False, sheet_name='Synced Data')
         # master_description = settings.MASTER_DESCRIPTION_DEFINE.format(
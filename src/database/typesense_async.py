@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import random
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class TypesenseServerError(Exception):
+    """5xx response from a Typesense node; retried on the next node."""
+    pass
+
+
+class AsyncTypesenseClient:
+    """
+    Asyncio Typesense client for the request path.
+
+    - One pooled httpx.AsyncClient with keep-alive connections shared by all requests.
+    - Several nodes, tried round-robin; a failing node is skipped for the next attempt.
+    - Transport errors and 5xx responses are retried with exponential backoff and full jitter.
+    - `multi_search_many` runs independent multi_search calls concurrently.
+
+    The synchronous TypesenseClient stays in place for admin and ingestion scripts.
+    """
+
+    def __init__(
+            self,
+            nodes: List[Dict[str, Any]],
+            api_key: str,
+            connection_timeout_seconds: float = 10,
+            retry_interval_seconds: float = 0.1,
+            num_retries: int = 3,
+            max_connections: int = 100,
+            max_keepalive_connections: int = 20
+    ):
+        if not nodes:
+            raise ValueError("AsyncTypesenseClient cần ít nhất một node")
+        self.node_urls = [f"{node.get('protocol', 'http')}://{node['host']}:{node['port']}" for node in nodes]
+        self.retry_interval_seconds = retry_interval_seconds
+        self.num_retries = num_retries
+        self._next_node = 0
+        self._client = httpx.AsyncClient(
+            headers={"X-TYPESENSE-API-KEY": api_key},
+            timeout=httpx.Timeout(connection_timeout_seconds),
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_keepalive_connections)
+        )
+
+    async def _request(self, method: str, path: str, params: Optional[Dict[str, Any]] = None,
+                       json: Optional[Dict[str, Any]] = None) -> Any:
+        last_error: Optional[Exception] = None
+        for attempt in range(self.num_retries + 1):
+            node_index = (self._next_node + attempt) % len(self.node_urls)
+            url = f"{self.node_urls[node_index]}{path}"
+            try:
+                response = await self._client.request(method, url, params=params, json=json)
+                if response.status_code >= 500:
+                    raise TypesenseServerError(f"{response.status_code}: {response.text}")
+                response.raise_for_status()
+                self._next_node = (node_index + 1) % len(self.node_urls)
+                return response.json()
+            except (httpx.TransportError, TypesenseServerError) as e:
+                last_error = e
+                logger.warning(f"Typesense {method} {path} thất bại trên {self.node_urls[node_index]} "
+                               f"(lần {attempt + 1}/{self.num_retries + 1}): {e}")
+                if attempt < self.num_retries:
+                    backoff = self.retry_interval_seconds * (2 ** attempt)
+                    await asyncio.sleep(random.uniform(0, backoff))
+        raise ConnectionError(f"Không thể kết nối đến server Typesense: {last_error}")
+
+    async def search(self, collection_name: str, search_parameters: Dict[str, Any]) -> Dict[str, Any]:
+        """documents/search trên một collection (GET, dùng cho truy vấn ngắn không có vector)."""
+        return await self._request("GET", f"/collections/{collection_name}/documents/search",
+                                   params=search_parameters)
+
+    async def retrieve_document(self, collection_name: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """Lấy một document theo id; trả về None nếu không tồn tại."""
+        try:
+            return await self._request("GET", f"/collections/{collection_name}/documents/{document_id}")
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 404:
+                return None
+            raise
+
+    async def multi_search(self, queries: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Thực hiện multi search (POST, nên vector_query dài không bị giới hạn URL).
+        Giống TypesenseClient.multi_search: trả về {"error": ...} khi thất bại.
+        """
+        try:
+            return await self._request("POST", "/multi_search", json=queries)
+        except Exception as e:
+            logger.error(f"Lỗi khi thực hiện multi search: {e}")
+            return {"error": str(e)}
+
+    async def multi_search_many(self, queries_list: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Chạy nhiều multi_search độc lập song song."""
+        return list(await asyncio.gather(*(self.multi_search(queries) for queries in queries_list)))
+
+    async def health(self) -> bool:
+        try:
+            result = await self._request("GET", "/health")
+            return bool(result.get("ok"))
+        except Exception:
+            return False
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_async_typesense_client_instance: Optional[AsyncTypesenseClient] = None
+
+
+def get_async_typesense_instance_service() -> AsyncTypesenseClient:
+    """
+    Returns the singleton instance of the AsyncTypesenseClient.
+    Uses TYPESENSE_NODES (list of {host, port, protocol}) when configured,
+    otherwise the single TYPESENSE_HOST / TYPESENSE_PORT node.
+    """
+    global _async_typesense_client_instance
+    if _async_typesense_client_instance is None:
+        nodes = getattr(settings, "TYPESENSE_NODES", None) or [{
+            "host": settings.TYPESENSE_HOST,
+            "port": settings.TYPESENSE_PORT,
+            "protocol": settings.TYPESENSE_PROTOCOL
+        }]
+        _async_typesense_client_instance = AsyncTypesenseClient(
+            nodes=nodes,
+            api_key=settings.TYPESENSE_API_KEY,
+            max_connections=getattr(settings, "TYPESENSE_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=getattr(settings, "TYPESENSE_MAX_KEEPALIVE_CONNECTIONS", 20)
+        )
+    return _async_typesense_client_instance
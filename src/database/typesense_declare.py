@@ -1,3 +1,5 @@
+import hashlib
+import json
 import os
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
@@ -13,10 +15,17 @@ import uuid
 import random
 import string
 from config import settings
+from database.vector_profile import encode_vector_query
+from database.redis_connection import r
+from database.search_cache import bump_collection_version
+from database.local_vector_index import LocalVectorIndex, get_local_index_service
 
 
 logger = logging.getLogger(__name__)
 
+# Một document cho mỗi file đã upload (của mọi chatbot), để liệt kê/xóa không phải quét chunk
+DOCUMENT_CATALOG_COLLECTION = "document_catalog"
+
 
 class TypesenseClient:
     def __init__(
@@ -69,18 +78,22 @@ class TypesenseClient:
         raise ConnectionError("Không thể kết nối đến server Typesense")
 
     # -------- Schema cho collection tài liệu của chatbot --------
-    def _get_document_schema(self, chatbot_name: str) -> Dict[str, Any]:
+    def _get_document_schema(self, chatbot_name: str, embedding_dim: int = None) -> Dict[str, Any]:
+        # embedding_dim cho phép collection dùng vector đã nén (xem database/vector_profile.py)
+        embedding_dim = embedding_dim or self.embedding_dim
         schema = {
             "name": chatbot_name,
             "fields": [
                 {"name": "id", "type": "string"},
+                {"name": "doc_uuid", "type": "string", "facet": True},
                 {"name": "title", "type": "string"},
                 {"name": "text", "type": "string"},
                 {"name": "page_num", "type": "int32"},
                 {"name": "chunk_num", "type": "int32"},
                 {"name": "start_index", "type": "int32"},
                 {"name": "end_index", "type": "int32"},
-                {"name": "embedding", "type": "float[]", "num_dim": self.embedding_dim}
+                {"name": "content_hash", "type": "string", "optional": True, "index": False},
+                {"name": "embedding", "type": "float[]", "num_dim": embedding_dim}
             ]
         }
         return schema
@@ -98,6 +111,25 @@ class TypesenseClient:
         }
         return schema
 
+    # -------- Schema cho catalog tài liệu --------
+    def _get_document_catalog_schema(self) -> Dict[str, Any]:
+        schema = {
+            "name": DOCUMENT_CATALOG_COLLECTION,
+            "fields": [
+                {"name": "chatbot_name", "type": "string", "facet": True},
+                {"name": "doc_uuid", "type": "string"},
+                {"name": "title", "type": "string"},
+                {"name": "file_type", "type": "string", "facet": True},
+                {"name": "page_count", "type": "int32"},
+                {"name": "chunk_count", "type": "int32"},
+                {"name": "content_hash", "type": "string", "optional": True},
+                {"name": "uploaded_at", "type": "int64"},
+                {"name": "status", "type": "string", "facet": True}
+            ],
+            "default_sorting_field": "uploaded_at"
+        }
+        return schema
+
     def _collection_exists(self, collection_name: str) -> bool:
         try:
             collections = self.client.collections.retrieve()
@@ -106,6 +138,13 @@ class TypesenseClient:
             logger.error(f"Lỗi khi kiểm tra sự tồn tại của collection '{collection_name}': {e}")
             return False
 
+    def resolve_collection(self, chatbot_name: str) -> str:
+        """Tên collection vật lý đứng sau alias chatbot_name (hoặc chính chatbot_name nếu không phải alias)."""
+        try:
+            return self.client.aliases[chatbot_name].retrieve()["collection_name"]
+        except Exception:
+            return chatbot_name
+
     def _generate_random_api_key(self, length: int = 32) -> str:
         """Tạo một API key ngẫu nhiên."""
         characters = string.ascii_letters + string.digits
@@ -138,11 +177,19 @@ class TypesenseClient:
             # Nếu có lỗi, trả về uuid
             return str(uuid.uuid4())
 
+    def _notify_chatbot_info_changed(self, chatbot_name: str) -> None:
+        """Báo cho các worker (qua Redis pub/sub) rằng 'chatbot_info' đã thay đổi để làm mới cache API key."""
+        try:
+            r.publish("chatbot_info_changed", chatbot_name)
+        except Exception as e:
+            logger.warning(f"Không thể gửi thông báo thay đổi chatbot '{chatbot_name}': {e}")
+
     # --------------- Chatbot operations ---------------
     def create_chatbot(self, chatbot_name: str, description: str) -> Dict[str, Any]:
         """
         Tạo chatbot mới:
-          - Tạo collection tài liệu với tên chatbot_name.
+          - Tạo collection tài liệu "<chatbot_name>__<timestamp>" phục vụ qua alias chatbot_name,
+            để compress_collection có thể đổi collection mà không gián đoạn truy vấn.
           - Đảm bảo collection 'chatbot_info' tồn tại.
           - Thêm document vào 'chatbot_info' chứa thông tin của chatbot.
         """
@@ -158,16 +205,18 @@ class TypesenseClient:
                 logger.error(f"Lỗi khi tạo collection 'chatbot_info': {e}")
                 raise
 
-        # Tạo collection tài liệu cho chatbot
-        doc_schema = self._get_document_schema(chatbot_name)
-        try:
-            self.client.collections.create(doc_schema)
-            logger.info(f"Tạo collection tài liệu '{chatbot_name}' thành công")
-        except typesense.exceptions.ObjectAlreadyExists:
+        # Tạo collection tài liệu cho chatbot (sau alias chatbot_name)
+        if self.resolve_collection(chatbot_name) != chatbot_name or self._collection_exists(chatbot_name):
             logger.info(f"Collection tài liệu '{chatbot_name}' đã tồn tại")
-        except Exception as e:
-            logger.error(f"Lỗi khi tạo collection tài liệu '{chatbot_name}': {e}")
-            raise
+        else:
+            physical_name = f"{chatbot_name}__{int(time.time())}"
+            try:
+                self.client.collections.create(self._get_document_schema(physical_name))
+                self.client.aliases.upsert(chatbot_name, {"collection_name": physical_name})
+                logger.info(f"Tạo collection tài liệu '{physical_name}' (alias '{chatbot_name}') thành công")
+            except Exception as e:
+                logger.error(f"Lỗi khi tạo collection tài liệu '{chatbot_name}': {e}")
+                raise
 
         # Lấy chatbot id mới (số tăng dần)
         chatbot_id = self._get_next_chatbot_id()
@@ -183,6 +232,7 @@ class TypesenseClient:
         try:
             self.client.collections["chatbot_info"].documents.create(chatbot_meta)
             logger.info(f"Đã index thông tin chatbot '{chatbot_name}' vào 'chatbot_info'")
+            self._notify_chatbot_info_changed(chatbot_name)
         except typesense.exceptions.ObjectAlreadyExists:
             logger.info(f"Thông tin chatbot '{chatbot_name}' đã tồn tại trong 'chatbot_info'")
         except Exception as e:
@@ -225,6 +275,7 @@ class TypesenseClient:
                 doc_id = result["hits"][0]["document"]["id"]
                 updated_doc = self.client.collections["chatbot_info"].documents[doc_id].update(update_data)
                 logger.info(f"Cập nhật thông tin chatbot '{chatbot_name}' thành công")
+                self._notify_chatbot_info_changed(chatbot_name)
                 return updated_doc
             else:
                 return {"error": f"Không tìm thấy chatbot '{chatbot_name}' để cập nhật"}
@@ -239,11 +290,25 @@ class TypesenseClient:
         responses = {}
         # Xóa collection tài liệu của chatbot
         try:
-            responses["documents_collection"] = self.client.collections[chatbot_name].delete()
+            # Collection nén được phục vụ qua alias trùng tên chatbot (xem database/vector_profile.py)
+            try:
+                target = self.client.aliases[chatbot_name].retrieve()["collection_name"]
+            except Exception:
+                target = None
+            responses["documents_collection"] = self.client.collections[target or chatbot_name].delete()
+            if target:
+                self.client.aliases[chatbot_name].delete()
+            bump_collection_version(chatbot_name)
             logger.info(f"Xóa collection tài liệu '{chatbot_name}' thành công")
         except Exception as e:
             logger.error(f"Lỗi khi xóa collection tài liệu '{chatbot_name}': {e}")
             responses["documents_collection_error"] = str(e)
+        # Xóa các entry của chatbot trong catalog tài liệu
+        try:
+            self.client.collections[DOCUMENT_CATALOG_COLLECTION].documents.delete(
+                {"filter_by": f"chatbot_name:=`{chatbot_name}`"})
+        except Exception as e:
+            logger.warning(f"Không thể xóa catalog tài liệu của '{chatbot_name}': {e}")
         # Xóa document meta trong 'chatbot_info'
         try:
             result = self.client.collections["chatbot_info"].documents.search({
@@ -255,6 +320,7 @@ class TypesenseClient:
                 doc_id = result["hits"][0]["document"]["id"]
                 responses["chatbot_info"] = self.client.collections["chatbot_info"].documents[doc_id].delete()
                 logger.info(f"Xóa thông tin chatbot '{chatbot_name}' khỏi 'chatbot_info' thành công")
+                self._notify_chatbot_info_changed(chatbot_name)
             else:
                 responses["chatbot_info_error"] = f"Không tìm thấy chatbot '{chatbot_name}' trong 'chatbot_info'"
         except Exception as e:
@@ -274,6 +340,23 @@ class TypesenseClient:
         return meta
 
     # --------------- Document operations ---------------
+    # Mọi thao tác ghi vào collection tài liệu đều tăng version của collection
+    # để cache kết quả vector search (database/search_cache.py) không trả về dữ liệu cũ.
+    def import_documents(self, chatbot_name: str, documents: List[Dict[str, Any]],
+                         params: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """Import (mặc định upsert) một batch document vào collection tài liệu của chatbot."""
+        try:
+            return self.client.collections[chatbot_name].documents.import_(documents, params or {"action": "upsert"})
+        finally:
+            bump_collection_version(chatbot_name)
+
+    def delete_documents(self, chatbot_name: str, filter_by: str) -> Dict[str, Any]:
+        """Xóa hàng loạt document theo filter_by."""
+        try:
+            return self.client.collections[chatbot_name].documents.delete({"filter_by": filter_by})
+        finally:
+            bump_collection_version(chatbot_name)
+
     def add_document(self, chatbot_name: str, document: Dict[str, Any]) -> Dict[str, Any]:
         """
         Thêm document vào collection tài liệu của chatbot.
@@ -283,6 +366,7 @@ class TypesenseClient:
             raise ValueError("Document là bắt buộc")
         try:
             response = self.client.collections[chatbot_name].documents.create(document)
+            bump_collection_version(chatbot_name)
             logger.info(f"Thêm document vào '{chatbot_name}' thành công")
             return response
         except Exception as e:
@@ -306,12 +390,84 @@ class TypesenseClient:
         """
         try:
             updated_doc = self.client.collections[chatbot_name].documents[document_id].update(update_data)
+            bump_collection_version(chatbot_name)
             logger.info(f"Cập nhật document '{document_id}' trong '{chatbot_name}' thành công")
             return updated_doc
         except Exception as e:
             logger.error(f"Lỗi khi cập nhật document '{document_id}' trong '{chatbot_name}': {e}")
             return {"error": str(e)}
 
+    # --------------- Catalog tài liệu ---------------
+    def _ensure_document_catalog(self) -> None:
+        if getattr(self, "_document_catalog_ready", False):
+            return
+        if not self._collection_exists(DOCUMENT_CATALOG_COLLECTION):
+            try:
+                self.client.collections.create(self._get_document_catalog_schema())
+                logger.info(f"Tạo collection '{DOCUMENT_CATALOG_COLLECTION}' thành công")
+            except typesense.exceptions.ObjectAlreadyExists:
+                pass
+        self._document_catalog_ready = True
+
+    @staticmethod
+    def _catalog_entry_id(chatbot_name: str, doc_uuid: str) -> str:
+        return hashlib.sha1(f"{chatbot_name}/{doc_uuid}".encode("utf-8")).hexdigest()
+
+    def upsert_catalog_entry(self, chatbot_name: str, doc_uuid: str, title: str, file_type: str,
+                             page_count: int = 0, chunk_count: int = 0, content_hash: str = None,
+                             status: str = "ready", uploaded_at: int = None) -> Dict[str, Any]:
+        """
+        Ghi (tạo hoặc thay thế) entry của một file trong catalog tài liệu.
+        status: "indexing" | "ready" | "failed".
+        """
+        self._ensure_document_catalog()
+        entry = {
+            "id": self._catalog_entry_id(chatbot_name, doc_uuid),
+            "chatbot_name": chatbot_name,
+            "doc_uuid": doc_uuid,
+            "title": title,
+            "file_type": file_type,
+            "page_count": page_count,
+            "chunk_count": chunk_count,
+            "uploaded_at": uploaded_at or int(time.time()),
+            "status": status
+        }
+        if content_hash:
+            entry["content_hash"] = content_hash
+        return self.client.collections[DOCUMENT_CATALOG_COLLECTION].documents.upsert(entry)
+
+    def find_catalog_entries(self, chatbot_name: str, title: str = None) -> List[Dict[str, Any]]:
+        """Các entry catalog của chatbot (lọc theo title nếu có)."""
+        self._ensure_document_catalog()
+        filter_by = f"chatbot_name:=`{chatbot_name}`"
+        if title is not None:
+            filter_by += f" && title:=`{title.replace('`', '')}`"
+        entries = []
+        page = 1
+        while True:
+            result = self.client.collections[DOCUMENT_CATALOG_COLLECTION].documents.search({
+                "q": "*", "filter_by": filter_by, "per_page": 250, "page": page
+            })
+            hits = result.get("hits", [])
+            entries.extend(hit["document"] for hit in hits)
+            if len(hits) < 250:
+                return entries
+            page += 1
+
+    def delete_catalog_entry(self, chatbot_name: str, doc_uuid: str) -> None:
+        try:
+            self.client.collections[DOCUMENT_CATALOG_COLLECTION].documents[
+                self._catalog_entry_id(chatbot_name, doc_uuid)].delete()
+        except typesense.exceptions.ObjectNotFound:
+            pass
+
+    def delete_document_by_id(self, chatbot_name: str, doc_uuid: str) -> Dict[str, Any]:
+        """Xóa toàn bộ chunk của một tài liệu bằng một lệnh delete theo doc_uuid, rồi xóa entry catalog."""
+        result = self.delete_documents(chatbot_name, f"doc_uuid:=`{doc_uuid}`")
+        self.delete_catalog_entry(chatbot_name, doc_uuid)
+        logger.info(f"Đã xóa {result.get('num_deleted', 0)} chunk của tài liệu '{doc_uuid}' từ '{chatbot_name}'")
+        return {"status": "success", "doc_uuid": doc_uuid, "num_deleted": result.get("num_deleted", 0)}
+
     def delete_document(self, chatbot_name: str, document_title: str):
         """
         Xóa tất cả document từ collection dựa vào title
@@ -324,104 +480,85 @@ class TypesenseClient:
             Kết quả xóa document
         """
         try:
-            # Kiểm tra collection có tồn tại không
-            try:
-                self.client.collections[chatbot_name].retrieve()
-            except Exception as e:
-                logger.error(f"Collection '{chatbot_name}' không tồn tại: {e}")
-                raise Exception(f"Collection '{chatbot_name}' không tồn tại: {e}")
-
-            # Thử sử dụng batch delete nếu API hỗ trợ
-            try:
-                delete_query = {
-                    "filter_by": f"title:={document_title}"
-                }
-                batch_delete_result = self.client.collections[chatbot_name].documents.delete(delete_query)
-                logger.info(
-                    f"Đã xóa tất cả document với title='{document_title}' từ collection '{chatbot_name}' bằng batch delete")
-                return {
-                    "status": "success",
-                    "message": f"Đã xóa tất cả document với title='{document_title}' từ chatbot '{chatbot_name}'",
-                    "result": batch_delete_result
-                }
-            except Exception as batch_err:
-                # Batch delete không hoạt động, chuyển sang phương pháp 2 sử dụng phân trang
-                logger.info(f"Batch delete không thành công ({batch_err}), chuyển sang phương pháp phân trang")
-
-                total_deleted = 0
-                all_deleted_docs = []
-
-                # Tìm tổng số document cần xóa (chỉ cần lấy thông tin, không cần kết quả chi tiết)
-                count_params = {
-                    "q": "*",
-                    "filter_by": f"title:={document_title}",
-                    "per_page": 0  # Chỉ lấy tổng số, không lấy kết quả
-                }
-                count_results = self.client.collections[chatbot_name].documents.search(count_params)
-                total_to_delete = count_results["found"]
-
-                if total_to_delete == 0:
-                    logger.warning(
-                        f"Không tìm thấy document nào với title '{document_title}' trong collection '{chatbot_name}'")
-                    return {
-                        "status": "error",
-                        "message": f"Không tìm thấy document nào với title '{document_title}' trong collection '{chatbot_name}'"
-                    }
-
-                # Lấy và xóa document theo từng trang (tối đa 250 mỗi trang)
-                page = 1
-                per_page = 250  # Giới hạn của Typesense
-
-                while total_deleted < total_to_delete:
-                    search_parameters = {
-                        "q": "*",
-                        "filter_by": f"title:={document_title}",
-                        "per_page": per_page,
-                        "page": page
-                    }
-
-                    search_results = self.client.collections[chatbot_name].documents.search(search_parameters)
-
-                    if len(search_results["hits"]) == 0:
-                        break  # Không còn document nào
-
-                    # Xóa từng document trong trang hiện tại
-                    batch_result = []
-                    for hit in search_results["hits"]:
-                        doc_id = hit["document"]["id"]
-                        try:
-                            delete_result = self.client.collections[chatbot_name].documents[doc_id].delete()
-                            batch_result.append(delete_result)
-                            total_deleted += 1
-                        except Exception as del_err:
-                            logger.error(f"Lỗi khi xóa document id={doc_id}: {del_err}")
-
-                    all_deleted_docs.extend(batch_result)
-                    logger.info(
-                        f"Đã xóa {len(batch_result)} document trong trang {page}, tổng số đã xóa: {total_deleted}/{total_to_delete}")
-
-                    # Không tăng page number vì chúng ta luôn lấy trang đầu tiên
-                    # (sau khi xóa trang 1, trang 2 trở thành trang 1 mới)
-
-                # Kiểm tra lại sau khi xóa
-                final_check = self.client.collections[chatbot_name].documents.search(count_params)
-                remaining = final_check["found"]
-
-                if remaining > 0:
-                    logger.warning(f"Vẫn còn {remaining} document với title='{document_title}' sau khi xóa")
-
-                return {
-                    "status": "success",
-                    "message": f"Đã xóa {total_deleted} document với title='{document_title}' từ chatbot '{chatbot_name}'",
-                    "result": {
-                        "deleted_count": total_deleted,
-                        "remaining": remaining
-                    }
-                }
+            entries = self.find_catalog_entries(chatbot_name, document_title)
+            if entries:
+                results = [self.delete_document_by_id(chatbot_name, entry["doc_uuid"]) for entry in entries]
+                num_deleted = sum(result["num_deleted"] for result in results)
+            else:
+                # Tài liệu index trước khi có catalog: xóa theo title
+                result = self.delete_documents(chatbot_name, f"title:=`{document_title.replace('`', '')}`")
+                num_deleted = result.get("num_deleted", 0)
+            logger.info(f"Đã xóa {num_deleted} chunk với title='{document_title}' từ collection '{chatbot_name}'")
+            return {
+                "status": "success",
+                "message": f"Đã xóa tất cả document với title='{document_title}' từ chatbot '{chatbot_name}'",
+                "result": {"deleted_count": num_deleted}
+            }
         except Exception as e:
             logger.error(f"Lỗi khi xóa document '{document_title}' từ '{chatbot_name}': {e}")
             raise
 
+    def rebuild_document_catalog(self, chatbot_name: str) -> Dict[str, Any]:
+        """
+        Dựng lại catalog của chatbot từ các chunk đã index và các file trong UPLOAD_DIR
+        (dùng một lần cho dữ liệu có trước catalog).
+        """
+        documents = {}
+        exported = self.client.collections[chatbot_name].documents.export(
+            {"include_fields": "id,doc_uuid,title,page_num"})
+        for line in exported.splitlines():
+            if not line.strip():
+                continue
+            chunk = json.loads(line)
+            doc_uuid = chunk.get("doc_uuid") or chunk["id"].rsplit("_", 2)[0]
+            entry = documents.setdefault(doc_uuid, {"title": chunk.get("title", ""), "pages": set(), "chunks": 0})
+            entry["pages"].add(chunk.get("page_num"))
+            entry["chunks"] += 1
+
+        for doc_uuid, entry in documents.items():
+            self.upsert_catalog_entry(chatbot_name, doc_uuid, entry["title"], "pdf",
+                                      page_count=len(entry["pages"]), chunk_count=entry["chunks"])
+
+        upload_dir = os.path.join(settings.UPLOAD_DIR, chatbot_name)
+        files = os.listdir(upload_dir) if os.path.isdir(upload_dir) else []
+        for file_name in files:
+            file_type = "excel" if file_name.lower().endswith((".xlsx", ".xls")) else "file"
+            self.upsert_catalog_entry(chatbot_name, file_name, file_name, file_type,
+                                      uploaded_at=int(os.path.getmtime(os.path.join(upload_dir, file_name))))
+        logger.info(f"Đã dựng lại catalog của '{chatbot_name}': {len(documents)} tài liệu, {len(files)} file")
+        return {"collection": chatbot_name, "documents": len(documents), "files": len(files)}
+
+    def migrate_document_schema(self, chatbot_name: str, batch_size: int = 250) -> Dict[str, Any]:
+        """
+        Chuyển collection tài liệu theo schema cũ (chỉ có id dạng "{uuid}_{page}_{chunk}")
+        sang schema mới có field `doc_uuid` để lọc theo tài liệu/trang bằng filter_by.
+        """
+        collection = self.client.collections[self.resolve_collection(chatbot_name)]
+        existing_fields = {field["name"] for field in collection.retrieve().get("fields", [])}
+        if "doc_uuid" not in existing_fields:
+            collection.update({"fields": [{"name": "doc_uuid", "type": "string", "facet": True, "optional": True}]})
+            logger.info(f"Đã thêm field 'doc_uuid' vào collection '{chatbot_name}'")
+
+        exported = collection.documents.export({"include_fields": "id,doc_uuid"})
+        updates = []
+        skipped = 0
+        for line in exported.splitlines():
+            if not line.strip():
+                continue
+            doc = json.loads(line)
+            if doc.get("doc_uuid"):
+                continue
+            parts = doc["id"].rsplit("_", 2)
+            if len(parts) != 3:
+                skipped += 1
+                continue
+            updates.append({"id": doc["id"], "doc_uuid": parts[0]})
+
+        for i in range(0, len(updates), batch_size):
+            self.import_documents(chatbot_name, updates[i:i + batch_size], {"action": "update"})
+        logger.info(f"Đã migrate {len(updates)} chunk trong '{chatbot_name}' (bỏ qua {skipped} id không hợp lệ)")
+        return {"collection": chatbot_name, "migrated": len(updates), "skipped": skipped}
+
     # --------------- Search operations ---------------
     def search_documents(self, chatbot_name: str, query: str, limit: int = 10) -> Dict[str, Any]:
         """
@@ -442,7 +579,7 @@ class TypesenseClient:
         """
         Tìm kiếm theo vector embedding trong field 'embedding' của collection tài liệu.
         """
-        vector_str = ",".join(str(x) for x in vector)
+        vector_str = encode_vector_query(vector)
         try:
             result = self.client.collections[chatbot_name].documents.search({
                 "q": "*",
@@ -452,13 +589,17 @@ class TypesenseClient:
             return result
         except Exception as e:
             logger.error(f"Lỗi khi tìm kiếm vector trong '{chatbot_name}': {e}")
+            # Typesense lỗi: trả lời từ index cục bộ nếu collection có index
+            local_index = get_local_index_service().fallback_index(chatbot_name)
+            if local_index is not None:
+                return local_index.vector_search(chatbot_name, vector, limit)
             return {"error": str(e)}
 
     def hybrid_search(self, chatbot_name: str, query: str, vector: List[float], limit: int = 10) -> Dict[str, Any]:
         """
         Thực hiện hybrid search: kết hợp full-text search trên 'text' và vector search trên 'embedding'.
         """
-        vector_str = ",".join(str(x) for x in vector)
+        vector_str = encode_vector_query(vector)
         try:
             result = self.client.collections[chatbot_name].documents.search({
                 "q": query,
@@ -510,7 +651,9 @@ if __name__ == "__main__":
     parser.add_argument("--protocol", default="http", help="HTTP protocol")
     parser.add_argument("--api-key", default="avision", help="API key")
     parser.add_argument("--chatbot", required=True, help="Tên của chatbot")
-    parser.add_argument("--action", choices=["create", "delete", "info", "update", "ensure_master"], default="create",
+    parser.add_argument("--action", choices=["create", "delete", "info", "update", "ensure_master", "compress",
+                                             "migrate_schema", "rebuild_catalog", "build_local_index"],
+                        default="create",
                         help="Hành động cần thực hiện")
     parser.add_argument("--dim", type=int, default=1024, help="Kích thước embedding")
     parser.add_argument("--description", default="", help="Mô tả của chatbot")
@@ -522,6 +665,10 @@ if __name__ == "__main__":
     parser.add_argument("--chunk_num", type=int, default=0, help="Thứ tự chunk")
     parser.add_argument("--start_index", type=int, default=0, help="Index bắt đầu")
     parser.add_argument("--end_index", type=int, default=0, help="Index kết thúc")
+    # Các tham số cho action "compress" (xem database/vector_profile.py)
+    parser.add_argument("--compress_method", choices=["none", "truncate", "pca"], default="pca",
+                        help="Cách giảm chiều vector")
+    parser.add_argument("--compress_dim", type=int, default=384, help="Số chiều vector sau khi nén")
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
 
@@ -548,4 +695,20 @@ if __name__ == "__main__":
         print(f"Deleted chatbot: {result}")
     elif args.action == "ensure_master":
         result = client.create_collection_if_not_exists()
-        print(f"Ensured chatbot_master exists: {result}")
\ No newline at end of file
+        print(f"Ensured chatbot_master exists: {result}")
+    elif args.action == "compress":
+        from database.vector_profile import compress_collection
+        result = compress_collection(client, args.chatbot, method=args.compress_method, dim=args.compress_dim)
+        if result.get("unavailable_ms") is not None:
+            print(f"Note: '{args.chatbot}' was a plain collection; it answered no queries for "
+                  f"{result['unavailable_ms']:.0f} ms while it was replaced by an alias")
+        print(f"Compressed chatbot collection: {result}")
+    elif args.action == "migrate_schema":
+        result = client.migrate_document_schema(args.chatbot)
+        print(f"Migrated document schema: {result}")
+    elif args.action == "rebuild_catalog":
+        result = client.rebuild_document_catalog(args.chatbot)
+        print(f"Rebuilt document catalog: {result}")
+    elif args.action == "build_local_index":
+        index = LocalVectorIndex.build(client, args.chatbot)
+        print(f"Built local vector index: {index.size} chunks, version {index.version}")
@@ -1,41 +1,287 @@
 import logging
 from typing import List, Dict, Any
-from .typesense_declare import TypesenseClient
+
+import httpx
+
+from .typesense_async import AsyncTypesenseClient
+from .typesense_declare import DOCUMENT_CATALOG_COLLECTION
+from .search_cache import SEARCH_CACHE_ENABLED, aget_cached_hits, aget_collection_version, aput_cached_hits, \
+    chunk_cache, search_cache_key
+from .local_vector_index import get_local_index_service
+from .vector_profile import encode_vector_query
 
 logger = logging.getLogger(__name__)
 
-def get_document_safe(doc_id: str, typesense_client: TypesenseClient, collection_name: str) -> Dict:
+async def get_document_safe(doc_id: str, typesense_client: AsyncTypesenseClient, collection_name: str) -> Dict:
     try:
-        doc = typesense_client.client.collections[collection_name].documents[doc_id].retrieve()
+        doc = await typesense_client.retrieve_document(collection_name, doc_id)
         return doc
     except Exception as e:
         logger.warning(f"Error retrieving document {doc_id}: {e}")
         return None
 
-def get_all_chunks_of_page(uuid, page, typesense_client=None, found_collection=None):
+async def get_all_chunks_of_page(uuid, page, typesense_client=None, found_collection=None):
     chunk_index = 0
     chunks = []
     while True:
         chunk_id = f"{uuid}_{page}_{chunk_index}"
-        chunk_doc = get_document_safe(chunk_id, typesense_client, found_collection)
+        chunk_doc = await get_document_safe(chunk_id, typesense_client, found_collection)
         if not chunk_doc:
             break
         chunks.append(chunk_doc.get("text", ""))
         chunk_index += 1
     return chunks
 
-def perform_vector_search(collection_name: str, query_embedding: List[float], top_k: int, typesense_client: TypesenseClient) -> List[Dict]:
-    """Performs a vector search using the Typesense client."""
+async def get_chunks_of_page_window(doc_uuid: str, page_num: int, window: int, typesense_client: AsyncTypesenseClient,
+                                    collection_name: str, per_page: int = 250) -> List[Dict]:
+    """
+    Fetches every chunk of pages [page_num - window, page_num + window] of one document
+    with a single filtered search, ordered by (page_num, chunk_num).
+    Each returned chunk carries its `text` and stored `embedding`.
+    """
+    first_page = max(page_num - window, 0)
+    last_page = page_num + window
+    search_parameters = {
+        "q": "*",
+        "filter_by": f"doc_uuid:=`{doc_uuid}` && page_num:[{first_page}..{last_page}]",
+        "sort_by": "page_num:asc,chunk_num:asc",
+        "include_fields": "id,text,page_num,chunk_num,embedding",
+        "per_page": per_page,
+        "page": 1
+    }
+    chunks = []
+    while True:
+        result = await typesense_client.search(collection_name, search_parameters)
+        hits = result.get("hits", [])
+        chunks.extend(hit["document"] for hit in hits)
+        if len(hits) < per_page or len(chunks) >= result.get("found", 0):
+            return chunks
+        search_parameters["page"] += 1
+
+
+async def get_chunk_embeddings(chunk_ids: List[str], typesense_client: AsyncTypesenseClient,
+                               collection_name: str) -> Dict[str, List[float]]:
+    """Fetches the stored embeddings of several chunks with one filtered search."""
+    if not chunk_ids:
+        return {}
+    result = await typesense_client.search(collection_name, {
+        "q": "*",
+        "filter_by": f"id:[{','.join(f'`{chunk_id}`' for chunk_id in chunk_ids)}]",
+        "include_fields": "id,embedding",
+        "per_page": len(chunk_ids)
+    })
+    return {hit["document"]["id"]: hit["document"]["embedding"]
+            for hit in result.get("hits", []) if "embedding" in hit["document"]}
+
+
+SEARCH_INCLUDE_FIELDS = "id,doc_uuid,text,title,page_num,chunk_num"
+
+
+async def _vector_search_uncached(collection_name: str, query_embedding: List[float], top_k: int,
+                                  typesense_client: AsyncTypesenseClient) -> Dict:
+    search_requests = {
+        "searches": [
+            {
+                "collection": collection_name,
+                "q": "*",
+                "vector_query": f"embedding:([{encode_vector_query(query_embedding)}], k:{top_k * 5})",
+                # The top_k nearest (the local index returns the same)
+                "per_page": min(top_k, 250),
+                "include_fields": SEARCH_INCLUDE_FIELDS
+            }
+        ]
+    }
+    return await typesense_client.multi_search(search_requests)
+
+
+async def perform_vector_search(collection_name: str, query_embedding: List[float], top_k: int,
+                                typesense_client: AsyncTypesenseClient) -> List[Dict]:
+    """
+    Performs a vector search using the Typesense client.
+
+    Small collections (and any collection while Typesense is failing) are answered from
+    the in-process index of database/local_vector_index.py. Otherwise results are cached
+    per (collection, collection version, quantised embedding, top_k) as (id, distance)
+    pairs; chunk documents come from the shared chunk LRU, with one filtered search for
+    those it does not hold. Any write to the collection bumps its version.
+    """
+    version = await aget_collection_version(collection_name)
+    local_indexes = get_local_index_service()
+    local_index = await local_indexes.aprimary_index(collection_name, version)
+    if local_index is not None:
+        return local_index.search(query_embedding, top_k)
+
+    use_cache = SEARCH_CACHE_ENABLED and version is not None
+    if use_cache:
+        cache_key = search_cache_key(collection_name, version, query_embedding, top_k)
+        cached = await aget_cached_hits(cache_key)
+        if cached is not None:
+            ids = [chunk_id for chunk_id, _ in cached]
+            docs = chunk_cache.get_many(collection_name, version, ids)
+            missing = [chunk_id for chunk_id in ids if chunk_id not in docs]
+            if missing:
+                result = await typesense_client.search(collection_name, {
+                    "q": "*",
+                    "filter_by": f"id:[{','.join(f'`{chunk_id}`' for chunk_id in missing)}]",
+                    "include_fields": SEARCH_INCLUDE_FIELDS,
+                    "per_page": len(missing)
+                })
+                fetched = [hit["document"] for hit in result.get("hits", [])]
+                chunk_cache.put_many(collection_name, version, fetched)
+                docs.update((doc["id"], doc) for doc in fetched)
+            return [{"document": docs[chunk_id], "vector_distance": distance}
+                    for chunk_id, distance in cached if chunk_id in docs]
+
+    multi_search_result = await _vector_search_uncached(collection_name, query_embedding, top_k, typesense_client)
+    result = multi_search_result.get("results", [{}])[0]
+    if "error" in multi_search_result or "error" in result:
+        local_indexes.mark_typesense_failed()
+        fallback = await local_indexes.afallback_index(collection_name)
+        if fallback is None:
+            return []
+        logger.warning(f"Vector search on '{collection_name}' failed, answering from the local index")
+        return fallback.search(query_embedding, top_k)
+    local_indexes.mark_typesense_ok()
+
+    hits = result.get("hits", [])
+    if use_cache:
+        await aput_cached_hits(cache_key, hits)
+        chunk_cache.put_many(collection_name, version, [hit["document"] for hit in hits])
+    return hits
+
+
+async def perform_keyword_search(collection_name: str, query_text: str, top_k: int,
+                                 typesense_client: AsyncTypesenseClient) -> List[Dict]:
+    """Keyword (BM25-style text match) search on the chunk text; no embedding needed."""
+    search_requests = {
+        "searches": [
+            {
+                "collection": collection_name,
+                "q": query_text,
+                "query_by": "text",
+                "per_page": min(top_k * 5, 250),
+                "include_fields": SEARCH_INCLUDE_FIELDS
+            }
+        ]
+    }
+    multi_search_result = await typesense_client.multi_search(search_requests)
+    result = multi_search_result.get("results", [{}])[0]
+    error = multi_search_result.get("error") or result.get("error")
+    if error:
+        logger.error(f"Keyword search on '{collection_name}' failed: {error}")
+        local_indexes = get_local_index_service()
+        local_indexes.mark_typesense_failed()
+        fallback = await local_indexes.afallback_index(collection_name)
+        if fallback is None:
+            return []
+        logger.warning(f"Answering keyword search on '{collection_name}' from the local index")
+        return fallback.keyword_search(query_text, min(top_k * 5, 250))
+    get_local_index_service().mark_typesense_ok()
+    return result.get("hits", [])
+
+
+def fuse_hits(keyword_hits: List[Dict], vector_hits: List[Dict], alpha: float = 0.5, fusion: str = "rrf",
+              rrf_k: int = 60) -> List[Dict]:
+    """
+    Merges keyword and vector hit lists into one ranking.
+
+    - "rrf":      score = alpha / (rrf_k + vector_rank) + (1 - alpha) / (rrf_k + keyword_rank)
+    - "weighted": score = alpha * vector_score + (1 - alpha) * keyword_score, both min-max normalised
+
+    Each returned hit keeps its original fields plus `fusion_score`.
+    """
+    def _normalise(values: Dict[str, float]) -> Dict[str, float]:
+        if not values:
+            return {}
+        low, high = min(values.values()), max(values.values())
+        span = high - low
+        return {key: (value - low) / span if span else 1.0 for key, value in values.items()}
+
+    hits_by_id: Dict[str, Dict] = {}
+    for hit in keyword_hits + vector_hits:
+        doc_id = hit["document"]["id"]
+        hits_by_id[doc_id] = {**hits_by_id.get(doc_id, {}), **hit}
+
+    scores = {doc_id: 0.0 for doc_id in hits_by_id}
+    if fusion == "weighted":
+        vector_scores = _normalise({hit["document"]["id"]: -hit.get("vector_distance", 0.0) for hit in vector_hits})
+        keyword_scores = _normalise({hit["document"]["id"]: float(hit.get("text_match", 0)) for hit in keyword_hits})
+        for doc_id, score in vector_scores.items():
+            scores[doc_id] += alpha * score
+        for doc_id, score in keyword_scores.items():
+            scores[doc_id] += (1 - alpha) * score
+    else:
+        for rank, hit in enumerate(vector_hits, start=1):
+            scores[hit["document"]["id"]] += alpha / (rrf_k + rank)
+        for rank, hit in enumerate(keyword_hits, start=1):
+            scores[hit["document"]["id"]] += (1 - alpha) / (rrf_k + rank)
+
+    fused = []
+    for doc_id in sorted(scores, key=scores.get, reverse=True):
+        fused.append({**hits_by_id[doc_id], "fusion_score": scores[doc_id]})
+    return fused
+
+
+async def perform_hybrid_search(collection_name: str, query_text: str, query_embedding: List[float], top_k: int,
+                                typesense_client: AsyncTypesenseClient, alpha: float = 0.5,
+                                fusion: str = "rrf") -> List[Dict]:
+    """Runs keyword and vector retrieval in one multi_search and fuses the two rankings."""
+    per_page = min(top_k * 5, 250)
     search_requests = {
         "searches": [
+            {
+                "collection": collection_name,
+                "q": query_text,
+                "query_by": "text",
+                "per_page": per_page,
+                "include_fields": SEARCH_INCLUDE_FIELDS
+            },
             {
                 "collection": collection_name,
                 "q": "*",
-                "vector_query": f"embedding:([{','.join(map(str, query_embedding))}], k:{top_k * 5})",
-                "include_fields": "id,text,title,page_num,chunk_num"
+                "vector_query": f"embedding:([{encode_vector_query(query_embedding)}], k:{top_k * 5})",
+                "per_page": per_page,
+                "include_fields": SEARCH_INCLUDE_FIELDS
             }
         ]
     }
-    multi_search_result = typesense_client.multi_search(search_requests)
-    print(multi_search_result)
-    return multi_search_result.get("results", [{}])[0].get("hits", [])
\ No newline at end of file
+    multi_search_result = await typesense_client.multi_search(search_requests)
+    results = multi_search_result.get("results", [])
+    keyword_result = results[0] if len(results) > 0 else {}
+    vector_result = results[1] if len(results) > 1 else {}
+    keyword_hits = keyword_result.get("hits", [])
+    vector_hits = vector_result.get("hits", [])
+    local_indexes = get_local_index_service()
+    errors = [error for error in (multi_search_result.get("error"), keyword_result.get("error"),
+                                  vector_result.get("error")) if error]
+    if errors:
+        logger.error(f"Hybrid search on '{collection_name}' failed: {'; '.join(map(str, errors))}")
+        local_indexes.mark_typesense_failed()
+        fallback = await local_indexes.afallback_index(collection_name)
+        if fallback is not None:
+            logger.warning(f"Answering hybrid search on '{collection_name}' from the local index")
+            keyword_hits = fallback.keyword_search(query_text, per_page)
+            vector_hits = fallback.search(query_embedding, top_k * 5)
+        # Without a local index, fuse whichever of the two searches succeeded
+    else:
+        local_indexes.mark_typesense_ok()
+    return fuse_hits(keyword_hits, vector_hits, alpha=alpha, fusion=fusion)[:per_page]
+
+
+async def list_catalog_documents(chatbot_name: str, typesense_client: AsyncTypesenseClient,
+                                 limit: int = 100, offset: int = 0) -> List[Dict]:
+    """Entries of the chatbot's document catalog, newest upload first (no chunk scan)."""
+    try:
+        result = await typesense_client.search(DOCUMENT_CATALOG_COLLECTION, {
+            "q": "*",
+            "filter_by": f"chatbot_name:=`{chatbot_name}`",
+            "sort_by": "uploaded_at:desc",
+            "limit": limit,
+            "offset": offset
+        })
+    except httpx.HTTPStatusError as e:
+        # Catalog not created yet: nothing has been uploaded since it was introduced
+        if e.response.status_code == 404:
+            return []
+        raise
+    return [hit["document"] for hit in result.get("hits", [])]
@@ -0,0 +1,337 @@
+import io
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from config import settings
+from database.redis_connection import get_async_redis, r
+from database.search_cache import bump_collection_version
+
+logger = logging.getLogger(__name__)
+
+VECTOR_PROFILE_KEY_PREFIX = "vector_profile:"
+# Decimal places kept per component when a vector is sent in a `vector_query`
+VECTOR_QUERY_PRECISION = getattr(settings, "VECTOR_QUERY_PRECISION", 5)
+# Seconds a worker trusts its in-process copy of a profile before re-reading Redis,
+# so a collection compressed from another worker is picked up quickly
+VECTOR_PROFILE_CACHE_TTL = getattr(settings, "VECTOR_PROFILE_CACHE_TTL", 30)
+PROJECTION_METHODS = ("none", "truncate", "pca")
+
+
+def encode_vector_query(vector: Sequence[float], precision: int = VECTOR_QUERY_PRECISION) -> str:
+    """
+    Compact textual encoding of a vector for Typesense `vector_query`.
+    Uses fixed-point with trailing zeros trimmed instead of Python's 17-digit repr.
+    """
+    rounded = np.round(np.asarray(vector, dtype=np.float32), precision)
+    return ",".join(
+        (f"{x:.{precision}f}".rstrip("0").rstrip(".") or "0") for x in rounded.tolist()
+    )
+
+
+class VectorProfile:
+    """
+    Per-collection vector compression profile.
+
+    - normalize:  L2-normalise vectors (before and after projection).
+    - method:     "none" keeps the full dimension, "truncate" keeps the first
+                  `dim` components, "pca" projects onto the top `dim` principal
+                  components learned from the collection.
+    """
+
+    def __init__(
+            self,
+            method: str = "none",
+            dim: Optional[int] = None,
+            normalize: bool = True,
+            mean: Optional[np.ndarray] = None,
+            components: Optional[np.ndarray] = None,
+            source_dim: Optional[int] = None
+    ):
+        if method not in PROJECTION_METHODS:
+            raise ValueError(f"Unknown projection method '{method}'. Choose one of {PROJECTION_METHODS}.")
+        if method == "pca" and (mean is None or components is None):
+            raise ValueError("A PCA profile needs a fitted mean and components; use VectorProfile.fit.")
+        self.method = method
+        self.dim = dim
+        self.normalize = normalize
+        self.mean = mean
+        self.components = components
+        self.source_dim = source_dim
+
+    @property
+    def output_dim(self) -> Optional[int]:
+        if self.method == "none":
+            return self.source_dim
+        return self.dim
+
+    @classmethod
+    def fit(cls, embeddings: np.ndarray, method: str = "pca", dim: int = 384, normalize: bool = True) -> "VectorProfile":
+        """Learns a profile from a sample of collection embeddings (rows = vectors)."""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        source_dim = embeddings.shape[1]
+        if method != "none" and not 0 < dim <= source_dim:
+            raise ValueError(f"Target dimension {dim} must be in (0, {source_dim}].")
+        if normalize:
+            embeddings = _l2_normalize(embeddings)
+
+        if method != "pca":
+            return cls(method=method, dim=dim, normalize=normalize, source_dim=source_dim)
+
+        mean = embeddings.mean(axis=0)
+        # Rows of vt are principal directions ordered by explained variance
+        _, _, vt = np.linalg.svd(embeddings - mean, full_matrices=False)
+        components = vt[:dim].astype(np.float32)
+        return cls(method="pca", dim=dim, normalize=normalize, mean=mean, components=components,
+                   source_dim=source_dim)
+
+    def transform(self, vectors: Any) -> np.ndarray:
+        """Applies the profile to one vector (1-D) or a matrix of vectors (2-D)."""
+        matrix = np.asarray(vectors, dtype=np.float32)
+        single = matrix.ndim == 1
+        if single:
+            matrix = matrix[None, :]
+
+        if self.normalize:
+            matrix = _l2_normalize(matrix)
+        if self.method == "truncate":
+            matrix = matrix[:, :self.dim]
+        elif self.method == "pca":
+            matrix = (matrix - self.mean) @ self.components.T
+        if self.normalize and self.method != "none":
+            matrix = _l2_normalize(matrix)
+
+        return matrix[0] if single else matrix
+
+    def to_bytes(self) -> bytes:
+        meta = {"method": self.method, "dim": self.dim, "normalize": self.normalize, "source_dim": self.source_dim}
+        arrays = {"meta": np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8)}
+        if self.method == "pca":
+            arrays["mean"] = self.mean
+            arrays["components"] = self.components
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, payload: bytes) -> "VectorProfile":
+        with np.load(io.BytesIO(payload)) as data:
+            meta = json.loads(data["meta"].tobytes().decode("utf-8"))
+            return cls(
+                method=meta["method"],
+                dim=meta["dim"],
+                normalize=meta["normalize"],
+                source_dim=meta.get("source_dim"),
+                mean=data["mean"] if "mean" in data else None,
+                components=data["components"] if "components" in data else None
+            )
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+# In-process copy of the profiles so the query path does not hit Redis every time:
+# collection -> (loaded_at, collection version, profile)
+_profile_cache: Dict[str, tuple] = {}
+
+
+def _fresh_cached_profile(collection_name: str, version: Optional[int]) -> Optional[tuple]:
+    cached = _profile_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < VECTOR_PROFILE_CACHE_TTL and (version is None or cached[1] == version):
+        return cached
+    return None
+
+
+def _cache_profile(collection_name: str, version: Optional[int], payload: Optional[bytes]) -> Optional[VectorProfile]:
+    profile = VectorProfile.from_bytes(payload) if payload else None
+    _profile_cache[collection_name] = (time.monotonic(), version, profile)
+    return profile
+
+
+def get_vector_profile(collection_name: str, version: Optional[int] = None) -> Optional[VectorProfile]:
+    """
+    Returns the compression profile of a collection, or None if it stores raw vectors.
+    With the current collection `version` the cached copy is also dropped as soon as the
+    collection changes (compress_collection bumps it when it swaps in the new collection).
+    """
+    cached = _fresh_cached_profile(collection_name, version)
+    if cached:
+        return cached[2]
+    try:
+        payload = r.get(f"{VECTOR_PROFILE_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not load vector profile for '{collection_name}': {e}")
+        stale = _profile_cache.get(collection_name)
+        return stale[2] if stale else None
+    return _cache_profile(collection_name, version, payload)
+
+
+async def aget_vector_profile(collection_name: str, version: Optional[int] = None) -> Optional[VectorProfile]:
+    """get_vector_profile for the event loop: a cache refresh reads Redis on the asyncio pool."""
+    cached = _fresh_cached_profile(collection_name, version)
+    if cached:
+        return cached[2]
+    try:
+        payload = await get_async_redis().get(f"{VECTOR_PROFILE_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not load vector profile for '{collection_name}': {e}")
+        stale = _profile_cache.get(collection_name)
+        return stale[2] if stale else None
+    return _cache_profile(collection_name, version, payload)
+
+
+def save_vector_profile(collection_name: str, profile: Optional[VectorProfile]) -> None:
+    key = f"{VECTOR_PROFILE_KEY_PREFIX}{collection_name}"
+    if profile is None:
+        r.delete(key)
+    else:
+        r.set(key, profile.to_bytes())
+    _profile_cache.pop(collection_name, None)
+
+
+def project_vectors(vectors: Any, profile: Optional[VectorProfile]) -> List:
+    """Transforms vector(s) with an already loaded profile; returns them unchanged (as lists) for None."""
+    if profile is None:
+        return np.asarray(vectors).tolist()
+    return profile.transform(vectors).tolist()
+
+
+def apply_vector_profile(vectors: Any, collection_name: str, version: Optional[int] = None) -> List:
+    """Transforms vector(s) with the collection's profile; returns them unchanged (as lists) if it has none."""
+    return project_vectors(vectors, get_vector_profile(collection_name, version))
+
+
+def _alias_target(client: Any, name: str) -> Optional[str]:
+    """The collection an alias points to, or None when `name` is not an alias."""
+    try:
+        return client.aliases[name].retrieve()["collection_name"]
+    except Exception:
+        return None
+
+
+def compress_collection(
+        typesense_client: Any,
+        collection_name: str,
+        method: str = "pca",
+        dim: int = 384,
+        normalize: bool = True,
+        sample_size: int = 20000,
+        batch_size: int = 100
+) -> Dict[str, Any]:
+    """
+    Re-indexes a chatbot collection under a new compression profile.
+
+    Exports every chunk, learns the profile from (a sample of) the stored
+    embeddings and imports the transformed vectors into a new collection with the
+    reduced `num_dim`. Only when every document was imported is the profile saved
+    and the alias `collection_name` pointed at the new collection; the old one is
+    deleted after the swap. Existing collections must still hold full-size
+    vectors (i.e. no profile applied yet).
+
+    Chatbots created behind an alias (create_chatbot) switch without interruption.
+    A plain collection named `collection_name` (created before aliases were used)
+    must be deleted to free its name for the alias: it answers no queries between
+    the delete and the alias upsert (reported as `unavailable_ms`), and if the alias
+    cannot be created the original collection is rebuilt from the export.
+    """
+    if get_vector_profile(collection_name) is not None:
+        raise ValueError(f"Collection '{collection_name}' already has a vector profile; re-ingest to change it.")
+
+    documents = typesense_client.client.collections[collection_name].documents
+    exported = [json.loads(line) for line in documents.export().splitlines() if line.strip()]
+    if not exported:
+        raise ValueError(f"Collection '{collection_name}' is empty; nothing to learn a profile from.")
+
+    embeddings = np.asarray([doc["embedding"] for doc in exported], dtype=np.float32)
+    rng = np.random.default_rng(0)
+    sample_idx = rng.choice(len(embeddings), size=min(sample_size, len(embeddings)), replace=False)
+    profile = VectorProfile.fit(embeddings[sample_idx], method=method, dim=dim, normalize=normalize)
+
+    compressed = profile.transform(embeddings)
+    for doc, vector in zip(exported, compressed):
+        doc["embedding"] = vector.tolist()
+
+    client = typesense_client.client
+    target = f"{collection_name}__{profile.method}{profile.output_dim}_{int(time.time())}"
+    client.collections.create(typesense_client._get_document_schema(target, embedding_dim=profile.output_dim))
+    try:
+        failures = []
+        for i in range(0, len(exported), batch_size):
+            results = client.collections[target].documents.import_(exported[i:i + batch_size], {"action": "upsert"})
+            failures.extend(result for result in results if not result.get("success"))
+        if failures:
+            raise RuntimeError(f"{len(failures)} of {len(exported)} chunks failed to import, e.g. {failures[0]}")
+        imported = client.collections[target].retrieve().get("num_documents")
+        if imported != len(exported):
+            raise RuntimeError(f"'{target}' holds {imported} chunks, expected {len(exported)}")
+    except Exception:
+        # The live collection was not touched
+        client.collections[target].delete()
+        raise
+
+    previous = _alias_target(client, collection_name)
+    unavailable_ms = None
+    save_vector_profile(collection_name, profile)
+    if previous is not None:
+        try:
+            _upsert_alias(client, collection_name, target)
+        except Exception:
+            # The alias still points at the uncompressed collection
+            save_vector_profile(collection_name, None)
+            client.collections[target].delete()
+            raise
+    else:
+        logger.warning(f"'{collection_name}' is a plain collection: it is unavailable until the alias replaces it")
+        started = time.perf_counter()
+        client.collections[collection_name].delete()
+        try:
+            _upsert_alias(client, collection_name, target)
+        except Exception:
+            logger.error(f"Could not alias '{collection_name}' to '{target}'; rebuilding the original collection")
+            save_vector_profile(collection_name, None)
+            _restore_collection(typesense_client, collection_name, exported, embeddings, batch_size)
+            client.collections[target].delete()
+            bump_collection_version(collection_name)
+            raise
+        unavailable_ms = (time.perf_counter() - started) * 1000
+    bump_collection_version(collection_name)
+    if previous is not None:
+        client.collections[previous].delete()
+    logger.info(f"Compressed '{collection_name}': {profile.source_dim} -> {profile.output_dim} dims "
+                f"({method}, normalize={normalize}), {len(exported)} chunks re-indexed")
+    return {
+        "collection": collection_name,
+        "num_chunks": len(exported),
+        "source_dim": profile.source_dim,
+        "output_dim": profile.output_dim,
+        "method": method,
+        "unavailable_ms": unavailable_ms
+    }
+
+
+def _upsert_alias(client: Any, name: str, target: str, attempts: int = 3) -> None:
+    for attempt in range(attempts):
+        try:
+            client.aliases.upsert(name, {"collection_name": target})
+            return
+        except Exception as e:
+            if attempt == attempts - 1:
+                raise
+            logger.warning(f"Alias upsert '{name}' -> '{target}' failed (attempt {attempt + 1}/{attempts}): {e}")
+            time.sleep(0.2 * (2 ** attempt))
+
+
+def _restore_collection(typesense_client: Any, collection_name: str, exported: List[Dict[str, Any]],
+                        embeddings: np.ndarray, batch_size: int) -> None:
+    """Recreates a deleted plain collection from its export (with the original, uncompressed vectors)."""
+    client = typesense_client.client
+    client.collections.create(typesense_client._get_document_schema(collection_name, embedding_dim=embeddings.shape[1]))
+    for doc, vector in zip(exported, embeddings):
+        doc["embedding"] = vector.tolist()
+    for i in range(0, len(exported), batch_size):
+        client.collections[collection_name].documents.import_(exported[i:i + batch_size], {"action": "upsert"})
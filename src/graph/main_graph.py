@@ -6,7 +6,8 @@ from pydantic import BaseModel, Field
 from langgraph.graph import StateGraph, END
 
 from processing.query_retrieval_processor import get_classifier_pipeline
-from rag_components.llm_interface import reformulate_query_with_chain
+from rag_components.llm_interface import reformulate_standalone_query, add_user_context
+from llm.query_embedding import QUERY_EMBEDDING_MODEL, embed_query, encode_query_embedding
 from typing_class.rag_type import QueryRequest
 from typing_class.graph_type import OrchestratorState
 from graph.call_api_routes import *
@@ -116,15 +117,17 @@ async def tool_router_node(state: OrchestratorState) -> dict:
     # --- NEW: Get the summary from the state ---
     conversation_summary = state.get("conversation_summary", "Đây là lượt đầu tiên của cuộc trò chuyện.")
 
-    reformulated_query = await reformulate_query_with_chain(
+    # Embed the clean standalone query once: the classifier and the RAG backend both reuse this vector
+    standalone_query = await reformulate_standalone_query(
         query=state['query'],
-        chat_history=state['chat_history'],
-        user_id=state["user_id"],
-        user_role=state["user_role"]
+        chat_history=state['chat_history']
     )
+    query_embedding = await embed_query(standalone_query)
+    encoded_embedding = encode_query_embedding(query_embedding)
+    reformulated_query = add_user_context(standalone_query, state["user_id"], state["user_role"])
 
     instance_finding = get_classifier_pipeline()
-    result = instance_finding(reformulated_query)
+    result = await instance_finding.aclassify(standalone_query, query_embedding=query_embedding)
 
     if result == "FOUND":
         print("The query is classified to use retrieval from database")
@@ -139,7 +142,8 @@ async def tool_router_node(state: OrchestratorState) -> dict:
     })
 
     if not decision:
-        return {"tool_to_use": "none", "tool_input": {}}
+        return {"tool_to_use": "none", "tool_input": {},
+                "standalone_query": standalone_query, "query_embedding": encoded_embedding}
 
     tool_name = decision.tool_name
     print(f"--- ROUTER DECISION: Tool='{tool_name}' ---")
@@ -158,13 +162,16 @@ async def tool_router_node(state: OrchestratorState) -> dict:
             voice=state.get("voice", False),
             user_id=state.get('user_id', "duythai"),
             user_role=state.get('user_role', "duythai"),
+            query_embedding=encoded_embedding,
+            embedding_model=QUERY_EMBEDDING_MODEL,
         ).dict()
-        print("The tool input is ", tool_input)
+        print("The tool input is ", {**tool_input, "query_embedding": f"<{len(encoded_embedding)} chars>"})
     elif tool_name == "analysis":
         # Prepare the input for the Analysis API
         tool_input = {"aggregation_level": decision.aggregation_level}
 
-    return {"tool_to_use": tool_name, "tool_input": tool_input}
+    return {"tool_to_use": tool_name, "tool_input": tool_input,
+            "standalone_query": standalone_query, "query_embedding": encoded_embedding}
 
 
 async def api_caller_node(state: OrchestratorState, config: RunnableConfig) -> dict:
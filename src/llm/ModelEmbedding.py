@@ -1,5 +1,7 @@
+import json
+import os
 from abc import ABC
-from typing import Callable, List
+from typing import Callable, Dict, List, Optional
 
 from chonkie import BaseEmbeddings
 
@@ -8,20 +10,74 @@ from sentence_transformers import SentenceTransformer
 import torch
 import numpy as np
 
+# Supported inference backends:
+# - "torch":     full-precision SentenceTransformer through PyTorch (GPU if available)
+# - "onnx":      fp32 ONNX Runtime export, CPU only
+# - "onnx-int8": dynamically quantised int8 ONNX Runtime export, CPU only
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_EMBEDDING_BACKEND = getattr(settings, "EMBEDDING_BACKEND", "torch")
+# Instruction set targeted by the int8 export ("avx2", "avx512", "avx512_vnni", "arm64");
+# the export records its choice in ONNX_EXPORT_INFO_FILE, which the loaders read back
+DEFAULT_ONNX_QUANTIZATION = getattr(settings, "EMBEDDING_ONNX_QUANTIZATION", "avx2")
+ONNX_EXPORT_INFO_FILE = "onnx_export.json"
+
+
+def get_onnx_export_dir(model_name: str) -> str:
+    """Directory holding the exported ONNX files for a model."""
+    default_dir = os.path.join(settings.MODEL_CACHE_DIR, "onnx", model_name.replace("/", "__"))
+    return getattr(settings, "EMBEDDING_ONNX_DIR", None) or default_dir
+
+
+def _export_quantization(export_dir: str) -> str:
+    """Quantisation config the int8 model in `export_dir` was exported with."""
+    try:
+        with open(os.path.join(export_dir, ONNX_EXPORT_INFO_FILE), encoding="utf-8") as f:
+            return json.load(f)["quantization"]
+    except (OSError, ValueError, KeyError):
+        # Exports made before the info file existed
+        return DEFAULT_ONNX_QUANTIZATION
+
+
+def _onnx_file_name(backend: str, export_dir: str) -> str:
+    if backend == "onnx-int8":
+        return f"onnx/model_qint8_{_export_quantization(export_dir)}.onnx"
+    return "onnx/model.onnx"
+
+
 # Base model Embedding
 class EmbeddingModel(BaseEmbeddings):
-    def __init__(self, model_name: str = settings.EMBEDDING_MODEL):
+    def __init__(self, model_name: str = settings.EMBEDDING_MODEL, backend: str = DEFAULT_EMBEDDING_BACKEND):
         # The BaseEmbeddings __init__ can be called if needed, but it's empty in the example
         # super().__init__()
         super().__init__()
-        device = "cuda:0" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {device}")
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of {EMBEDDING_BACKENDS}.")
+        self.backend = backend
+        self.model_name = model_name
 
-        self.model = SentenceTransformer(
-            model_name,
-            cache_folder=settings.MODEL_CACHE_DIR,
-            device=device
-        )
+        if backend == "torch":
+            device = "cuda:0" if torch.cuda.is_available() else "cpu"
+            print(f"Using device: {device}")
+            self.model = SentenceTransformer(
+                model_name,
+                cache_folder=settings.MODEL_CACHE_DIR,
+                device=device
+            )
+        else:
+            export_dir = get_onnx_export_dir(model_name)
+            file_name = _onnx_file_name(backend, export_dir)
+            if not os.path.exists(os.path.join(export_dir, file_name)):
+                raise FileNotFoundError(
+                    f"No ONNX export at {os.path.join(export_dir, file_name)}. "
+                    f"Run `python -m llm.ModelEmbedding export` first."
+                )
+            print(f"Using ONNX Runtime backend: {backend} ({file_name})")
+            self.model = SentenceTransformer(
+                export_dir,
+                device="cpu",
+                backend="onnx",
+                model_kwargs={"file_name": file_name}
+            )
         self.batch_size = settings.EMBEDDING_BATCH_SIZE
 
         # This property is not used by SentenceTransformer's encode method
@@ -59,14 +115,127 @@ class EmbeddingModel(BaseEmbeddings):
         # We return a lambda function that uses the model's tokenizer
         return lambda text: len(self.model.tokenizer.encode(text))
 
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Token counts (special tokens included, like the counter) of many texts in one tokenizer call."""
+        if not texts:
+            return []
+        return [len(ids) for ids in self.model.tokenizer(list(texts))["input_ids"]]
+
 _embedding_model_instance = None
 
-def get_embedding_model_service() -> EmbeddingModel:
+def get_embedding_model_service() -> BaseEmbeddings:
     """
     Returns the singleton instance of the EmbeddingModel.
     Initializes it if it hasn't been initialized yet.
+
+    When EMBEDDING_SERVER_URL or EMBEDDING_SERVER_SOCKET is configured, this is a
+    RemoteEmbeddingModel client for the shared embedding server instead, so
+    uvicorn workers do not each load their own copy of the model.
     """
     global _embedding_model_instance
     if _embedding_model_instance is None:
-        _embedding_model_instance = EmbeddingModel() # Instantiate your wrapper class
+        if getattr(settings, "EMBEDDING_SERVER_URL", None) or getattr(settings, "EMBEDDING_SERVER_SOCKET", None):
+            from llm.embedding_server import RemoteEmbeddingModel
+            _embedding_model_instance = RemoteEmbeddingModel()
+        else:
+            _embedding_model_instance = EmbeddingModel() # Instantiate your wrapper class
     return _embedding_model_instance
+
+
+def export_onnx_model(
+        model_name: str = settings.EMBEDDING_MODEL,
+        output_dir: Optional[str] = None,
+        quantization_config: str = DEFAULT_ONNX_QUANTIZATION,
+        cross_encoder: bool = False
+) -> str:
+    """
+    One-shot export of the embedding model (or, with `cross_encoder`, the reranker)
+    to ONNX (fp32) plus a dynamically quantised int8 copy, both under `output_dir`.
+    Returns the export directory.
+    """
+    from sentence_transformers import CrossEncoder, export_dynamic_quantized_onnx_model
+
+    output_dir = output_dir or get_onnx_export_dir(model_name)
+    print(f"Exporting '{model_name}' to ONNX at {output_dir} ...")
+    model_class = CrossEncoder if cross_encoder else SentenceTransformer
+    onnx_model = model_class(
+        model_name,
+        cache_folder=settings.MODEL_CACHE_DIR,
+        device="cpu",
+        backend="onnx"
+    )
+    onnx_model.save_pretrained(output_dir)
+
+    print(f"Quantising to int8 ({quantization_config}) ...")
+    export_dynamic_quantized_onnx_model(
+        onnx_model,
+        quantization_config=quantization_config,
+        model_name_or_path=output_dir
+    )
+    with open(os.path.join(output_dir, ONNX_EXPORT_INFO_FILE), "w", encoding="utf-8") as f:
+        json.dump({"model": model_name, "quantization": quantization_config}, f)
+    print("Export complete.")
+    return output_dir
+
+
+def check_backend_agreement(
+        texts: List[str],
+        backends: tuple = ("onnx", "onnx-int8"),
+        model_name: str = settings.EMBEDDING_MODEL
+) -> Dict[str, Dict[str, float]]:
+    """
+    Embeds `texts` with the torch reference and each backend in `backends` and
+    reports the per-text cosine agreement with the reference embeddings.
+    """
+    import time
+
+    def _normalise(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return matrix / np.where(norms == 0, 1, norms)
+
+    reference_model = EmbeddingModel(model_name, backend="torch")
+    start = time.perf_counter()
+    reference = _normalise(np.vstack(reference_model.embed_batch(texts)))
+    report = {"torch": {"seconds": time.perf_counter() - start, "mean_cosine": 1.0, "min_cosine": 1.0}}
+
+    for backend in backends:
+        candidate_model = EmbeddingModel(model_name, backend=backend)
+        start = time.perf_counter()
+        candidate = _normalise(np.vstack(candidate_model.embed_batch(texts)))
+        elapsed = time.perf_counter() - start
+        cosines = np.sum(reference * candidate, axis=1)
+        report[backend] = {
+            "seconds": elapsed,
+            "mean_cosine": float(np.mean(cosines)),
+            "min_cosine": float(np.min(cosines))
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export and validate ONNX backends for the embedding model")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export fp32 ONNX and int8 quantised models")
+    export_parser.add_argument("--model", default=settings.EMBEDDING_MODEL, help="SentenceTransformer model name")
+    export_parser.add_argument("--output-dir", default=None, help="Export directory")
+    export_parser.add_argument("--quantization", default=DEFAULT_ONNX_QUANTIZATION,
+                               choices=["arm64", "avx2", "avx512", "avx512_vnni"],
+                               help="Target instruction set for int8 quantisation")
+    export_parser.add_argument("--cross-encoder", action="store_true",
+                               help="Export a CrossEncoder (e.g. RERANK_MODEL) instead of a SentenceTransformer")
+
+    check_parser = subparsers.add_parser("check", help="Compare ONNX embeddings with the torch reference")
+    check_parser.add_argument("--model", default=settings.EMBEDDING_MODEL, help="SentenceTransformer model name")
+    check_parser.add_argument("--corpus", required=True, help="Text file with one sample sentence per line")
+    check_parser.add_argument("--limit", type=int, default=500, help="Maximum number of lines to embed")
+
+    args = parser.parse_args()
+    if args.action == "export":
+        export_onnx_model(args.model, args.output_dir, args.quantization, cross_encoder=args.cross_encoder)
+    elif args.action == "check":
+        with open(args.corpus, encoding="utf-8") as f:
+            sample = [line.strip() for line in f if line.strip()][:args.limit]
+        print(json.dumps(check_backend_agreement(sample, model_name=args.model), indent=2))
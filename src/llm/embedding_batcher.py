@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from config import settings
+from llm.ModelEmbedding import EmbeddingModel, get_embedding_model_service
+
+logger = logging.getLogger(__name__)
+
+# How long the worker waits for more requests before running a batch,
+# and the largest batch it will run in one `encode` call.
+DEFAULT_MAX_WAIT_MS = getattr(settings, "EMBEDDING_BATCH_WAIT_MS", 5)
+DEFAULT_MAX_BATCH_SIZE = getattr(settings, "EMBEDDING_MICRO_BATCH_SIZE", 32)
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent single-text `embed` calls and runs them as one batched
+    `embed_batch` call on a dedicated worker thread.
+
+    Exposes the same `embed` / `embed_batch` / `dimension` interface as
+    EmbeddingModel, plus `submit` (returns a Future) and `aembed` (awaitable),
+    so it can be dropped in wherever a single query is embedded.
+    """
+
+    def __init__(
+            self,
+            embedding_model: EmbeddingModel,
+            max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+            max_batch_size: int = DEFAULT_MAX_BATCH_SIZE
+    ):
+        self.embedding_model = embedding_model
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self._queue: "queue.Queue[Tuple[str, Future]]" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue a single text and return a Future resolving to its embedding."""
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        """Blocking single-text embed, batched with other concurrent callers."""
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> np.ndarray:
+        """Awaitable single-text embed; does not block the event loop."""
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_batch(self, texts: List[str]) -> List[np.ndarray]:
+        """Callers that already have a batch go straight to the model."""
+        return self.embedding_model.embed_batch(texts)
+
+    @property
+    def dimension(self) -> int:
+        return self.embedding_model.dimension
+
+    def get_tokenizer_or_token_counter(self) -> Callable[[str], int]:
+        return self.embedding_model.get_tokenizer_or_token_counter()
+
+    def _collect_batch(self) -> List[Tuple[str, Future]]:
+        """Block for the first request, then gather more until the wait window closes."""
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = [(text, future) for text, future in self._collect_batch()
+                     if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            try:
+                embeddings = self.embedding_model.embed_batch([text for text, _ in batch])
+            except Exception as e:
+                logger.error(f"Embedding batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), embedding in zip(batch, embeddings):
+                future.set_result(embedding)
+
+
+_embedding_batcher_instance: Optional[EmbeddingBatcher] = None
+
+
+def get_embedding_batcher_service() -> EmbeddingBatcher:
+    """
+    Returns the singleton EmbeddingBatcher wrapping the shared EmbeddingModel.
+    """
+    global _embedding_batcher_instance
+    if _embedding_batcher_instance is None:
+        _embedding_batcher_instance = EmbeddingBatcher(get_embedding_model_service())
+    return _embedding_batcher_instance
@@ -0,0 +1,168 @@
+"""
+Out-of-process embedding server shared by all uvicorn workers on a node.
+
+The server loads the SentenceTransformer once and funnels every request
+through an EmbeddingBatcher, so concurrent calls from different workers are
+encoded together. Workers talk to it through RemoteEmbeddingModel, which
+implements the same embed / embed_batch / dimension interface as
+EmbeddingModel.
+
+Run it on a Unix socket (default) or TCP:
+
+    python -m llm.embedding_server --uds /tmp/geso-embedding.sock
+    python -m llm.embedding_server --host 127.0.0.1 --port 8765
+
+and point the API at it with EMBEDDING_SERVER_SOCKET or EMBEDDING_SERVER_URL.
+"""
+import asyncio
+import base64
+from typing import Callable, List, Optional
+
+import httpx
+import numpy as np
+from chonkie import BaseEmbeddings
+from pydantic import BaseModel
+
+from config import settings
+
+EMBEDDING_SERVER_URL = getattr(settings, "EMBEDDING_SERVER_URL", None)
+EMBEDDING_SERVER_SOCKET = getattr(settings, "EMBEDDING_SERVER_SOCKET", None)
+EMBEDDING_SERVER_TIMEOUT = getattr(settings, "EMBEDDING_SERVER_TIMEOUT", 30.0)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+
+
+class CountTokensRequest(BaseModel):
+    # One text ({"count"}) or a batch ({"counts"}, same order)
+    text: Optional[str] = None
+    texts: Optional[List[str]] = None
+
+
+def _encode_matrix(matrix: np.ndarray) -> dict:
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    return {"shape": list(matrix.shape), "data": base64.b64encode(matrix.tobytes()).decode("ascii")}
+
+
+def _decode_matrix(payload: dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload["data"]), dtype=np.float32).reshape(payload["shape"])
+
+
+def create_app():
+    """Builds the FastAPI app; the model is loaded here, once per server process."""
+    from fastapi import FastAPI
+    from llm.ModelEmbedding import EmbeddingModel
+    from llm.embedding_batcher import EmbeddingBatcher
+
+    model = EmbeddingModel()
+    batcher = EmbeddingBatcher(model)
+    app = FastAPI(title="Embedding Server", version="1.0.0")
+
+    @app.get("/info")
+    def info():
+        return {"model": model.model_name, "backend": model.backend, "dimension": model.dimension}
+
+    @app.post("/embed")
+    async def embed(request: EmbedRequest):
+        # Every text goes through the shared batcher, so texts from concurrent
+        # requests (and other workers) are encoded in the same forward pass.
+        futures = [asyncio.wrap_future(batcher.submit(text)) for text in request.texts]
+        embeddings = await asyncio.gather(*futures)
+        if not embeddings:
+            return _encode_matrix(np.zeros((0, model.dimension), dtype=np.float32))
+        return _encode_matrix(np.vstack(embeddings))
+
+    @app.post("/count_tokens")
+    def count_tokens(request: CountTokensRequest):
+        if request.texts is not None:
+            return {"counts": model.count_tokens_batch(request.texts)}
+        return {"count": model.get_tokenizer_or_token_counter()(request.text or "")}
+
+    return app
+
+
+class RemoteEmbeddingModel(BaseEmbeddings):
+    """
+    Client for the shared embedding server with the EmbeddingModel interface.
+    """
+
+    def __init__(self, url: Optional[str] = EMBEDDING_SERVER_URL, socket_path: Optional[str] = EMBEDDING_SERVER_SOCKET,
+                 timeout: float = EMBEDDING_SERVER_TIMEOUT):
+        super().__init__()
+        if not url and not socket_path:
+            raise ValueError("RemoteEmbeddingModel needs either a server URL or a Unix socket path.")
+        # With a Unix socket the host part of the URL is ignored by the transport
+        self.base_url = url or "http://embedding-server"
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._client = httpx.Client(
+            base_url=self.base_url,
+            transport=httpx.HTTPTransport(uds=socket_path) if socket_path else None,
+            timeout=timeout
+        )
+        self._async_client: Optional[httpx.AsyncClient] = None
+        self._dimension: Optional[int] = None
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                base_url=self.base_url,
+                transport=httpx.AsyncHTTPTransport(uds=self.socket_path) if self.socket_path else None,
+                timeout=self.timeout
+            )
+        return self._async_client
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embed a single text string."""
+        return self.embed_batch([text])[0]
+
+    async def aembed(self, text: str) -> np.ndarray:
+        response = await self._get_async_client().post("/embed", json={"texts": [text]})
+        response.raise_for_status()
+        return _decode_matrix(response.json())[0]
+
+    def embed_batch(self, texts: List[str]) -> List[np.ndarray]:
+        """Embed a list of text strings into vector representations."""
+        response = self._client.post("/embed", json={"texts": list(texts)})
+        response.raise_for_status()
+        return list(_decode_matrix(response.json()))
+
+    @property
+    def dimension(self) -> int:
+        if self._dimension is None:
+            response = self._client.get("/info")
+            response.raise_for_status()
+            self._dimension = response.json()["dimension"]
+        return self._dimension
+
+    def get_tokenizer_or_token_counter(self) -> Callable[[str], int]:
+        def count_tokens(text: str) -> int:
+            response = self._client.post("/count_tokens", json={"text": text})
+            response.raise_for_status()
+            return response.json()["count"]
+        return count_tokens
+
+    def count_tokens_batch(self, texts: List[str]) -> List[int]:
+        """Token counts of many texts in one round trip to the server."""
+        if not texts:
+            return []
+        response = self._client.post("/count_tokens", json={"texts": list(texts)})
+        response.raise_for_status()
+        return response.json()["counts"]
+
+
+if __name__ == "__main__":
+    import argparse
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Shared embedding server for API workers")
+    parser.add_argument("--uds", default=None, help="Unix socket path to listen on")
+    parser.add_argument("--host", default="127.0.0.1", help="TCP host (ignored with --uds)")
+    parser.add_argument("--port", type=int, default=8765, help="TCP port (ignored with --uds)")
+    args = parser.parse_args()
+
+    if args.uds:
+        uvicorn.run(create_app(), uds=args.uds)
+    else:
+        uvicorn.run(create_app(), host=args.host, port=args.port)
@@ -0,0 +1,77 @@
+import base64
+import binascii
+import logging
+from contextvars import ContextVar
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+from config import settings
+from llm.embedding_batcher import get_embedding_batcher_service
+
+logger = logging.getLogger(__name__)
+
+# Identifies the vector space of a shipped embedding; backends only reuse vectors from the same model
+QUERY_EMBEDDING_MODEL = settings.EMBEDDING_MODEL
+
+# Query embeddings already computed for the current request, keyed by query text.
+# Each request handler runs in its own context, so entries never leak between requests.
+_request_embeddings: ContextVar[Optional[Dict[str, np.ndarray]]] = ContextVar("request_embeddings", default=None)
+
+
+def encode_query_embedding(embedding: Sequence[float]) -> str:
+    """Compact wire form of a query embedding: base64 of little-endian float16 (2 bytes per dimension)."""
+    return base64.b64encode(np.asarray(embedding, dtype="<f2").tobytes()).decode("ascii")
+
+
+def decode_query_embedding(encoded: Optional[str], model: Optional[str]) -> Optional[np.ndarray]:
+    """
+    The float32 vector carried by a request, or None when it is absent or unusable
+    (other model, wrong dimension, not finite, not valid base64).
+    """
+    if not encoded:
+        return None
+    if model != QUERY_EMBEDDING_MODEL:
+        logger.info(f"Ignoring query embedding from model '{model}' (serving '{QUERY_EMBEDDING_MODEL}')")
+        return None
+    try:
+        embedding = np.frombuffer(base64.b64decode(encoded, validate=True), dtype="<f2").astype(np.float32)
+    except (binascii.Error, ValueError) as e:
+        logger.warning(f"Ignoring malformed query embedding: {e}")
+        return None
+    if embedding.shape[0] != settings.EMBEDDING_DIMENSION or not np.all(np.isfinite(embedding)):
+        logger.warning(f"Ignoring query embedding of dimension {embedding.shape[0]} or with non-finite values")
+        return None
+    return embedding
+
+
+def provide_query_embedding(query_text: str, embedding: np.ndarray) -> None:
+    """Registers an already computed embedding of `query_text` for the rest of the current request."""
+    cache = _request_embeddings.get()
+    if cache is None:
+        cache = {}
+        _request_embeddings.set(cache)
+    cache[query_text] = embedding
+
+
+async def embed_query(query_text: str) -> np.ndarray:
+    """Embedding of a query text, computed at most once per request (through the micro-batcher)."""
+    cache = _request_embeddings.get()
+    if cache is not None and query_text in cache:
+        return cache[query_text]
+    embedding = await get_embedding_batcher_service().aembed(query_text)
+    provide_query_embedding(query_text, embedding)
+    return embedding
+
+
+async def request_query_embedding(request) -> np.ndarray:
+    """
+    Embedding for a QueryRequest: the vector shipped with it when valid for this model,
+    otherwise `request.query` embedded here. Either way it is registered for the request.
+    """
+    embedding = decode_query_embedding(getattr(request, "query_embedding", None),
+                                       getattr(request, "embedding_model", None))
+    if embedding is None:
+        return await embed_query(request.query)
+    provide_query_embedding(request.query, embedding)
+    return embedding
@@ -1,15 +1,20 @@
-import pickle
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 from config import settings
 from llm.llm_langchain import gemini_llm_service, local_llm_service
-from context_engine.rag_prompt import SELECT_EXCEL_FILE_PROMPT_TEMPLATE
+from llm.query_embedding import embed_query
+from processing.dataset_selector import get_dataset_selector_service, description_summary
 from typing import Tuple, Optional, Dict, Any, Coroutine
+import asyncio
 import os
 import json
 import pandas as pd
 import logging
 from database.redis_connection import r, delete_dataframe_from_cache, flush_redis_database, CustomEncoder
+from database.dataframe_codec import decode_excel_result, encode_excel_result
+from database.dataframe_cache import get_dataframe_cache_service
+from database.dataset_partitions import TimeRange, aget_dataset
+from processing.dataset_query_plan import aplan_dataset_query
 import redis
 
 
@@ -101,18 +106,19 @@ def get_excel_data_with_cache(file_path: str, cache_path: str) -> Tuple[
     Optional[pd.DataFrame], Optional[pd.DataFrame], Dict[str, Any], str, Optional[str]]:
     """
     A caching wrapper around _read_excel_file_data.
-    Uses Redis as a cache, with PICKLE for robust serialization of the result tuple.
+    Uses Redis as a cache; the result tuple is stored with the Arrow codec (database/dataframe_codec.py)
+    and kept decoded in the process-local L1 cache while its Redis version is unchanged.
     """
+    dataframe_cache = get_dataframe_cache_service()
     try:
         # flush_redis_database()
-        cached_result_bytes = r.get(cache_path)
+        cached_result = dataframe_cache.get(cache_path, decode_excel_result)
 
-        if cached_result_bytes:
+        if cached_result is not None:
             print("-" * 100)
             print("We have cached data for", cache_path)
             logging.info(f"CACHE HIT for '{os.path.basename(file_path)}'")
-            # Deserialize the entire tuple from bytes using pickle.loads
-            return pickle.loads(cached_result_bytes)
+            return cached_result
         else:
             logging.info(f"CACHE MISS for '{os.path.basename(file_path)}'. Reading from file.")
             result_tuple = _read_excel_file_data(file_path)
@@ -120,9 +126,8 @@ def get_excel_data_with_cache(file_path: str, cache_path: str) -> Tuple[
 
             if error_message is None:
                 logging.info(f"Storing '{os.path.basename(cache_path)}' in Redis cache.")
-                # Serialize the entire tuple into bytes using pickle.dumps
-                serialized_result = pickle.dumps(result_tuple)
-                r.set(cache_path, serialized_result, ex=864000)
+                serialized_result = encode_excel_result(result_tuple)
+                dataframe_cache.put(cache_path, result_tuple, serialized_result, ex=864000)
 
             return result_tuple
 
@@ -132,38 +137,21 @@ def get_excel_data_with_cache(file_path: str, cache_path: str) -> Tuple[
 
 
 
-async def select_database(query:str, collection: str) -> tuple | None:
+async def select_database(query:str, collection: str, query_embedding=None, columns: Optional[list] = None,
+                          time_range: Optional[TimeRange] = None) -> tuple | None:
     """
-    Extracts metadata from a single Excel file for LLM context.
-    Reads only the first few rows for efficiency.
+    Selects the dataset of a collection that answers the query (see DatasetSelector) and loads it.
+    The LLM is only consulted when the embedding + BM25 ranking has no clear winner.
+    `columns` / `time_range` ((nam, thang), (nam, thang)) restrict what is loaded of a server dataset;
+    when neither is given they are derived from the query (see processing/dataset_query_plan.py).
     """
-
-    master_descriptions = r.lrange(settings.LIST_MASTER_DATA_DESCRIPTION, 0, -1)
-    master_descriptions = [item.decode('utf-8') for item in master_descriptions]
-    collection_description = [temp for temp in master_descriptions if temp.split("_")[0] == collection]
-    db_metadata = "\n".join([
-        "\n----------------\n" + md.split("Các cột chi tiết trong bảng dữ liệu bao gồm")[0]
-        for md in collection_description
-    ])
-
-    prompt = SELECT_EXCEL_FILE_PROMPT_TEMPLATE.format(
-        query=query, db_metadata_json=db_metadata
-    )
-
-    print("DB metadata for prompt: ", db_metadata)
-
-    try:
-        raw_prompt_template = ChatPromptTemplate.from_template("{prompt}")
-        llm_to_use = gemini_llm_service.bind(max_output_tokens=32)
-        simple_chain = raw_prompt_template | llm_to_use | StrOutputParser()
-        result = await simple_chain.ainvoke({"prompt": prompt})
-        print("LLM selected database (raw):", result)
-        selected_db_name = [temp for temp in collection_description if result.strip() in temp][0]
-        print("LLM selected database:", selected_db_name)
-    except Exception as e:
-        logger.error(f"Exception calling LLM API: {e}. Falling back to first file.")
-        # Fallback to the first file if LLM fails
-        selected_db_name = ""
+    if query_embedding is None:
+        query_embedding = await embed_query(query)
+    selected_db_name = await get_dataset_selector_service().select(query, collection, query_embedding)
+    if selected_db_name is None:
+        logger.info(f"No dataset of '{collection}' matches the query.")
+        return None, None, {}, "", ""
+    print("Selected database:", description_summary(selected_db_name)[:200])
 
     _collection_name = selected_db_name.split("_")[0] if selected_db_name else ""
     _type = selected_db_name.split("_")[1] if len(selected_db_name.split("_")) > 1 else ""
@@ -171,7 +159,8 @@ async def select_database(query:str, collection: str) -> tuple | None:
     _selected_metadata = "_".join(selected_db_name.split("_")[3:]) if len(selected_db_name.split("_")) > 3 else ""
 
     if _type == "xlsx":
-        return select_excel_database(_name_data, collection, _selected_metadata)
+        # Excel reading / decoding stays synchronous: keep it off the event loop
+        return await asyncio.to_thread(select_excel_database, _name_data, collection, _selected_metadata)
     else:
         key = settings.DATAFRAME_CACHE_DEFINE.format(
             collection=_collection_name,
@@ -180,7 +169,10 @@ async def select_database(query:str, collection: str) -> tuple | None:
         )
         print("Selecting server database with key:", key)
         print("Selected metadata:", _selected_metadata)
-        return select_server_database(key, _selected_metadata, None, selected_db_name, _selected_metadata)
+        if columns is None and time_range is None:
+            columns, time_range = await aplan_dataset_query(key, query, _selected_metadata)
+        return await select_server_database(key, _selected_metadata, None, selected_db_name, _selected_metadata,
+                                      columns=columns, time_range=time_range)
 
 
 def select_excel_database(selected_db_name: str, collection: str, descriptions: str) -> tuple:
@@ -219,9 +211,11 @@ def select_excel_database(selected_db_name: str, collection: str, descriptions:
 
     return data_df, descriptions, permission, os.path.basename(selected_path), descriptions
 
-def select_server_database(key:str, master_description: str, permission: dict, selected_path: str, description: str) -> tuple:
+async def select_server_database(key:str, master_description: str, permission: dict, selected_path: str, description: str,
+                                 columns: Optional[list] = None, time_range: Optional[TimeRange] = None) -> tuple:
     print("Selecting server database with key:", key)
-    result = r.get(key)
-    result = pickle.loads(result)
+    # One small version GET when the decoded table is already in this process;
+    # otherwise only the partitions of `time_range` and the column groups of `columns` are fetched
+    result = await aget_dataset(key, columns=columns, time_range=time_range)
     print(result.iloc[:5])
     return result, master_description, {}, "selected_path", description
\ No newline at end of file
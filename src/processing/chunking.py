@@ -1,35 +1,169 @@
-from chonkie import SemanticChunker
-from llm.ModelEmbedding import get_embedding_model_service
+import logging
+import re
+from typing import Callable, List, Optional, Tuple
 
-model_embedding_service = get_embedding_model_service()
-# Basic initialization with default parameters
-chunker = SemanticChunker(
-    embedding_model=model_embedding_service,
-    threshold=0.8,
-    chunk_size=2048,
-    similarity_window=3,
-    skip_window=0
-)
+import numpy as np
 
-from chonkie import ChromaHandshake, SemanticChunker
+from config import settings
 
-print("Setting up ChromaDB handshake...")
-handshake = ChromaHandshake(path="./query_retrieval_db")
+logger = logging.getLogger(__name__)
 
+CHUNK_STRATEGIES = ("fixed", "sentence", "semantic")
+DEFAULT_CHUNK_STRATEGY = getattr(settings, "CHUNK_STRATEGY", "sentence")
+# Limits are in tokens of the embedding model's tokenizer
+CHUNK_MAX_TOKENS = getattr(settings, "CHUNK_MAX_TOKENS", 256)
+CHUNK_OVERLAP_TOKENS = getattr(settings, "CHUNK_OVERLAP_TOKENS", 32)
+# "semantic": adjacent sentences less similar than this start a new chunk
+SEMANTIC_CHUNK_THRESHOLD = getattr(settings, "SEMANTIC_CHUNK_THRESHOLD", 0.5)
 
-# 5. SEARCH FUNCTION: This is the function you wanted to write
-def search(query_text, n_results=2):
+# End of a sentence (., !, ?, … followed by whitespace) or a blank line between paragraphs
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…])\s+|\n\s*\n\s*")
+WORD = re.compile(r"\S+")
+
+Span = Tuple[int, int]
+
+
+def split_sentences(text: str) -> List[Span]:
+    """(start, end) of every sentence, found in one regex pass; spans exclude the separating whitespace."""
+    spans = []
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text):
+        spans.append((start, len(text)))
+    return spans
+
+
+def split_words(text: str, start: int = 0, end: Optional[int] = None) -> List[Span]:
+    return [match.span() for match in WORD.finditer(text, start, len(text) if end is None else end)]
+
+
+class Chunker:
     """
-    Searches the ChromaDB for the most relevant chunks based on a query.
+    Splits page text into chunks bounded by a token budget of the embedding tokenizer.
+
+    Strategies:
+      - "fixed":    packs words up to `max_tokens`, ignoring sentence boundaries.
+      - "sentence": packs whole sentences up to `max_tokens`; a sentence longer than the
+                    budget is split on words.
+      - "semantic": like "sentence", but also starts a new chunk where the similarity of
+                    adjacent sentence embeddings drops below `threshold`.
+
+    Consecutive chunks share up to `overlap_tokens` of trailing units. Each unit is
+    tokenized once and packing is a single forward pass, so cost is linear in the text.
+    Returns chunks as contiguous slices of the input with their (start, end) offsets.
+    """
+
+    def __init__(
+            self,
+            embedding_model,
+            strategy: str = DEFAULT_CHUNK_STRATEGY,
+            max_tokens: int = CHUNK_MAX_TOKENS,
+            overlap_tokens: int = CHUNK_OVERLAP_TOKENS,
+            threshold: float = SEMANTIC_CHUNK_THRESHOLD
+    ):
+        if strategy not in CHUNK_STRATEGIES:
+            raise ValueError(f"Unknown chunking strategy '{strategy}'. Choose one of {CHUNK_STRATEGIES}.")
+        if not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.embedding_model = embedding_model
+        self.strategy = strategy
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.threshold = threshold
+        self._count_tokens: Callable[[str], int] = embedding_model.get_tokenizer_or_token_counter()
+        # The counter adds special tokens ([CLS]/[SEP]) to every call; count them once per chunk instead
+        self._special_tokens = self._count_tokens("")
 
-    Args:
-        query_text (str): The question or text to search for.
-        n_results (int): The number of top results to return.
+    def _unit_tokens(self, text: str, spans: List[Span]) -> List[int]:
+        units = [text[start:end] for start, end in spans]
+        if hasattr(self.embedding_model, "count_tokens_batch"):
+            # One tokenizer call (one request with the embedding server) for all spans
+            counts = self.embedding_model.count_tokens_batch(units)
+        else:
+            counts = [self._count_tokens(unit) for unit in units]
+        return [max(count - self._special_tokens, 1) for count in counts]
 
-    Returns:
-        list: A list of search result objects.
+    def _units(self, text: str) -> Tuple[List[Span], List[int], List[bool]]:
+        """Units to pack, their token counts, and whether a chunk must start before each unit."""
+        if self.strategy == "fixed":
+            spans = split_words(text)
+            tokens = self._unit_tokens(text, spans)
+            return spans, tokens, [False] * len(spans)
+
+        sentences = split_sentences(text)
+        sentence_tokens = self._unit_tokens(text, sentences)
+        breaks = [False] * len(sentences)
+        if self.strategy == "semantic" and len(sentences) > 1:
+            embeddings = np.asarray(self.embedding_model.embed_batch([text[s:e] for s, e in sentences]),
+                                    dtype=np.float32)
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+            similarity = np.einsum("ij,ij->i", embeddings[:-1], embeddings[1:])
+            breaks = [False] + (similarity < self.threshold).tolist()
+
+        budget = self.max_tokens - self._special_tokens
+        # Sentences over the budget are split on words; all their words are counted in one call
+        words = {i: split_words(text, *span) for i, (span, count) in enumerate(zip(sentences, sentence_tokens))
+                 if count > budget}
+        word_tokens = iter(self._unit_tokens(text, [word for i in sorted(words) for word in words[i]]))
+
+        spans, tokens, starts = [], [], []
+        for i, (span, count, must_break) in enumerate(zip(sentences, sentence_tokens, breaks)):
+            if i not in words:
+                spans.append(span)
+                tokens.append(count)
+                starts.append(must_break)
+                continue
+            spans.extend(words[i])
+            tokens.extend(next(word_tokens) for _ in words[i])
+            starts.extend([must_break] + [False] * (len(words[i]) - 1))
+        return spans, tokens, starts
+
+    def chunk(self, text: str) -> Tuple[List[str], List[Span]]:
+        if not text or not text.strip():
+            return [], []
+        spans, tokens, starts = self._units(text)
+        budget = self.max_tokens - self._special_tokens
+
+        chunks, offsets = [], []
+        first = 0  # first unit of the current chunk
+        total = 0
+        index = 0
+        while index < len(spans):
+            if index > first and (total + tokens[index] > budget or starts[index]):
+                chunks.append(text[spans[first][0]:spans[index - 1][1]])
+                offsets.append((spans[first][0], spans[index - 1][1]))
+                # Carry trailing units into the next chunk as overlap (never the whole chunk)
+                carry = index
+                carried = 0
+                if not starts[index]:
+                    while (carry - 1 > first and carried + tokens[carry - 1] <= self.overlap_tokens
+                           and carried + tokens[carry - 1] + tokens[index] <= budget):
+                        carry -= 1
+                        carried += tokens[carry]
+                first, total = carry, carried
+            total += tokens[index]
+            index += 1
+        chunks.append(text[spans[first][0]:spans[-1][1]])
+        offsets.append((spans[first][0], spans[-1][1]))
+        return chunks, offsets
+
+
+_chunker_instances = {}
+
+
+def get_chunker_service(strategy: str = DEFAULT_CHUNK_STRATEGY) -> Chunker:
     """
-    print(f"\n🔎 Searching for: '{query_text}'")
-    search_results = handshake.search(query=query_text, n_results=n_results)
-    return search_results
+    Returns the shared Chunker for a strategy, built on the embedding model's tokenizer.
+    """
+    if strategy not in _chunker_instances:
+        from llm.ModelEmbedding import get_embedding_model_service
+        _chunker_instances[strategy] = Chunker(get_embedding_model_service(), strategy=strategy)
+    return _chunker_instances[strategy]
+
 
+def chunk_text(text: str, strategy: str = DEFAULT_CHUNK_STRATEGY) -> Tuple[List[str], List[Span]]:
+    """Splits text into chunks with the shared chunker; returns (chunks, [(start, end), ...])."""
+    return get_chunker_service(strategy).chunk(text)
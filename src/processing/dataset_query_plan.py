@@ -0,0 +1,190 @@
+"""
+Derives what of a partitioned dataset a query needs before it is loaded.
+
+- time range: explicit periods in the query ("tháng 3/2024", "quý 2 năm 2024",
+  "từ tháng 1 đến tháng 6 năm 2024", "năm 2023", "2024-03"). Relative periods
+  ("tháng trước", "cùng kỳ", ...) or a month without a year leave it unrestricted.
+- columns: the dimension (non-numeric) and identifier ("mã ...", *_FK) columns are always
+  kept, since the query may filter on any of their values; numeric measure columns are
+  kept only when the query names them or the leading phrase of their description (the
+  "COLUMN: meaning" lines of the master description), all of them when it names none.
+  Columns described as unused ("KHÔNG XÀI") are dropped.
+
+Only partitioned datasets are planned: a single-value dataset is decoded whole anyway.
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pandas as pd
+from unidecode import unidecode
+
+from config import settings
+from database.dataset_partitions import DATASET_TIME_COLUMNS, TimeRange, aread_manifest
+from processing.dataset_selector import COLUMN_DETAILS_MARKER
+
+logger = logging.getLogger(__name__)
+
+# Derive columns / time range from the query for partitioned datasets
+DATASET_QUERY_PLANNING = getattr(settings, "DATASET_QUERY_PLANNING", True)
+# Columns always loaded: the row-level authorization filters on them (utils/helper_authorization.py)
+DATASET_ALWAYS_LOAD_COLUMNS = getattr(settings, "DATASET_ALWAYS_LOAD_COLUMNS", ("GSBH_FK", "DDKD_FK", "NHANVIEN_FK"))
+
+# Matched on the accent-folded, lower-cased query
+_RELATIVE_PERIOD = re.compile(
+    r"\b(cung ky|thang (nay|truoc|sau)|nam (nay|truoc|ngoai|sau)|quy (nay|truoc|sau)|gan day|vua qua|hien tai)\b")
+_MONTH_RANGE = re.compile(
+    r"\bthang\s*(\d{1,2})\s*(?:den|toi|-)\s*(?:thang\s*)?(\d{1,2})\s*(?:/|-|nam)\s*(20\d{2})\b")
+_QUARTER = re.compile(r"\bquy\s*(iv|iii|ii|i|[1-4])\s*(?:/|-|nam)?\s*(20\d{2})\b")
+# A bare number before "năm" / "-" is not a month ("top 10 - 2024", "2 năm 2023"): without
+# "tháng" only M/YYYY or MM/YYYY is read as a month (otherwise the whole year is loaded)
+_MONTH_YEAR = re.compile(r"\bthang\s*(\d{1,2})\s*(?:/|-|nam)\s*(20\d{2})\b")
+_MONTH_YEAR_NUMERIC = re.compile(r"\b(\d{1,2})/(20\d{2})\b")
+_YEAR_MONTH = re.compile(r"\b(20\d{2})[-/](\d{1,2})\b")
+_YEAR = re.compile(r"\b(?:nam\s*)?(20\d{2})\b")
+_MONTH_ONLY = re.compile(r"\bthang\s*\d{1,2}\b")
+_COLUMN_LINE = re.compile(r"^\s*([A-Z][A-Z0-9_]*)\s*:\s*(.*)$", re.MULTILINE)
+_WORD = re.compile(r"[a-z0-9]+")
+_QUARTERS = {"i": 1, "ii": 2, "iii": 3, "iv": 4}
+
+
+def _fold(text: str) -> str:
+    return unidecode(text).lower()
+
+
+def plan_time_range(query: str) -> Optional[TimeRange]:
+    """The (NAM, THANG) span covering every explicit period of the query, or None (load all)."""
+    text = _fold(query)
+    if _RELATIVE_PERIOD.search(text):
+        return None
+    periods: List[Tuple[Tuple[int, int], Tuple[int, int]]] = []
+
+    def take(pattern: re.Pattern, to_period) -> None:
+        nonlocal text
+        for match in pattern.finditer(text):
+            periods.append(to_period(match))
+        text = pattern.sub(" ", text)
+
+    take(_MONTH_RANGE, lambda m: ((int(m[3]), int(m[1])), (int(m[3]), int(m[2]))))
+    take(_QUARTER, lambda m: ((int(m[2]), 3 * (_QUARTERS.get(m[1]) or int(m[1])) - 2),
+                              (int(m[2]), 3 * (_QUARTERS.get(m[1]) or int(m[1])))))
+    take(_YEAR_MONTH, lambda m: ((int(m[1]), int(m[2])), (int(m[1]), int(m[2]))))
+    take(_MONTH_YEAR, lambda m: ((int(m[2]), int(m[1])), (int(m[2]), int(m[1]))))
+    take(_MONTH_YEAR_NUMERIC, lambda m: ((int(m[2]), int(m[1])), (int(m[2]), int(m[1]))))
+    take(_YEAR, lambda m: ((int(m[1]), 1), (int(m[1]), 12)))
+    if not periods or _MONTH_ONLY.search(text):
+        # No period, or a month whose year is unknown
+        return None
+    if any(not 1 <= thang <= 12 for start, end in periods for _, thang in (start, end)):
+        return None
+    return min(start for start, _ in periods), max(end for _, end in periods)
+
+
+def _column_details(description: str) -> Dict[str, str]:
+    if COLUMN_DETAILS_MARKER not in description:
+        return {}
+    details = description.split(COLUMN_DETAILS_MARKER, 1)[1]
+    return {column: _fold(meaning) for column, meaning in _COLUMN_LINE.findall(details)}
+
+
+def _is_identifier(column: str, meaning: str) -> bool:
+    return column.endswith("_FK") or column.endswith("_ID") or meaning.startswith("ma ")
+
+
+def _is_numeric(dtype: Optional[str]) -> bool:
+    try:
+        return dtype is not None and pd.api.types.is_numeric_dtype(pd.api.types.pandas_dtype(dtype))
+    except TypeError:
+        return False
+
+
+def plan_columns(query: str, description: str, manifest: Dict[str, Any]) -> Optional[List[str]]:
+    """The dataset columns the query may need (see module docstring), or None for all of them."""
+    details = _column_details(description)
+    words = _WORD.findall(_fold(query))
+    query_bigrams = {" ".join(pair) for pair in zip(words, words[1:])}
+    query_words = set(words)
+
+    def mentioned(column: str) -> bool:
+        if column.lower() in query_words:
+            return True
+        # Only the leading phrase names the measure; the rest explains it in generic words
+        meaning = _WORD.findall(re.split(r"[.,(:;]", details.get(column, ""), 1)[0])
+        # Vietnamese words are mostly two syllables: single syllables match far too much
+        return any(" ".join(pair) in query_bigrams for pair in zip(meaning, meaning[1:]))
+
+    dtypes = manifest.get("dtypes", {})
+    unused = {column for column, meaning in details.items() if meaning.strip().rstrip(".") == "khong xai"}
+    measures = [column for column in manifest["columns"] if _is_numeric(dtypes.get(column))
+                and column not in DATASET_TIME_COLUMNS and column not in DATASET_ALWAYS_LOAD_COLUMNS
+                and not _is_identifier(column, details.get(column, ""))]
+    wanted_measures = {column for column in measures if mentioned(column)}
+    if not wanted_measures:
+        # Nothing recognisable is asked for: keep every measure rather than guess
+        wanted_measures = set(measures)
+
+    columns = [column for column in manifest["columns"]
+               if column not in unused and (column not in measures or column in wanted_measures)]
+    return None if len(columns) == len(manifest["columns"]) else columns
+
+
+async def aplan_dataset_query(key: str, query: str, description: str) -> Tuple[Optional[List[str]], Optional[TimeRange]]:
+    """(columns, time_range) to load of the dataset under `key` for `query`; (None, None) loads everything."""
+    if not DATASET_QUERY_PLANNING:
+        return None, None
+    try:
+        manifest = await aread_manifest(key)
+    except Exception as e:
+        logger.warning(f"Could not read the manifest of '{key}' to plan the query: {e}")
+        return None, None
+    if manifest is None:
+        return None, None
+    time_range = plan_time_range(query)
+    columns = plan_columns(query, description, manifest)
+    logger.info(f"Query plan for '{key}': time_range={time_range}, "
+                f"{len(columns) if columns is not None else len(manifest['columns'])}/{len(manifest['columns'])} columns")
+    return columns, time_range
+
+
+# (query, expected plan_time_range); run with `python -m processing.dataset_query_plan check`
+PLAN_EXAMPLES = [
+    ("Doanh thu tháng 3/2024 của nhãn Panadol", ((2024, 3), (2024, 3))),
+    ("doanh số tháng 3 năm 2024", ((2024, 3), (2024, 3))),
+    ("doanh số quý 2 năm 2024", ((2024, 4), (2024, 6))),
+    ("quý IV 2023", ((2023, 10), (2023, 12))),
+    ("từ tháng 1 đến tháng 6 năm 2024 doanh thu", ((2024, 1), (2024, 6))),
+    ("2024-03 bán được bao nhiêu", ((2024, 3), (2024, 3))),
+    ("doanh thu 03/2024", ((2024, 3), (2024, 3))),
+    ("top 10-2024", ((2024, 1), (2024, 12))),
+    ("doanh thu tháng 10-2024", ((2024, 10), (2024, 10))),
+    ("ngày 15/3/2024", ((2024, 3), (2024, 3))),
+    ("so sánh năm 2023 và 2024", ((2023, 1), (2024, 12))),
+    ("doanh số 2 năm 2023 và 2024", ((2023, 1), (2024, 12))),
+    ("top 10 - 2024 sản phẩm", ((2024, 1), (2024, 12))),
+    ("top 5 năm 2024", ((2024, 1), (2024, 12))),
+    ("tháng 3 doanh thu", None),
+    ("doanh thu tháng trước", None),
+    ("top khách hàng", None),
+]
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Inspect the time range derived from a query")
+    parser.add_argument("action", choices=["check", "plan"],
+                        help="check: verify PLAN_EXAMPLES; plan: print the time range of --query")
+    parser.add_argument("--query", default="", help="Query to plan")
+    args = parser.parse_args()
+
+    if args.action == "plan":
+        print(plan_time_range(args.query))
+    else:
+        failures = 0
+        for example, expected in PLAN_EXAMPLES:
+            planned = plan_time_range(example)
+            status = "ok" if planned == expected else "FAIL"
+            failures += planned != expected
+            print(f"{status:4} {example!r}: {planned} (expected {expected})")
+        sys.exit(1 if failures else 0)
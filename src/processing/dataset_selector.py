@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import math
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+
+from config import settings
+from context_engine.rag_prompt import SELECT_EXCEL_FILE_PROMPT_TEMPLATE
+from database.redis_connection import get_async_redis, r
+
+logger = logging.getLogger(__name__)
+
+# Bumped by every write to settings.LIST_MASTER_DATA_DESCRIPTION; indexes are rebuilt when it changes
+MASTER_DESCRIPTIONS_VERSION_KEY = "master_descriptions_version"
+# Weight of the embedding side in the combined score (the rest is normalised BM25)
+DATASET_EMBEDDING_WEIGHT = getattr(settings, "DATASET_EMBEDDING_WEIGHT", 0.7)
+# The top dataset is returned without the LLM when it leads the runner-up by at least this much
+DATASET_SELECTION_MARGIN = getattr(settings, "DATASET_SELECTION_MARGIN", 0.05)
+# Candidates shown to the LLM when it has to break a tie
+DATASET_SELECTION_CANDIDATES = getattr(settings, "DATASET_SELECTION_CANDIDATES", 3)
+
+# Column details follow this marker in a description; they are kept for BM25 but not embedded or prompted
+COLUMN_DETAILS_MARKER = "Các cột chi tiết trong bảng dữ liệu bao gồm"
+TOKEN = re.compile(r"\w+", re.UNICODE)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def bump_master_descriptions_version() -> None:
+    """Marks the master description list as changed (call after rpush/lrem on it)."""
+    try:
+        r.incr(MASTER_DESCRIPTIONS_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not bump the master description version: {e}")
+
+
+async def _aget_master_descriptions_version() -> Optional[int]:
+    try:
+        version = await get_async_redis().get(MASTER_DESCRIPTIONS_VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not read the master description version: {e}")
+        return None
+    return int(version) if version else 0
+
+
+def description_summary(master_description: str) -> str:
+    return master_description.split(COLUMN_DETAILS_MARKER)[0]
+
+
+def _tokenize(text: str) -> List[str]:
+    return TOKEN.findall(text.lower())
+
+
+class DatasetIndex:
+    """Embedding matrix and BM25 statistics over the master descriptions of one collection."""
+
+    def __init__(self, descriptions: List[str], embeddings: Sequence[np.ndarray]):
+        self.descriptions = descriptions
+        matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(descriptions), -1) if descriptions \
+            else np.zeros((0, 1), dtype=np.float32)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+        self.term_counts = [Counter(_tokenize(description)) for description in descriptions]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.avg_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        total = len(descriptions)
+        self.idf = {term: math.log(1 + (total - df + 0.5) / (df + 0.5)) for term, df in document_frequency.items()}
+
+    def bm25(self, query: str) -> np.ndarray:
+        terms = set(_tokenize(query))
+        scores = np.zeros(len(self.descriptions), dtype=np.float32)
+        for index, (counts, length) in enumerate(zip(self.term_counts, self.lengths)):
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * length / max(self.avg_length, 1e-9))
+            scores[index] = sum(self.idf[term] * counts[term] * (BM25_K1 + 1) / (counts[term] + norm)
+                                for term in terms if term in counts)
+        return scores
+
+    def rank(self, query: str, query_embedding: Sequence[float]) -> List[Tuple[str, float]]:
+        """(description, combined score) from best to worst."""
+        query_vector = np.array(query_embedding, dtype=np.float32)
+        query_vector /= max(float(np.linalg.norm(query_vector)), 1e-12)
+        similarity = self.matrix @ query_vector
+        keyword = self.bm25(query)
+        if keyword.max() > 0:
+            keyword /= keyword.max()
+        combined = DATASET_EMBEDDING_WEIGHT * similarity + (1 - DATASET_EMBEDDING_WEIGHT) * keyword
+        order = np.argsort(-combined)
+        return [(self.descriptions[i], float(combined[i])) for i in order]
+
+
+class DatasetSelector:
+    """
+    Picks the dataset (master description) of a collection that answers a query.
+
+    Ranks the collection's descriptions by embedding similarity plus BM25 and returns the
+    top one directly when it leads the runner-up by DATASET_SELECTION_MARGIN; otherwise
+    the LLM chooses among the top DATASET_SELECTION_CANDIDATES only. Per-collection
+    indexes live in memory and are rebuilt when the master description version changes,
+    reusing the embeddings of descriptions that did not change.
+    """
+
+    def __init__(self):
+        self._indexes: Dict[str, Tuple[Optional[int], DatasetIndex]] = {}
+        self._embeddings: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _build(self, collection: str) -> DatasetIndex:
+        from llm.ModelEmbedding import get_embedding_model_service
+
+        descriptions = [item.decode("utf-8") for item in r.lrange(settings.LIST_MASTER_DATA_DESCRIPTION, 0, -1)]
+        # Re-uploading a file appends the same description again: keep one of each
+        descriptions = list(dict.fromkeys(d for d in descriptions if d.split("_")[0] == collection))
+        missing = [d for d in descriptions if d not in self._embeddings]
+        if missing:
+            summaries = [description_summary(d) for d in missing]
+            for description, embedding in zip(missing, get_embedding_model_service().embed_batch(summaries)):
+                self._embeddings[description] = embedding
+        logger.info(f"Built dataset index for '{collection}': {len(descriptions)} datasets, {len(missing)} embedded")
+        return DatasetIndex(descriptions, [self._embeddings[d] for d in descriptions])
+
+    async def get_index(self, collection: str) -> DatasetIndex:
+        version = await _aget_master_descriptions_version()
+        cached = self._indexes.get(collection)
+        if cached is not None and version is not None and cached[0] == version:
+            return cached[1]
+        index = await asyncio.to_thread(self._build_locked, collection)
+        self._indexes[collection] = (version, index)
+        return index
+
+    def _build_locked(self, collection: str) -> DatasetIndex:
+        with self._lock:
+            return self._build(collection)
+
+    async def select(self, query: str, collection: str, query_embedding: Sequence[float]) -> Optional[str]:
+        """The selected master description, or None when the collection has no dataset or the LLM says NONE."""
+        index = await self.get_index(collection)
+        if not index.descriptions:
+            return None
+        ranked = index.rank(query, query_embedding)
+        if len(ranked) == 1 or ranked[0][1] - ranked[1][1] >= DATASET_SELECTION_MARGIN:
+            logger.info(f"Dataset selected without LLM (score {ranked[0][1]:.3f}): {ranked[0][0][:80]}")
+            return ranked[0][0]
+
+        candidates = [description for description, _ in ranked[:DATASET_SELECTION_CANDIDATES]]
+        return await self._llm_tie_break(query, candidates)
+
+    @staticmethod
+    async def _llm_tie_break(query: str, candidates: List[str]) -> Optional[str]:
+        from llm.llm_langchain import gemini_llm_service
+
+        db_metadata = "\n".join("\n----------------\n" + description_summary(d) for d in candidates)
+        prompt = SELECT_EXCEL_FILE_PROMPT_TEMPLATE.format(query=query, db_metadata_json=db_metadata)
+        try:
+            raw_prompt_template = ChatPromptTemplate.from_template("{prompt}")
+            simple_chain = raw_prompt_template | gemini_llm_service.bind(max_output_tokens=32) | StrOutputParser()
+            result = (await simple_chain.ainvoke({"prompt": prompt})).strip().strip('"')
+            logger.info(f"LLM tie-break among {len(candidates)} datasets: {result}")
+        except Exception as e:
+            logger.error(f"Exception calling LLM API: {e}. Falling back to the best ranked dataset.")
+            return candidates[0]
+        if result.upper() == "NONE":
+            return None
+        matches = [description for description in candidates if result and result in description]
+        return matches[0] if matches else candidates[0]
+
+
+_dataset_selector_instance: Optional[DatasetSelector] = None
+
+
+def get_dataset_selector_service() -> DatasetSelector:
+    """
+    Returns the singleton instance of the DatasetSelector.
+    """
+    global _dataset_selector_instance
+    if _dataset_selector_instance is None:
+        _dataset_selector_instance = DatasetSelector()
+    return _dataset_selector_instance
@@ -1,65 +1,86 @@
 import fitz
 import logging
+import multiprocessing
+import os
 import pandas as pd
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, Optional
+
+from config import settings
 
 logger = logging.getLogger(__name__)
 
+# PDFs with fewer pages are extracted in-process; the pool start-up is not worth it
+PDF_PARALLEL_MIN_PAGES = getattr(settings, "PDF_PARALLEL_MIN_PAGES", 64)
+PDF_PAGES_PER_TASK = getattr(settings, "PDF_PAGES_PER_TASK", 16)
+PDF_EXTRACT_WORKERS = getattr(settings, "PDF_EXTRACT_WORKERS", None) or os.cpu_count() or 1
 
-def extract_text_from_pdf(pdf_path: str) -> list[str]:
-    """Extracts all text from a PDF file, page by page."""
-    pages = []
+_extract_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_extract_pool() -> ProcessPoolExecutor:
+    global _extract_pool
+    if _extract_pool is None:
+        # spawn: the parent runs threads (ingestion workers, torch) that must not be forked
+        _extract_pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _extract_pool
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> list[str]:
+    # Each worker opens its own document: PyMuPDF objects cannot be shared across threads/processes
+    with fitz.open(pdf_path) as doc:
+        return [doc[page_index].get_text().lower() for page_index in range(start, stop)]
+
+
+def pdf_page_count(pdf_path: str) -> int:
     try:
         with fitz.open(pdf_path) as doc:
-            for page in doc:
-                text = page.get_text().lower()
-                pages.append(text)
-        return pages
+            return doc.page_count
     except Exception as e:
-        logger.error(f"Error extracting text from PDF {pdf_path}: {e}")
-        return []
+        logger.error(f"Error opening PDF {pdf_path}: {e}")
+        return 0
 
 
-def chunk_text(text: str, max_chars: int = 1000, overlap: int = 200) -> tuple[list[str], list[tuple[int, int]]]:
+def iter_pdf_pages(pdf_path: str, pages_per_task: int = PDF_PAGES_PER_TASK) -> Iterator[str]:
     """
-    Splits text into smaller chunks with overlap.
-    (This function remains the same as in the original file)
+    Yields the text of each page, in order.
+
+    Large PDFs are split into page ranges extracted by a process pool. Only a bounded
+    window of ranges is in flight at a time, so memory stays flat however slowly the
+    caller consumes pages.
     """
-    # ... (The full chunk_text function from the original file goes here) ...
-    chunks = []
-    chunk_indices = []
-
-    if not text:
-        return [], []
-
-    if len(text) <= max_chars:
-        return [text], [(0, len(text))]
-
-    start = 0
-    while start < len(text):
-        end = min(start + max_chars, len(text))
-
-        if end < len(text):
-            # Find a suitable break point (sentence or space)
-            break_point = text.rfind('. ', start, end)
-            if break_point != -1 and break_point > start:
-                end = break_point + 1
-            else:
-                break_point = text.rfind(' ', start, end)
-                if break_point != -1 and break_point > start:
-                    end = break_point + 1
-
-        chunk = text[start:end]
-        chunks.append(chunk)
-        chunk_indices.append((start, end))
-
-        if end >= len(text):
-            break
-
-        start = end - overlap
-        if start <= chunk_indices[-1][0]:  # Ensure progress
-            start = chunk_indices[-1][0] + 1
-
-    return chunks, chunk_indices
+    page_count = pdf_page_count(pdf_path)
+    if page_count < PDF_PARALLEL_MIN_PAGES:
+        with fitz.open(pdf_path) as doc:
+            for page in doc:
+                yield page.get_text().lower()
+        return
+
+    pool = _get_extract_pool()
+    ranges = deque((start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task))
+    in_flight = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < 2 * PDF_EXTRACT_WORKERS:
+                start, stop = ranges.popleft()
+                in_flight.append(pool.submit(_extract_page_range, pdf_path, start, stop))
+            yield from in_flight.popleft().result()
+    finally:
+        # The caller stopped early (error or close()): do not leave ranges queued on the shared pool
+        for future in in_flight:
+            future.cancel()
+
+
+def extract_text_from_pdf(pdf_path: str) -> list[str]:
+    """Extracts all text from a PDF file, page by page."""
+    try:
+        return list(iter_pdf_pages(pdf_path))
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF {pdf_path}: {e}")
+        return []
+
 
 def add_new_data(existing_df, new_file_path):
     if existing_df is None:
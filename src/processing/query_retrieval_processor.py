@@ -1,17 +1,49 @@
 #
 # File: query_pipeline.py
 #
-from typing import Dict, Optional, Literal
+import argparse
+import asyncio
+import json
+import logging
+import threading
+from typing import Dict, Iterable, List, Literal, Optional, Tuple
+
+import numpy as np
 
 # Assuming these are in your project structure
-from llm.ModelEmbedding import EmbeddingModel, get_embedding_model_service
+from config import settings
+from llm.ModelEmbedding import EmbeddingModel
+from llm.embedding_batcher import get_embedding_batcher_service
 from chonkie import ChromaHandshake
+from database.redis_connection import get_async_redis, r
+
+logger = logging.getLogger(__name__)
+
+# Cosine similarity a query needs with its closest category to count as a match,
+# for categories without a calibrated threshold of their own
+CLASSIFIER_MIN_SIMILARITY = getattr(settings, "CLASSIFIER_MIN_SIMILARITY", 0.5)
+# Bumped by every category / threshold write; other processes (the orchestrator) resync when it changes
+CLASSIFIER_VERSION_KEY = "classifier_categories_version"
+
+
+def _normalise(vectors) -> np.ndarray:
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix = matrix.reshape(-1, matrix.shape[-1]) if matrix.size else matrix.reshape(0, 0)
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
 
 
 class QueryClassifierPipeline:
     """
     A pipeline for classifying incoming queries against a predefined set of categories
-    using semantic similarity in a vector database.
+    using semantic similarity.
+
+    Category embeddings are held in memory as an L2-normalised matrix, so a query is
+    scored against every category with one dot product. ChromaDB is only the persistence
+    layer: it is written on every update and read by `sync_from_db` at startup and whenever
+    the Redis version CLASSIFIER_VERSION_KEY, bumped by every write from any process,
+    differs from the one last synced (checked with one GET per classification).
+    Each category may carry its own calibrated threshold (see `calibrate_thresholds`),
+    persisted in its Chroma metadata.
     """
 
     def __init__(
@@ -19,7 +51,8 @@ class QueryClassifierPipeline:
             embedding_model: EmbeddingModel,
             db_handshake: ChromaHandshake,
             categories: Optional[Dict[str, str]] = None,
-            threshold: float = 1.0
+            min_similarity: float = CLASSIFIER_MIN_SIMILARITY,
+            thresholds: Optional[Dict[str, float]] = None
     ):
         """
         Initializes the classification pipeline.
@@ -29,20 +62,113 @@ class QueryClassifierPipeline:
             db_handshake (ChromaHandshake): The ChromaDB connection manager.
             categories (Dict[str, str]): A dictionary where keys are category names (e.g., "Billing")
                                           and values are descriptive paragraphs for that category.
-            threshold (float): The maximum distance for a query to be considered a match.
-                               For ChromaDB's default L2 (Euclidean) distance, a lower value is stricter.
-                               A good starting point might be 1.0.
+            min_similarity (float): The minimum cosine similarity for a query to be considered a match,
+                                    used for categories without a calibrated threshold. Higher is stricter.
+            thresholds (Dict[str, float]): Calibrated per-category minimum similarities.
         """
 
         self.embedding_model = embedding_model
         self.db_handshake = db_handshake
         self.collection = db_handshake.collection  # Get a direct reference to the collection
         self.categories = categories or {}
-        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.thresholds: Dict[str, float] = dict(thresholds or {})
+        # (category names, normalised embedding rows); replaced as a whole so readers never see a half update
+        self._index: Tuple[List[str], np.ndarray] = ([], np.zeros((0, 0), dtype=np.float32))
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._synced_version: Optional[int] = None
         print("✅ QueryClassifierPipeline initialized.")
         print(f"   - Collection: '{self.collection.name}'")
         print(f"   - Categories to manage: {list(self.categories.keys())}")
-        print(f"   - Similarity Threshold (L2 Distance): {self.threshold}")
+        print(f"   - Default Similarity Threshold (cosine): {self.min_similarity}")
+
+    # ---- In-memory index ----
+    def _set_rows(self, names: List[str], embeddings) -> None:
+        """Inserts or replaces rows of the in-memory matrix."""
+        rows = _normalise(embeddings)
+        with self._write_lock:
+            current_names, current_matrix = self._index
+            new_names = list(current_names)
+            positions = {name: i for i, name in enumerate(new_names)}
+            matrix = current_matrix if current_matrix.size else np.zeros((0, rows.shape[1]), dtype=np.float32)
+            appended = []
+            matrix = matrix.copy()
+            for name, row in zip(names, rows):
+                if name in positions:
+                    matrix[positions[name]] = row
+                else:
+                    positions[name] = len(new_names)
+                    new_names.append(name)
+                    appended.append(row)
+            if appended:
+                matrix = np.vstack([matrix, np.asarray(appended, dtype=np.float32)])
+            self._index = (new_names, matrix)
+
+    # ---- Cross-process freshness ----
+    @staticmethod
+    def _read_version() -> Optional[int]:
+        try:
+            version = r.get(CLASSIFIER_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Could not read the classifier version: {e}")
+            return None
+        return int(version) if version else 0
+
+    @staticmethod
+    async def _aread_version() -> Optional[int]:
+        try:
+            version = await get_async_redis().get(CLASSIFIER_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"Could not read the classifier version: {e}")
+            return None
+        return int(version) if version else 0
+
+    def _bump_version(self) -> None:
+        try:
+            version = int(r.incr(CLASSIFIER_VERSION_KEY))
+        except Exception as e:
+            logger.warning(f"Could not bump the classifier version: {e}")
+            return
+        # Our own write: the in-memory state already has it, no resync needed
+        if self._synced_version == version - 1:
+            self._synced_version = version
+
+    def _refresh_if_stale(self, version: Optional[int]) -> None:
+        """Reloads from Chroma when another process changed the categories (None = Redis unavailable)."""
+        if version is None or version == self._synced_version:
+            return
+        with self._sync_lock:
+            if version != self._synced_version:
+                self.sync_from_db(version)
+
+    def threshold_for(self, category_name: str) -> float:
+        return self.thresholds.get(category_name, self.min_similarity)
+
+    def closest_category(self, query_embedding) -> Optional[Tuple[str, float]]:
+        """(name, cosine similarity) of the closest category, or None when there are no categories."""
+        names, matrix = self._index
+        if not names:
+            return None
+        scores = matrix @ _normalise(query_embedding)[0]
+        best = int(np.argmax(scores))
+        return names[best], float(scores[best])
+
+    # ---- Writes (memory + Chroma) ----
+    def _metadata(self, category_name: str) -> Optional[Dict[str, float]]:
+        # Chroma rejects empty metadata dicts: only send one when there is something to keep
+        if category_name in self.thresholds:
+            return {"threshold": self.thresholds[category_name]}
+        return None
+
+    def _persist(self, names: List[str], embeddings, descriptions: List[str]) -> None:
+        metadatas = [self._metadata(name) for name in names]
+        self.collection.upsert(
+            ids=names,
+            embeddings=[np.asarray(e, dtype=np.float32).tolist() for e in embeddings],
+            documents=descriptions,
+            **({"metadatas": metadatas} if all(metadatas) else {})
+        )
 
     def index_categories(self) -> None:
         """
@@ -60,70 +186,133 @@ class QueryClassifierPipeline:
 
         embeddings = self.embedding_model.embed_batch(category_descriptions)
 
-        self.collection.upsert(
-            ids=category_names,
-            embeddings=[e.tolist() for e in embeddings],
-            documents=category_descriptions
-        )
+        self._persist(category_names, embeddings, category_descriptions)
+        self._set_rows(category_names, embeddings)
+        self._bump_version()
         print(f"✅ Successfully indexed {len(category_names)} categories.")
 
     def add_or_update_category(self, category_name: str, category_description: str):
         """
-        Embeds and upserts a single category into the vector database.
+        Embeds and upserts a single category into the in-memory index and the vector database.
         """
         print(f"\n🔄 Upserting single category: '{category_name}'")
         embedding = self.embedding_model.embed(category_description)
-        self.collection.upsert(
-            ids=[category_name],
-            embeddings=[embedding.tolist()],
-            documents=[category_description]
-        )
+        self._persist([category_name], [embedding], [category_description])
+        self._set_rows([category_name], [embedding])
         self.categories[category_name] = category_description
+        self._bump_version()
         print(f"✅ Successfully upserted '{category_name}'.")
 
+    # ---- Classification ----
     def classify(self, query_text: str) -> Optional[Literal["FOUND", "NOT_FOUND"]]:
-        # This method requires no changes. It's already robust.
+        self._refresh_if_stale(self._read_version())
         query_embedding = self.embedding_model.embed(query_text)
-        results = self.collection.query(
-            query_embeddings=[query_embedding.tolist()],
-            n_results=1
-        )
-
-        if not results or not results.get('ids') or not results['ids'][0]:
-            print(f"\n🔎 Query: '{query_text}'")
-            print("   -> Classification: 'Unknown' (no categories in the database to compare against).")
-            return "NOT_FOUND"
-
-        closest_category = results['ids'][0][0]
-        distance = results['distances'][0][0]
+        return self._classify_embedding(query_text, query_embedding)
 
-        print(f"\n🔎 Query: '{query_text}'")
-        print(f"   -> Closest Match: '{closest_category}' (Distance: {distance:.4f})")
+    async def aclassify(self, query_text: str, query_embedding=None) -> Optional[Literal["FOUND", "NOT_FOUND"]]:
+        """
+        Async variant of `classify` that awaits the embedding instead of blocking the event loop.
+        Falls back to the blocking path if the embedding model has no `aembed`.
+        A `query_embedding` already computed for this request is used as is.
+        """
+        version = await self._aread_version()
+        if version is not None and version != self._synced_version:
+            await asyncio.to_thread(self._refresh_if_stale, version)
+        if query_embedding is None:
+            if hasattr(self.embedding_model, "aembed"):
+                query_embedding = await self.embedding_model.aembed(query_text)
+            else:
+                query_embedding = self.embedding_model.embed(query_text)
+        return self._classify_embedding(query_text, query_embedding)
 
-        if distance <= self.threshold:
-            print(f"   -> Classification: '{closest_category}' (within threshold of {self.threshold})")
-            return "FOUND"
-        else:
-            print(f"   -> Classification: 'Unknown' (distance exceeds threshold of {self.threshold})")
+    def _classify_embedding(self, query_text: str, query_embedding) -> Optional[Literal["FOUND", "NOT_FOUND"]]:
+        closest = self.closest_category(query_embedding)
+        if closest is None:
+            logger.debug(f"Query '{query_text}' -> NOT_FOUND (no categories to compare against)")
             return "NOT_FOUND"
 
+        closest_category, similarity = closest
+        threshold = self.threshold_for(closest_category)
+        result = "FOUND" if similarity >= threshold else "NOT_FOUND"
+        logger.debug(f"Query '{query_text}' -> closest '{closest_category}' "
+                     f"(similarity {similarity:.4f}, threshold {threshold:.4f}): {result}")
+        return result
+
     def __call__(self, query_text: str) -> Optional[Literal["FOUND", "NOT_FOUND"]]:
         return self.classify(query_text)
 
-    def sync_from_db(self):
+    # ---- Calibration ----
+    def calibrate_thresholds(self, examples: Iterable[Dict[str, Optional[str]]],
+                             persist: bool = True) -> Dict[str, float]:
+        """
+        Sets per-category thresholds from labelled queries.
+
+        Each example is {"query": ..., "category": name or None}; None (or a category
+        that does not exist) means the query should be NOT_FOUND. For every category, the
+        queries whose closest category it is are split into true matches and the rest,
+        and the threshold is the cut on their similarities with the fewest errors, placed
+        midway between the similarities on either side of it.
+        Categories no query lands on keep the default.
+        """
+        examples = list(examples)
+        embeddings = self.embedding_model.embed_batch([example["query"] for example in examples])
+        by_category: Dict[str, List[Tuple[float, bool]]] = {}
+        for example, embedding in zip(examples, embeddings):
+            closest = self.closest_category(embedding)
+            if closest is None:
+                continue
+            name, similarity = closest
+            by_category.setdefault(name, []).append((similarity, example.get("category") == name))
+
+        calibrated = {}
+        for name, scored in by_category.items():
+            scored.sort()
+            similarities = [similarity for similarity, _ in scored]
+            matches = sum(is_match for _, is_match in scored)
+            # Cut before index i: everything from i on is FOUND.
+            # Errors = true matches below the cut + non-matches from the cut on.
+            errors = len(scored) - matches
+            best_errors, best_cut = errors, 0
+            for i, (_, is_match) in enumerate(scored, start=1):
+                errors += 1 if is_match else -1
+                if errors < best_errors:
+                    best_errors, best_cut = errors, i
+            if best_cut == 0:
+                threshold = min(similarities[0], self.min_similarity)
+            elif best_cut == len(scored):
+                threshold = similarities[-1] + 1e-6
+            else:
+                threshold = (similarities[best_cut - 1] + similarities[best_cut]) / 2
+            calibrated[name] = float(threshold)
+            logger.info(f"Calibrated '{name}': threshold {threshold:.4f} from {len(scored)} queries "
+                        f"({matches} matches, {best_errors} errors)")
+
+        self.thresholds.update(calibrated)
+        if persist:
+            for name, threshold in calibrated.items():
+                self.collection.update(ids=[name], metadatas=[{"threshold": threshold}])
+            self._bump_version()
+        return calibrated
+
+    def sync_from_db(self, version: Optional[int] = None):
         """
         Loads all existing data from the ChromaDB collection into the pipeline's
-        in-memory 'self.categories' dictionary. This is crucial for synchronizing
-        state when the application restarts.
+        in-memory state: the 'self.categories' dictionary, the embedding matrix and the
+        calibrated thresholds. This is crucial for synchronizing state when the
+        application restarts; stored embeddings are reused, nothing is re-embedded.
+        `version` is the CLASSIFIER_VERSION_KEY value this state corresponds to.
         """
         print("🔄 Syncing pipeline state from database...")
+        # Read before loading: a write landing meanwhile leaves the version ahead and triggers another sync
+        version = self._read_version() if version is None else version
 
         # The .get() method in ChromaDB retrieves records.
         # By not providing IDs, we get all of them.
-        all_items = self.collection.get()
+        all_items = self.collection.get(include=["embeddings", "documents", "metadatas"])
 
-        if not all_items or not all_items['ids']:
+        if not all_items or not len(all_items['ids']):
             print("ℹ️ Database collection is empty. No categories to sync.")
+            self._synced_version = version
             return
 
         # Reconstruct the categories dictionary from the database records
@@ -131,9 +320,19 @@ class QueryClassifierPipeline:
             doc_id: doc
             for doc_id, doc in zip(all_items['ids'], all_items['documents'])
         }
+        thresholds = dict(self.thresholds)
+        for doc_id, metadata in zip(all_items['ids'], all_items.get('metadatas') or []):
+            if metadata and "threshold" in metadata:
+                thresholds[doc_id] = float(metadata["threshold"])
 
+        # Swapped in whole: concurrent classifications keep using the previous matrix meanwhile
+        with self._write_lock:
+            self._index = (list(all_items['ids']), _normalise(all_items['embeddings']))
         self.categories = synced_categories
-        print(f"✅ Sync complete. Loaded {len(self.categories)} categories from the database.")
+        self.thresholds = thresholds
+        self._synced_version = version
+        print(f"✅ Sync complete. Loaded {len(self.categories)} categories "
+              f"({len(self.thresholds)} calibrated thresholds) from the database.")
 
 
 # This global variable will hold our single instance
@@ -151,8 +350,9 @@ def get_classifier_pipeline() -> QueryClassifierPipeline:
     if _pipeline_instance is None:
         print("🚀 Initializing QueryClassifierPipeline for the first time...")
 
-        # 1. Get the shared dependencies (which are also singletons)
-        model_embedding_service = get_embedding_model_service()
+        # 1. Get the shared dependencies (which are also singletons).
+        # Query-time embeds go through the micro-batcher so concurrent turns share one forward pass.
+        model_embedding_service = get_embedding_batcher_service()
         handshake = ChromaHandshake(
             path="./classification_db",
             collection_name="global_classifier"
@@ -162,11 +362,22 @@ def get_classifier_pipeline() -> QueryClassifierPipeline:
         # We start it empty, as it will sync with the database.
         _pipeline_instance = QueryClassifierPipeline(
             embedding_model=model_embedding_service,
-            db_handshake=handshake,
-            threshold=55
+            db_handshake=handshake
         )
 
         # 3. (IMPORTANT) Sync the pipeline's memory with the database on startup
-        _pipeline_instance.sync_from_db()  # We need to add this method! See Step 2.
+        _pipeline_instance.sync_from_db()
+
+    return _pipeline_instance
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query classifier maintenance")
+    parser.add_argument("action", choices=["calibrate"], help="calibrate: per-category thresholds from labelled queries")
+    parser.add_argument("--examples", required=True,
+                        help='JSONL of {"query": ..., "category": <category name or null>}')
+    args = parser.parse_args()
 
-    return _pipeline_instance
\ No newline at end of file
+    with open(args.examples, encoding="utf-8") as f:
+        labelled = [json.loads(line) for line in f if line.strip()]
+    print(json.dumps(get_classifier_pipeline().calibrate_thresholds(labelled), indent=2, ensure_ascii=False))
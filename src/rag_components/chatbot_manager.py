@@ -1,8 +1,18 @@
+import asyncio
 import logging
-from typing import List, Dict, Any
+import threading
+import time
+from typing import List, Dict, Any, Optional
+
+from config import settings
+from database.redis_connection import r
 
 logger = logging.getLogger(__name__)
 
+# Redis pub/sub channel announcing changes to 'chatbot_info'
+CHATBOT_INFO_CHANNEL = "chatbot_info_changed"
+API_KEY_CACHE_TTL = getattr(settings, "API_KEY_CACHE_TTL", 300)
+
 class InvalidAPIKeyError(Exception):
     pass
 
@@ -33,21 +43,107 @@ def list_all_chatbots(typesense_client: Any) -> List[Dict[str, Any]]:
 
 
 
-def get_chatbot_name_by_api_key(typesense_client: Any, api_key: str) -> str:
-    """Validates an API key and returns the associated chatbot name."""
+class ApiKeyCache:
+    """
+    In-process API key -> chatbot name map.
+
+    Loaded with one scan of 'chatbot_info', refreshed when older than `ttl_seconds`
+    and invalidated immediately through Redis pub/sub whenever a chatbot is created,
+    updated or deleted (see TypesenseClient._notify_chatbot_info_changed).
+    """
+
+    def __init__(self, ttl_seconds: float = API_KEY_CACHE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._names_by_key: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._listener: Optional[threading.Thread] = None
+
+    def is_fresh(self) -> bool:
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds
+
+    def invalidate(self) -> None:
+        self._loaded_at = None
+
+    async def refresh(self, typesense_client: Any) -> None:
+        """Reloads the whole map with paginated searches over 'chatbot_info'."""
+        names_by_key = {}
+        page = 1
+        while True:
+            result = await typesense_client.search("chatbot_info", {
+                "q": "*",
+                "query_by": "name",
+                "include_fields": "name,api_key",
+                "per_page": 250,
+                "page": page
+            })
+            hits = result.get("hits", [])
+            for hit in hits:
+                doc = hit.get("document", {})
+                if doc.get("api_key"):
+                    names_by_key[doc["api_key"]] = doc.get("name")
+            if len(hits) < 250:
+                break
+            page += 1
+        self._names_by_key = names_by_key
+        self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(names_by_key)} chatbot API keys into the cache")
+
+    async def resolve(self, typesense_client: Any, api_key: str) -> Optional[str]:
+        if not self.is_fresh():
+            async with self._lock:
+                if not self.is_fresh():
+                    try:
+                        await self.refresh(typesense_client)
+                    except Exception as e:
+                        if self._loaded_at is None and not self._names_by_key:
+                            raise
+                        # Keep serving the previous map while Typesense is unavailable
+                        logger.warning(f"Could not refresh API key cache, using previous map: {e}")
+        return self._names_by_key.get(api_key)
+
+    def start_listener(self) -> None:
+        """Subscribes (in a daemon thread) to chatbot change notifications."""
+        if self._listener is not None:
+            return
+
+        def _listen():
+            while True:
+                try:
+                    pubsub = r.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(CHATBOT_INFO_CHANNEL)
+                    # Messages may have been missed while (re)connecting
+                    self.invalidate()
+                    for _ in pubsub.listen():
+                        self.invalidate()
+                except Exception as e:
+                    logger.warning(f"API key cache listener disconnected: {e}")
+                    time.sleep(5)
+
+        self._listener = threading.Thread(target=_listen, name="api-key-cache-listener", daemon=True)
+        self._listener.start()
+
+
+api_key_cache = ApiKeyCache()
+
+
+async def warm_api_key_cache(typesense_client: Any) -> None:
+    """Startup hook: loads every API key in one scan and starts the pub/sub listener."""
+    api_key_cache.start_listener()
     try:
-        result = typesense_client.client.collections["chatbot_info"].documents.search({
-            "q": "*",
-            "query_by": "api_key",
-            "filter_by": f"api_key:={api_key}",
-            "limit": 1
-        })
-        print(result)
-        if hits := result.get("hits"):
-            return hits[0]["document"]["name"]
+        await api_key_cache.refresh(typesense_client)
+    except Exception as e:
+        logger.error(f"Could not preload API key cache: {e}", exc_info=True)
+
+
+async def get_chatbot_name_by_api_key(typesense_client: Any, api_key: str) -> str:
+    """Validates an API key and returns the associated chatbot name (typesense_client is an AsyncTypesenseClient)."""
+    try:
+        if name := await api_key_cache.resolve(typesense_client, api_key):
+            return name
         raise InvalidAPIKeyError("Invalid API Key provided.")
     except Exception as e:
         logger.error(f"Error validating API key: {e}", exc_info=True)
         if not isinstance(e, InvalidAPIKeyError):
             raise Exception("Could not validate API key.") from e
-        raise
\ No newline at end of file
+        raise
@@ -0,0 +1,343 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from config import settings
+from database.redis_connection import get_async_redis, r
+from database.typesense_declare import get_typesense_instance_service
+from processing.analysis_processor import _read_excel_file_data
+from processing.dataset_selector import bump_master_descriptions_version
+from processing.query_retrieval_processor import get_classifier_pipeline
+from utils import helper_rag
+
+logger = logging.getLogger(__name__)
+
+INGESTION_QUEUE_KEY_PREFIX = "ingestion_jobs:queue:"
+INGESTION_PROCESSING_KEY_PREFIX = "ingestion_jobs:processing:"
+INGESTION_JOB_KEY_PREFIX = "ingestion_job:"
+INGESTION_LEASE_KEY_PREFIX = "ingestion_lease:"
+# Uploads are staged on local disk, so each node consumes its own queue. Nodes whose
+# INGESTION_STAGING_DIR and UPLOAD_DIR are on shared storage may share one node id.
+INGESTION_NODE_ID = getattr(settings, "INGESTION_NODE_ID", None) or socket.gethostname()
+# A running job whose lease is not renewed for this long (worker crashed) is put back on the queue
+INGESTION_LEASE_SECONDS = getattr(settings, "INGESTION_LEASE_SECONDS", 60)
+# Runs of one job (crash recoveries included) before it is marked failed
+INGESTION_MAX_ATTEMPTS = getattr(settings, "INGESTION_MAX_ATTEMPTS", 3)
+# Number of jobs processed concurrently by the local worker pool
+INGESTION_WORKERS = getattr(settings, "INGESTION_WORKERS", 2)
+# Finished jobs stay queryable for this long (seconds)
+INGESTION_JOB_TTL = getattr(settings, "INGESTION_JOB_TTL", 7 * 24 * 3600)
+INGESTION_STAGING_DIR = getattr(settings, "INGESTION_STAGING_DIR", "./temp/ingestion")
+
+# Share of the overall progress covered by each stage: stage -> (start, end)
+STAGE_SPANS = {
+    "queued": (0.0, 0.0),
+    # Pages are extracted, chunked, embedded and indexed as one streaming stage
+    "processing": (0.0, 0.95),
+    "cleanup": (0.95, 1.0),
+    "done": (1.0, 1.0),
+}
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def queue_key(node_id: str = INGESTION_NODE_ID) -> str:
+    return f"{INGESTION_QUEUE_KEY_PREFIX}{node_id}"
+
+
+def processing_key(node_id: str = INGESTION_NODE_ID) -> str:
+    return f"{INGESTION_PROCESSING_KEY_PREFIX}{node_id}"
+
+
+def staging_path(job_id: str, file_name: str) -> str:
+    """Where an uploaded PDF waits until a worker picks its job up."""
+    os.makedirs(INGESTION_STAGING_DIR, exist_ok=True)
+    return os.path.join(INGESTION_STAGING_DIR, f"{job_id}{os.path.splitext(file_name)[1]}")
+
+
+def _save_job(job: Dict[str, Any]) -> None:
+    job["updated_at"] = time.time()
+    r.set(f"{INGESTION_JOB_KEY_PREFIX}{job['job_id']}", json.dumps(job), ex=INGESTION_JOB_TTL)
+
+
+def get_job(job_id: str) -> Optional[Dict[str, Any]]:
+    payload = r.get(f"{INGESTION_JOB_KEY_PREFIX}{job_id}")
+    return json.loads(payload) if payload else None
+
+
+async def aget_job(job_id: str) -> Optional[Dict[str, Any]]:
+    payload = await get_async_redis().get(f"{INGESTION_JOB_KEY_PREFIX}{job_id}")
+    return json.loads(payload) if payload else None
+
+
+def _new_job(job_id: str, chatbot_name: str, file_type: str, file_path: str, file_name: str,
+             permissions: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    now = time.time()
+    return {
+        "job_id": job_id,
+        "node_id": INGESTION_NODE_ID,
+        "attempts": 0,
+        "chatbot_name": chatbot_name,
+        "file_type": file_type,
+        "file_path": file_path,
+        "file_name": file_name,
+        "permissions": permissions,
+        "status": "queued",
+        "stage": "queued",
+        "done": 0,
+        "total": 0,
+        "progress": 0.0,
+        "result": None,
+        "error": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+
+def enqueue_job(job_id: str, chatbot_name: str, file_type: str, file_path: str, file_name: str,
+                permissions: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Registers an ingestion job and pushes it on the queue of this node (where its file was saved)."""
+    job = _new_job(job_id, chatbot_name, file_type, file_path, file_name, permissions)
+    _save_job(job)
+    r.rpush(queue_key(), job_id)
+    return job
+
+
+async def aenqueue_job(job_id: str, chatbot_name: str, file_type: str, file_path: str, file_name: str,
+                       permissions: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """enqueue_job for the event loop: the job record and the queue push go out in one MULTI."""
+    job = _new_job(job_id, chatbot_name, file_type, file_path, file_name, permissions)
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.set(f"{INGESTION_JOB_KEY_PREFIX}{job_id}", json.dumps(job), ex=INGESTION_JOB_TTL)
+        pipe.rpush(queue_key(), job_id)
+        await pipe.execute()
+    return job
+
+
+def ingest_excel_file(chatbot_name: str, destination_path: str, permissions: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Registers the master description, writes the permission sheet and updates the classifier for an uploaded workbook."""
+    master_df = pd.read_excel(destination_path, sheet_name="master")
+    if not master_df.empty:
+        description = "\n".join(master_df.iloc[:, 0].astype(str).tolist())
+        name_master_description = settings.MASTER_DESCRIPTION_DEFINE.format(
+            collection=chatbot_name,
+            type="xlsx",
+            full_path=destination_path,
+            description=description
+        )
+        r.rpush(settings.LIST_MASTER_DATA_DESCRIPTION, name_master_description)
+        bump_master_descriptions_version()
+
+    permission_df = None
+    if permissions:
+        data_for_df = []
+        for key, value in permissions.items():
+            string_value = json.dumps(value) if isinstance(value, (list, dict)) else str(value)
+            data_for_df.append([key, string_value])
+        permission_df = pd.DataFrame(data_for_df, columns=['Permission', 'Value'])
+
+    # Ghi lại tất cả các sheet (kèm sheet 'permission' nếu có) vào file
+    all_sheets_dfs = pd.read_excel(destination_path, sheet_name=None)
+    with pd.ExcelWriter(destination_path, engine='openpyxl', mode='w') as writer:
+        for sheet_name, df_to_write in all_sheets_dfs.items():
+            df_to_write.to_excel(writer, sheet_name=sheet_name, index=False)
+        if permission_df is not None:
+            permission_df.to_excel(writer, sheet_name="permission", index=False)
+
+    _, _, _, description, _ = _read_excel_file_data(str(destination_path))
+    get_classifier_pipeline().add_or_update_category(destination_path, description)
+
+    file_name = os.path.basename(destination_path)
+    get_typesense_instance_service().upsert_catalog_entry(
+        chatbot_name, file_name, file_name, "excel", page_count=len(all_sheets_dfs) + (permission_df is not None),
+        chunk_count=1, content_hash=helper_rag.file_content_hash(destination_path)
+    )
+    return {"document_id": file_name, "file_name": file_name, "num_chunks": 1}
+
+
+def run_job(job: Dict[str, Any]) -> None:
+    """Runs one job to completion, recording stage and progress in Redis as it goes."""
+    job.update(status="running", stage="processing", error=None, attempts=job.get("attempts", 0) + 1)
+    _save_job(job)
+
+    def on_progress(stage: str, done: int, total: int) -> None:
+        start, end = STAGE_SPANS.get(stage, (job["progress"], job["progress"]))
+        job.update(stage=stage, done=done, total=total,
+                   progress=round(start + (end - start) * (done / total if total else 0), 4))
+        _save_job(job)
+
+    try:
+        if job["file_type"] == "pdf":
+            result = helper_rag.index_pdf_file(job["chatbot_name"], job["file_path"], job["file_name"],
+                                               get_typesense_instance_service(), on_progress=on_progress)
+        else:
+            result = ingest_excel_file(job["chatbot_name"], job["file_path"], job.get("permissions"))
+        job.update(status="succeeded", stage="done", progress=1.0, result=result)
+    except Exception as e:
+        logger.error(f"Ingestion job {job['job_id']} ({job['file_name']}) failed: {e}", exc_info=True)
+        job.update(status="failed", error=str(e))
+    finally:
+        # The staged PDF is only an upload buffer; workbooks live in UPLOAD_DIR
+        if job["file_type"] == "pdf" and os.path.exists(job["file_path"]):
+            try:
+                os.remove(job["file_path"])
+            except OSError as e:
+                logger.warning(f"Could not remove staged file {job['file_path']}: {e}")
+    _save_job(job)
+
+
+def _discard_abandoned_job(job: Dict[str, Any]) -> None:
+    """
+    Cleans up after a PDF job whose worker died on its last attempt: deletes the staged
+    file and the chunks (with their catalog entry) of the revision it left half-indexed.
+    """
+    if job["file_type"] != "pdf":
+        return
+    if os.path.exists(job["file_path"]):
+        try:
+            os.remove(job["file_path"])
+        except OSError as e:
+            logger.warning(f"Could not remove staged file {job['file_path']}: {e}")
+    typesense_client = get_typesense_instance_service()
+    try:
+        # index_pdf_file marks the entry "indexing" before its first write; the dead worker
+        # could not roll back, so the revision's chunks are partial and go in one bulk delete
+        for entry in typesense_client.find_catalog_entries(job["chatbot_name"], job["file_name"]):
+            if entry.get("status") == "indexing":
+                typesense_client.delete_document_by_id(job["chatbot_name"], entry["doc_uuid"])
+    except Exception as e:
+        logger.error(f"Could not delete the partial chunks of abandoned job {job['job_id']}: {e}")
+
+
+class IngestionWorkerPool:
+    """
+    Local pool of worker threads consuming this node's Redis ingestion queue.
+
+    Concurrency is bounded by the number of workers, so a burst of uploads queues up
+    instead of competing with query handling for CPU. A job is taken with BLMOVE onto the
+    node's processing list and holds a lease key renewed by a heartbeat thread while it
+    runs; the reaper puts jobs whose lease lapsed (crashed worker or process) back on the
+    queue, up to INGESTION_MAX_ATTEMPTS runs.
+    """
+
+    def __init__(self, num_workers: int = INGESTION_WORKERS, poll_timeout: int = 5):
+        self.num_workers = num_workers
+        self.poll_timeout = poll_timeout
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._running: set = set()
+        self._running_lock = threading.Lock()
+
+    def _renew_lease(self, job_id: str) -> None:
+        r.set(f"{INGESTION_LEASE_KEY_PREFIX}{job_id}", INGESTION_NODE_ID, ex=INGESTION_LEASE_SECONDS)
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            try:
+                item = r.blmove(queue_key(), processing_key(), self.poll_timeout, "LEFT", "RIGHT")
+            except Exception as e:
+                logger.warning(f"Ingestion queue unavailable: {e}")
+                self._stop.wait(self.poll_timeout)
+                continue
+            if item is None:
+                continue
+            job_id = item.decode("utf-8") if isinstance(item, bytes) else item
+            with self._running_lock:
+                self._running.add(job_id)
+            try:
+                self._renew_lease(job_id)
+                job = get_job(job_id)
+                if job is None:
+                    logger.warning(f"Ingestion job {job_id} expired before it was processed")
+                else:
+                    run_job(job)
+            finally:
+                with self._running_lock:
+                    self._running.discard(job_id)
+                r.lrem(processing_key(), 1, job_id)
+                r.delete(f"{INGESTION_LEASE_KEY_PREFIX}{job_id}")
+
+    def _heartbeat(self) -> None:
+        while not self._stop.wait(INGESTION_LEASE_SECONDS / 3):
+            with self._running_lock:
+                running = list(self._running)
+            for job_id in running:
+                try:
+                    self._renew_lease(job_id)
+                except Exception as e:
+                    logger.warning(f"Could not renew the lease of ingestion job {job_id}: {e}")
+            try:
+                self.reap()
+            except Exception as e:
+                logger.warning(f"Ingestion reaper failed: {e}")
+
+    def reap(self) -> int:
+        """Requeues this node's taken jobs whose lease lapsed; returns how many were requeued."""
+        requeued = 0
+        for raw in r.lrange(processing_key(), 0, -1):
+            job_id = raw.decode("utf-8") if isinstance(raw, bytes) else raw
+            if r.exists(f"{INGESTION_LEASE_KEY_PREFIX}{job_id}"):
+                continue
+            job = get_job(job_id)
+            # Just taken by a worker that has not set its lease yet
+            if job is not None and time.time() - job.get("updated_at", 0) < INGESTION_LEASE_SECONDS:
+                continue
+            # LREM decides which reaper (one per process) owns the requeue
+            if not r.lrem(processing_key(), 1, job_id):
+                continue
+            if job is None:
+                continue
+            if job.get("attempts", 0) >= INGESTION_MAX_ATTEMPTS:
+                job.update(status="failed", error=f"Worker lost {job['attempts']} times while processing the job")
+                _save_job(job)
+                logger.error(f"Ingestion job {job_id} abandoned after {job['attempts']} attempts")
+                _discard_abandoned_job(job)
+                continue
+            job.update(status="queued", stage="queued", updated_at=time.time())
+            # Record and queue entry go out together, so a crash here cannot lose the job
+            with r.pipeline(transaction=True) as pipe:
+                pipe.set(f"{INGESTION_JOB_KEY_PREFIX}{job_id}", json.dumps(job), ex=INGESTION_JOB_TTL)
+                pipe.rpush(queue_key(), job_id)
+                pipe.execute()
+            requeued += 1
+            logger.warning(f"Requeued ingestion job {job_id} ({job['file_name']}): its worker stopped renewing the lease")
+        return requeued
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for index in range(self.num_workers):
+            thread = threading.Thread(target=self._work, name=f"ingestion-worker-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="ingestion-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info(f"Started {self.num_workers} ingestion workers on node '{INGESTION_NODE_ID}'")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._threads = []
+
+
+_ingestion_pool_instance: Optional[IngestionWorkerPool] = None
+
+
+def get_ingestion_pool_service() -> IngestionWorkerPool:
+    """
+    Returns the singleton instance of the IngestionWorkerPool.
+    """
+    global _ingestion_pool_instance
+    if _ingestion_pool_instance is None:
+        _ingestion_pool_instance = IngestionWorkerPool()
+    return _ingestion_pool_instance
@@ -62,8 +62,8 @@ reformulation_chain = (
 )
 
 # 3. Create the new async function that wraps the logic
-async def reformulate_query_with_chain(query: str, chat_history: List[Dict], user_id:str, user_role:str) -> str:
-    """Reformulates a query to be standalone if chat history exists."""
+async def reformulate_standalone_query(query: str, chat_history: List[Dict]) -> str:
+    """Rewrites a query to be standalone if chat history exists (no user prefix: this is the text to embed)."""
     # Prepare inputs for the chain
     recent_history = chat_history[-5:]
 
@@ -76,4 +76,15 @@ async def reformulate_query_with_chain(query: str, chat_history: List[Dict], use
         "chat_history": context_str,
         "query": query,
     })
-    return f"Tôi là user: {user_id}, vai trò của tôi khi truy vấn: {user_role}. {reformulated.strip()}."
\ No newline at end of file
+    return reformulated.strip()
+
+
+def add_user_context(standalone_query: str, user_id: str, user_role: str) -> str:
+    """Prefixes a standalone query with who is asking, for the routing and answering prompts."""
+    return f"Tôi là user: {user_id}, vai trò của tôi khi truy vấn: {user_role}. {standalone_query}."
+
+
+async def reformulate_query_with_chain(query: str, chat_history: List[Dict], user_id:str, user_role:str) -> str:
+    """Reformulates a query to be standalone if chat history exists."""
+    standalone_query = await reformulate_standalone_query(query, chat_history)
+    return add_user_context(standalone_query, user_id, user_role)
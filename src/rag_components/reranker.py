@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+RERANK_ENABLED = getattr(settings, "RERANK_ENABLED", False)
+# Small multilingual cross-encoder (covers Vietnamese) that runs acceptably on CPU
+RERANK_MODEL = getattr(settings, "RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1")
+# "torch", "onnx" or "onnx-int8", same meaning as EMBEDDING_BACKEND
+RERANK_BACKEND = getattr(settings, "RERANK_BACKEND", "torch")
+RERANK_MAX_CANDIDATES = getattr(settings, "RERANK_MAX_CANDIDATES", 20)
+RERANK_LATENCY_BUDGET_MS = getattr(settings, "RERANK_LATENCY_BUDGET_MS", 150)
+RERANK_CACHE_SIZE = getattr(settings, "RERANK_CACHE_SIZE", 10000)
+# Reranked hits used for the answer context (the best one is expanded to its page window)
+RERANK_CONTEXT_TOP_N = getattr(settings, "RERANK_CONTEXT_TOP_N", 3)
+# Reranked hits scoring below this are left out of the context (None: keep the top n)
+RERANK_MIN_SCORE = getattr(settings, "RERANK_MIN_SCORE", None)
+
+
+class CrossEncoderReranker:
+    """
+    Reranks retrieval hits with a cross-encoder.
+
+    - Only the first `max_candidates` hits are scored; the rest keep their order after them.
+    - Scores are cached per (query hash, chunk id) in an in-process LRU.
+    - Per-pair latency is tracked; when scoring the uncached pairs is expected to exceed
+      `latency_budget_ms`, the stage is skipped and the hits are returned unchanged.
+    """
+
+    def __init__(
+            self,
+            model_name: str = RERANK_MODEL,
+            backend: str = RERANK_BACKEND,
+            max_candidates: int = RERANK_MAX_CANDIDATES,
+            latency_budget_ms: float = RERANK_LATENCY_BUDGET_MS,
+            cache_size: int = RERANK_CACHE_SIZE
+    ):
+        from sentence_transformers import CrossEncoder
+        from llm.ModelEmbedding import EMBEDDING_BACKENDS, _onnx_file_name, get_onnx_export_dir
+
+        if backend not in EMBEDDING_BACKENDS:
+            raise ValueError(f"Unknown rerank backend '{backend}'. Choose one of {EMBEDDING_BACKENDS}.")
+        if backend == "torch":
+            self.model = CrossEncoder(model_name, device="cpu")
+        else:
+            # Same export layout as the embedding model: python -m llm.ModelEmbedding export --cross-encoder
+            export_dir = get_onnx_export_dir(model_name)
+            file_name = _onnx_file_name(backend, export_dir)
+            if not os.path.exists(os.path.join(export_dir, file_name)):
+                raise FileNotFoundError(
+                    f"No ONNX export at {os.path.join(export_dir, file_name)}. "
+                    f"Run `python -m llm.ModelEmbedding export --model {model_name} --cross-encoder` first."
+                )
+            self.model = CrossEncoder(export_dir, device="cpu", backend="onnx", model_kwargs={"file_name": file_name})
+        self.max_candidates = max_candidates
+        self.latency_budget_ms = latency_budget_ms
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Exponential moving average of milliseconds per scored pair; None until first measurement
+        self._ms_per_pair: Optional[float] = None
+
+    def _cache_get(self, key: tuple) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, key: tuple, score: float) -> None:
+        with self._lock:
+            self._cache[key] = score
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def rerank(self, query: str, hits: List[Dict]) -> List[Dict]:
+        """Returns the hits reordered by cross-encoder score (`rerank_score` added to scored hits)."""
+        if len(hits) < 2:
+            return hits
+        candidates, rest = hits[:self.max_candidates], hits[self.max_candidates:]
+        query_hash = hashlib.sha1(query.encode("utf-8")).hexdigest()
+
+        scores: Dict[int, float] = {}
+        pending = []
+        for index, hit in enumerate(candidates):
+            doc = hit.get("document", {})
+            cached = self._cache_get((query_hash, doc.get("id")))
+            if cached is None:
+                pending.append(index)
+            else:
+                scores[index] = cached
+
+        if pending:
+            if self._ms_per_pair is not None and self._ms_per_pair * len(pending) > self.latency_budget_ms:
+                logger.info(f"Skipping rerank: {len(pending)} pairs at ~{self._ms_per_pair:.1f}ms "
+                            f"exceed the {self.latency_budget_ms}ms budget")
+                # Decay the estimate so a transient slowdown does not disable reranking for good
+                self._ms_per_pair *= 0.9
+                return hits
+            pairs = [(query, candidates[index].get("document", {}).get("text", "")) for index in pending]
+            start = time.perf_counter()
+            predicted = self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+            per_pair = (time.perf_counter() - start) * 1000 / len(pairs)
+            self._ms_per_pair = per_pair if self._ms_per_pair is None else 0.8 * self._ms_per_pair + 0.2 * per_pair
+            for index, score in zip(pending, predicted):
+                scores[index] = float(score)
+                self._cache_put((query_hash, candidates[index].get("document", {}).get("id")), float(score))
+
+        order = sorted(range(len(candidates)), key=lambda index: scores[index], reverse=True)
+        return [{**candidates[index], "rerank_score": scores[index]} for index in order] + rest
+
+
+_reranker_instance: Optional[CrossEncoderReranker] = None
+
+
+def get_reranker_service() -> Optional[CrossEncoderReranker]:
+    """
+    Returns the singleton reranker, or None when RERANK_ENABLED is off.
+    """
+    global _reranker_instance
+    if not RERANK_ENABLED:
+        return None
+    if _reranker_instance is None:
+        _reranker_instance = CrossEncoderReranker()
+    return _reranker_instance
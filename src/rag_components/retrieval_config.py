@@ -0,0 +1,61 @@
+import json
+import logging
+import time
+from typing import Dict, Optional
+
+from config import settings
+from database.redis_connection import get_async_redis, r
+from typing_class.rag_type import RetrievalConfig
+
+logger = logging.getLogger(__name__)
+
+RETRIEVAL_CONFIG_KEY_PREFIX = "retrieval_config:"
+DEFAULT_RETRIEVAL_MODE = getattr(settings, "RAG_RETRIEVAL_MODE", "vector")
+RETRIEVAL_CONFIG_CACHE_TTL = getattr(settings, "RETRIEVAL_CONFIG_CACHE_TTL", 30)
+
+# collection -> (loaded_at, config)
+_config_cache: Dict[str, tuple] = {}
+
+
+def _cache_config(collection_name: str, payload: Optional[bytes]) -> RetrievalConfig:
+    config = RetrievalConfig(**json.loads(payload)) if payload else RetrievalConfig(mode=DEFAULT_RETRIEVAL_MODE)
+    _config_cache[collection_name] = (time.monotonic(), config)
+    return config
+
+
+def get_retrieval_config(collection_name: str) -> RetrievalConfig:
+    """Returns the retrieval settings of a chatbot collection, falling back to the defaults."""
+    cached = _config_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < RETRIEVAL_CONFIG_CACHE_TTL:
+        return cached[1]
+    try:
+        payload = r.get(f"{RETRIEVAL_CONFIG_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not load retrieval config for '{collection_name}': {e}")
+        return cached[1] if cached else RetrievalConfig(mode=DEFAULT_RETRIEVAL_MODE)
+    return _cache_config(collection_name, payload)
+
+
+async def aget_retrieval_config(collection_name: str) -> RetrievalConfig:
+    """get_retrieval_config on the asyncio Redis pool (request path)."""
+    cached = _config_cache.get(collection_name)
+    if cached and time.monotonic() - cached[0] < RETRIEVAL_CONFIG_CACHE_TTL:
+        return cached[1]
+    try:
+        payload = await get_async_redis().get(f"{RETRIEVAL_CONFIG_KEY_PREFIX}{collection_name}")
+    except Exception as e:
+        logger.warning(f"Could not load retrieval config for '{collection_name}': {e}")
+        return cached[1] if cached else RetrievalConfig(mode=DEFAULT_RETRIEVAL_MODE)
+    return _cache_config(collection_name, payload)
+
+
+def save_retrieval_config(collection_name: str, config: RetrievalConfig) -> RetrievalConfig:
+    r.set(f"{RETRIEVAL_CONFIG_KEY_PREFIX}{collection_name}", config.model_dump_json())
+    _config_cache[collection_name] = (time.monotonic(), config)
+    return config
+
+
+async def asave_retrieval_config(collection_name: str, config: RetrievalConfig) -> RetrievalConfig:
+    await get_async_redis().set(f"{RETRIEVAL_CONFIG_KEY_PREFIX}{collection_name}", config.model_dump_json())
+    _config_cache[collection_name] = (time.monotonic(), config)
+    return config
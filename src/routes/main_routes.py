@@ -1,11 +1,18 @@
 # -- routes/main_routes.py --
 import os
+import threading
 from fastapi import FastAPI, HTTPException, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from utils.logging_config import *
 from routes import rag_routes, analysis_routes, rag_query_routes
 from database.typesense_declare import get_typesense_instance_service
+from database.typesense_async import get_async_typesense_instance_service
+from rag_components.chatbot_manager import warm_api_key_cache
+from rag_components.ingestion_jobs import get_ingestion_pool_service
+from database.dataframe_cache import DATAFRAME_PREWARM_KEYS, get_dataframe_cache_service
+from database.dataset_partitions import get_dataset
+from database.redis_connection import check_redis_connection, close_async_redis
 
 
 from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
@@ -56,6 +63,43 @@ app.add_middleware(LoggingMiddleware)
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 app.mount("/uploads", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
 
+@app.on_event("startup")
+async def connect_redis():
+    # Opens the first pooled asyncio connection (the import-time ping of redis_connection is gone)
+    await check_redis_connection()
+
+
+@app.on_event("startup")
+async def preload_api_key_cache():
+    # Load every chatbot API key once so request auth never round-trips to Typesense
+    await warm_api_key_cache(get_async_typesense_instance_service())
+
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    # Uploads are processed off the request path by a bounded local worker pool
+    get_ingestion_pool_service().start()
+
+
+@app.on_event("startup")
+async def prewarm_dataframe_cache():
+    # Decode the configured hot datasets in the background so the first queries hit the L1 cache
+    if DATAFRAME_PREWARM_KEYS:
+        threading.Thread(target=get_dataframe_cache_service().prewarm, args=(DATAFRAME_PREWARM_KEYS,),
+                         kwargs={"load": get_dataset},
+                         name="dataframe-prewarm", daemon=True).start()
+
+
+@app.on_event("shutdown")
+async def stop_ingestion_workers():
+    get_ingestion_pool_service().stop()
+
+
+@app.on_event("shutdown")
+async def close_redis_pool():
+    await close_async_redis()
+
+
 # Include your API routers
 app.include_router(rag_routes.router, prefix="/api/v1", tags=["RAG System"])
 app.include_router(analysis_routes.router, prefix="/api/v1", tags=["Data Analysis"])
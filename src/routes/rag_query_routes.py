@@ -1,12 +1,16 @@
+import asyncio
+
 from fastapi import Depends, Header, APIRouter
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
 from rag_components.llm_interface import reformulate_query_with_chain
-from routes.rag_routes import get_typesense_client
+from routes.rag_routes import get_async_typesense_client
+from database.typesense_async import AsyncTypesenseClient
 from typing_class.rag_type import *
 from rag_components.chatbot_manager import *
 from processing.analysis_processor import select_excel_database, select_database
+from llm.query_embedding import request_query_embedding
 from rag_components.agents.data_analyst_agent import analyze_dataframe
 from llm.llm_langchain import gemini_llm_service, local_llm_service
 from context_engine.reformulation_prompt import reformulation_query_prompt, not_known_prompt
@@ -17,24 +21,29 @@ router = APIRouter()
 
 
 @router.post("/query_rag")
-async def query_analyze_rag_document(request: QueryRequest, api_key: str = Header(...), typesense_client: Any = Depends(get_typesense_client)):
-    collection_name = get_chatbot_name_by_api_key(typesense_client, api_key)
+async def query_analyze_rag_document(request: QueryRequest, api_key: str = Header(...),
+                                     typesense_client: AsyncTypesenseClient = Depends(get_async_typesense_client)):
+    collection_name = await get_chatbot_name_by_api_key(typesense_client, api_key)
+    # Reuses the orchestrator's query embedding when it was shipped with the request
+    query_embedding = await request_query_embedding(request)
     database, master_sheet, row_rules, selected_db, db_description = await select_database(
-        request.query, collection_name)
+        request.query, collection_name, query_embedding)
 
     if database is None:
         return {
             "answer": not_known_prompt
         }
 
-    result_analyze = analyze_dataframe(df=database,
-                                       query=request.query,
-                                       master_data=master_sheet,
-                                       row_rules=row_rules,
-                                       user_id=request.user_id,
-                                       user_role=request.user_role,
-                                       selected_db=selected_db
-                                       )
+    # Authorization (sync Redis), code generation and execution are blocking: keep them off the event loop
+    result_analyze = await asyncio.to_thread(analyze_dataframe,
+                                             df=database,
+                                             query=request.query,
+                                             master_data=master_sheet,
+                                             row_rules=row_rules,
+                                             user_id=request.user_id,
+                                             user_role=request.user_role,
+                                             selected_db=selected_db
+                                             )
 
     answer = result_analyze.get("result", None)
     reason = result_analyze.get("reason", None)
@@ -1,15 +1,21 @@
+import asyncio
 from datetime import timezone
 import pandas as pd
 from fastapi import Depends, Query, APIRouter, UploadFile, File, Header
 from pydantic import ValidationError
 
-from database.redis_connection import flush_redis_database, r
+from database.redis_connection import flush_redis_database, get_async_redis
 from processing.analysis_processor import _read_excel_file_data
+from processing.dataset_selector import MASTER_DESCRIPTIONS_VERSION_KEY
 from processing.query_retrieval_processor import get_classifier_pipeline
 from utils import helper_rag
 from typing_class.rag_type import *
 from database.typesense_declare import get_typesense_instance_service
+from database.typesense_async import AsyncTypesenseClient, get_async_typesense_instance_service
+from database.typesense_search import list_catalog_documents
 from rag_components.chatbot_manager import *
+from rag_components.retrieval_config import aget_retrieval_config, asave_retrieval_config
+from rag_components import ingestion_jobs
 from config import settings
 import aiofiles
 import os
@@ -34,6 +40,11 @@ def get_typesense_client():
     return client
 
 
+# Helper dependency to get the pooled async Typesense client used on request paths
+def get_async_typesense_client() -> AsyncTypesenseClient:
+    return get_async_typesense_instance_service()
+
+
 # ===================================================
 # [Group 1] Chatbot management endpoints
 # ===================================================
@@ -74,6 +85,20 @@ async def delete_chatbot_endpoint(chatbot_name: str, typesense_client: Any = Dep
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/typesense/chatbot/retrieval/{chatbot_name}", response_model=RetrievalConfig)
+async def get_chatbot_retrieval_config(chatbot_name: str):
+    """Lấy cấu hình truy xuất (vector / hybrid, fusion, alpha) của chatbot"""
+    return await aget_retrieval_config(chatbot_name)
+
+
+@router.put("/typesense/chatbot/retrieval/{chatbot_name}", response_model=RetrievalConfig)
+async def update_chatbot_retrieval_config(chatbot_name: str, config: RetrievalConfig):
+    """Cập nhật cấu hình truy xuất của chatbot"""
+    try:
+        return await asave_retrieval_config(chatbot_name, config)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # ===================================================
 # [Group 2] Document management endpoints
 # ===================================================
@@ -83,158 +108,118 @@ async def get_chatbot_documents(
     chatbot_name: str,
     limit: int = Query(100, ge=1, le=250), # FIX: Add pagination
     offset: int = Query(0, ge=0),
-    typesense_client: Any = Depends(get_typesense_client)
+    typesense_client: AsyncTypesenseClient = Depends(get_async_typesense_client)
 ):
-    """Lấy danh sách document trong collection của chatbot."""
+    """Lấy danh sách tài liệu của chatbot từ catalog tài liệu."""
     try:
-        result = typesense_client.client.collections[chatbot_name].documents.search({
-            "q": "*", "query_by": "text", "limit": limit, "offset": offset
-        })
-
+        entries = await list_catalog_documents(chatbot_name, typesense_client, limit=limit, offset=offset)
         documents = [
             Document(
-                document_id=doc.get("id"),
-                file_name=doc.get("title"),
-                file_type=doc.get("file_type", "unknown"), # FIX: Use stored file type
-                chunk_text=doc.get("text"),
-                chunk_num=doc.get("chunk_num", 0)
+                document_id=entry["doc_uuid"],
+                file_name=entry["title"],
+                file_type=entry["file_type"],
+                chunk_text="",
+                chunk_num=entry["chunk_count"],
+                num_pages=entry["page_count"],
+                num_chunks=entry["chunk_count"],
+                content_hash=entry.get("content_hash"),
+                status=entry["status"],
+                uploaded_at=datetime.fromtimestamp(entry["uploaded_at"], timezone.utc)
             )
-            for hit in result.get("hits", []) if (doc := hit.get("document"))
+            for entry in entries
         ]
-        documents.extend([
-            Document(
-                document_id=temp,
-                file_name=temp,
-                file_type="excel",  # FIX: Use stored file type
-                chunk_text="none",
-                chunk_num=1
-            )
-            for temp in os.listdir(os.path.join(settings.UPLOAD_DIR, chatbot_name))
-        ])
         return {"status": "success", "chatbot_id": chatbot_name, "documents": documents}
     except Exception as e:
-        print(e)
+        logger.error(f"Error retrieving documents for chatbot {chatbot_name}: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Error retrieving documents for chatbot {chatbot_name}: {e}")
 
 
-@router.post("/typesense/document/upload/{chatbot_name}", response_model=ProcessingResponse)
+@router.delete("/typesense/document/{chatbot_name}/{document_id}")
+async def delete_chatbot_document(chatbot_name: str, document_id: str,
+                                  typesense_client: Any = Depends(get_typesense_client)):
+    """Xóa một tài liệu đã index (toàn bộ chunk theo doc_uuid) và entry của nó trong catalog."""
+    try:
+        return await asyncio.to_thread(typesense_client.delete_document_by_id, chatbot_name, document_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error deleting document '{document_id}': {e}")
+
+
+@router.post("/typesense/document/upload/{chatbot_name}", response_model=IngestionJobResponse)
 async def process_pdf_endpoint(chatbot_name: str,
                                file: UploadFile = File(...),
-                               typesense_client: Any = Depends(get_typesense_client),
                                permissions_str: Optional[str] = Form(None, alias="permissions"),
                                ):
-    """Upload và xử lý file PDF, index vào collection của chatbot."""
-    # flush_redis_database()
+    """
+    Upload file của chatbot và đưa vào hàng đợi xử lý.
+    PDF và Excel được xử lý bởi ingestion worker; theo dõi tiến độ qua /jobs/{job_id}.
+    """
+    permissions_dict = None
     if permissions_str:
         try:
             # Manually parse the JSON string
             permissions_data = json.loads(permissions_str)
             # Validate the data using the Pydantic model
             permissions = PermissionConfig(**permissions_data)
-
-            # If we get here, everything is valid
-            print(f"Received and validated permission configuration for bot: {permissions.botName}")
-            print(permissions)
-            # db.save_permission_config(chatbot_name, permissions.dict())
-
+            permissions_dict = permissions.model_dump() if hasattr(permissions, 'model_dump') else permissions.dict()
+            logger.info(f"Received and validated permission configuration for bot: {permissions.botName}")
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid JSON format in the 'permissions' field.")
         except ValidationError as e:
             # Pydantic raises a ValidationError, which we catch
             raise HTTPException(status_code=422, detail=f"Invalid permission data: {e.errors()}")
 
-    try:
-        if file.filename.split(".")[-1] == "pdf":
-            result = await helper_rag.process_and_index_pdf(chatbot_name, file, typesense_client)
-            return {
-                "status": "success",
-                "message": "PDF processed and indexed successfully",
-                "document_id": result["document_id"],
-                "file_name": result["file_name"],
-                "num_chunks": result["num_chunks"],
-                "file_type": "pdf"
-            }
-
+    job_id = ingestion_jobs.new_job_id()
+    if file.filename.split(".")[-1] == "pdf":
+        file_type = "pdf"
+        destination_path = ingestion_jobs.staging_path(job_id, file.filename)
+    else:
+        file_type = "excel" if file.filename.lower().endswith(('.xlsx', '.xls')) else "file"
         chatbot_directory = os.path.join(settings.UPLOAD_DIR, chatbot_name)
         os.makedirs(chatbot_directory, exist_ok=True)
         destination_path = os.path.join(chatbot_directory, file.filename.replace("_", "-"))
 
+    try:
+        async with aiofiles.open(destination_path, 'wb') as out_file:
+            while content := await file.read(1024 * 1024):
+                await out_file.write(content)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Could not save file: {e}")
+
+    if file_type == "file":
+        # Listed from the catalog like indexed documents; same entry as rebuild_document_catalog writes
+        saved_name = os.path.basename(destination_path)
         try:
-            async with aiofiles.open(destination_path, 'wb') as out_file:
-                while content := await file.read(1024):
-                    await out_file.write(content)
+            await asyncio.to_thread(get_typesense_instance_service().upsert_catalog_entry,
+                                    chatbot_name, saved_name, saved_name, "file")
         except Exception as e:
-            return {"error": f"Could not save file: {e}"}
-
-        if destination_path.lower().endswith(('.xlsx', '.xls')):
-            try:
-                master_df = pd.read_excel(destination_path, sheet_name="master")
-                if not master_df.empty:
-                    description = "\n".join(master_df.iloc[:, 0].astype(str).tolist())
-                    name_master_description = settings.MASTER_DESCRIPTION_DEFINE.format(
-                        collection=chatbot_name,
-                        type="xlsx",
-                        full_path=destination_path,
-                        description=description
-                    )
-                    r.rpush(settings.LIST_MASTER_DATA_DESCRIPTION, name_master_description)
-
-                permission_df = None
-                if permissions_str:
-                    if hasattr(permissions, 'model_dump'):
-                        permissions_dict = permissions.model_dump()
-                    else:
-                        permissions_dict = permissions.dict()
-
-                    if permissions_dict:
-                        data_for_df = []
-                        for key, value in permissions_dict.items():
-                            string_value = json.dumps(value) if isinstance(value, (list, dict)) else str(value)
-                            data_for_df.append([key, string_value])
-                        permission_df = pd.DataFrame(data_for_df, columns=['Permission', 'Value'])
-
-                # --- 5. GHI TẤT CẢ CÁC SHEET ĐÃ CẬP NHẬT TRỞ LẠI FILE ---
-                # Sử dụng mode='w' để ghi đè file với nội dung mới từ dictionary all_sheets_dfs
-                all_sheets_dfs = pd.read_excel(destination_path, sheet_name=None)
-                with pd.ExcelWriter(destination_path, engine='openpyxl', mode='w') as writer:
-                    # Ghi lại tất cả các sheet đã được sửa đổi (data, master) và các sheet không đổi
-                    for sheet_name, df_to_write in all_sheets_dfs.items():
-                        df_to_write.to_excel(writer, sheet_name=sheet_name, index=False)
-
-                    # Ghi thêm sheet 'permission' nếu nó đã được tạo
-                    if permission_df is not None:
-                        permission_df.to_excel(writer, sheet_name="permission", index=False)
-
-                print("Successfully wrote all updated sheets to the file.")
-
-                # --- 6. CÁC BƯỚC XỬ LÝ TIẾP THEO ---
-                _, _, _, description, _ = _read_excel_file_data(str(destination_path))
-                shared_pipeline = get_classifier_pipeline()
-                shared_pipeline.add_or_update_category(destination_path, description)
-
-            except Exception as e:
-                # Thay đổi thông báo lỗi để rõ ràng hơn
-                return {"error": f"An error occurred while processing the Excel file: {e}"}
-
-        return {
-            "status": "success",
-            "message": "File processed, standardized, and indexed successfully",
-            "document_id": "",
-            "file_name": "",
-            "num_chunks": 1,
-            "file_type": "excel"
-        }
-    except helper_rag.DocumentProcessingError as e:
-        raise HTTPException(status_code=500, detail=str(e))
+            logger.error(f"Could not add '{saved_name}' to the document catalog of '{chatbot_name}': {e}")
+        return {"status": "success", "message": "File saved", "job_id": None,
+                "file_name": file.filename, "file_type": file_type}
+
+    try:
+        await ingestion_jobs.aenqueue_job(job_id, chatbot_name, file_type, destination_path, file.filename,
+                                          permissions_dict)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"An unexpected error occurred during file processing. {e}")
+        raise HTTPException(status_code=503, detail=f"Could not queue the file for processing: {e}")
+    return {"status": "queued", "message": "File queued for processing", "job_id": job_id,
+            "file_name": file.filename, "file_type": file_type}
+
+
+@router.get("/jobs/{job_id}", response_model=IngestionJob)
+async def get_ingestion_job(job_id: str):
+    """Trạng thái, giai đoạn và tiến độ của một job ingestion."""
+    job = await ingestion_jobs.aget_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found")
+    return job
 
 # ===================================================
 # [Group 3] Search and Tools endpoints
 # ===================================================
 
 @router.post("/typesense/query_ver_thai")
-async def query_documents_endpoint(request: QueryRequest, api_key: str = Header(...), typesense_client: Any = Depends(get_typesense_client)):
+async def query_documents_endpoint(request: QueryRequest, api_key: str = Header(...),
+                                   typesense_client: AsyncTypesenseClient = Depends(get_async_typesense_client)):
     """Endpoint thực hiện RAG query, trả về câu trả lời từ LLM."""
     response_data = await helper_rag.process_rag_query(request, api_key, typesense_client)
     print(response_data["answer"])
@@ -248,10 +233,11 @@ async def suggest_follow_up_questions_endpoint(request: SuggestQuestionsRequest)
 
 
 @router.post("/typesense/get_chatbot_info", response_model=ChatbotInfoResponse)
-async def get_chatbot_info(request: ChatbotInfoRequest, typesense_client: Any = Depends(get_typesense_client)):
+async def get_chatbot_info(request: ChatbotInfoRequest,
+                           typesense_client: AsyncTypesenseClient = Depends(get_async_typesense_client)):
     """Lấy tên chatbot từ API key."""
     try:
-        chatbot_name = helper_rag.get_chatbot_name_by_api_key(typesense_client, request.api_key)
+        chatbot_name = await helper_rag.get_chatbot_name_by_api_key(typesense_client, request.api_key)
         return {"chatbot_name": chatbot_name}
     except helper_rag.InvalidAPIKeyError as e:
         raise HTTPException(status_code=401, detail=str(e))
@@ -262,7 +248,8 @@ async def get_chatbot_info(request: ChatbotInfoRequest, typesense_client: Any =
 @router.delete("/typesense/document/delete/{chatbotName}/{documentTitle}")
 async def delete_excel_document(chatbotName:str, documentTitle:str):
     """Xóa file excel đã upload"""
-    master_descriptions_list = r.lrange(settings.LIST_MASTER_DATA_DESCRIPTION, 0, -1)
+    redis_client = get_async_redis()
+    master_descriptions_list = await redis_client.lrange(settings.LIST_MASTER_DATA_DESCRIPTION, 0, -1)
     master_del = settings.MASTER_DESCRIPTION_DEFINE.format(
         collection=chatbotName,
         type="xlsx",
@@ -277,12 +264,14 @@ async def delete_excel_document(chatbotName:str, documentTitle:str):
     try:
 
         marker = "__TO_DELETE__"
-        # Set marker
-        r.lset(settings.LIST_MASTER_DATA_DESCRIPTION, idx, marker)
-
-        # Remove marker
-        r.lrem(settings.LIST_MASTER_DATA_DESCRIPTION, 1, marker)
+        # Set marker, remove marker and bump the description version in one MULTI round trip
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.lset(settings.LIST_MASTER_DATA_DESCRIPTION, idx, marker)
+            pipe.lrem(settings.LIST_MASTER_DATA_DESCRIPTION, 1, marker)
+            pipe.incr(MASTER_DESCRIPTIONS_VERSION_KEY)
+            await pipe.execute()
         file_path = os.path.join(settings.UPLOAD_DIR, chatbotName, documentTitle)
+        await asyncio.to_thread(get_typesense_instance_service().delete_catalog_entry, chatbotName, documentTitle)
         if os.path.exists(file_path):
             os.remove(file_path)
             return {"status": "success", "message": f"File '{documentTitle}' deleted successfully from chatbot '{chatbotName}'."}
@@ -14,6 +14,9 @@ class OrchestratorState(TypedDict, total=False):
     tool_to_use: Literal["rag", "analysis", "none"]
     tool_input: dict
     final_response: Any
+    # Reformulated query without the user prefix, and its embedding (base64 float16) computed once per turn
+    standalone_query: str
+    query_embedding: str
 
     top_k: int
     include_sources: bool
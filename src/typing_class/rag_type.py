@@ -1,8 +1,8 @@
 import json
 
 from fastapi import Form, HTTPException
-from pydantic import BaseModel
-from typing import List, Dict, Optional, Any, Union
+from pydantic import BaseModel, Field
+from typing import List, Dict, Optional, Any, Union, Literal
 from datetime import datetime
 
 
@@ -26,6 +26,10 @@ class Document(BaseModel):
     chunk_num: int
     page_num: Optional[int] = None
     uploaded_at: Optional[datetime] = None
+    num_pages: Optional[int] = None
+    num_chunks: Optional[int] = None
+    content_hash: Optional[str] = None
+    status: Optional[str] = None
 
 class DocumentListResponse(BaseModel):
     status: str
@@ -41,6 +45,28 @@ class ProcessingResponse(BaseModel):
     status: str
     message: str
 
+class IngestionJobResponse(BaseModel):
+    status: str
+    message: str
+    job_id: Optional[str] = None
+    file_name: str
+    file_type: str
+
+class IngestionJob(BaseModel):
+    job_id: str
+    chatbot_name: str
+    file_name: str
+    file_type: str
+    status: Literal["queued", "running", "succeeded", "failed"]
+    stage: str
+    done: int = 0
+    total: int = 0
+    progress: float = 0.0
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+    created_at: float
+    updated_at: float
+
 class QueryRequest(BaseModel):
     query: str
     top_k: Optional[int] = 20
@@ -51,6 +77,24 @@ class QueryRequest(BaseModel):
     voice: Optional[bool] = False
     user_id: str = "duythai"
     user_role: str = 'duythai'
+    # Embedding of the standalone query computed upstream (llm.query_embedding.encode_query_embedding):
+    # base64 little-endian float16, reused instead of re-embedding when embedding_model matches
+    query_embedding: Optional[str] = None
+    embedding_model: Optional[str] = None
+
+
+class RetrievalConfig(BaseModel):
+    """
+    Per-chatbot retrieval settings.
+
+    Attributes:
+        mode: "vector" for embedding search only, "hybrid" for keyword + vector with rank fusion
+        fusion: "rrf" (reciprocal rank fusion) or "weighted" (min-max normalised scores)
+        alpha: Weight of the vector side in the fusion (1.0 = vector only, 0.0 = keyword only)
+    """
+    mode: Literal["vector", "hybrid"] = "vector"
+    fusion: Literal["rrf", "weighted"] = "rrf"
+    alpha: float = Field(0.5, ge=0.0, le=1.0)
 
 
 class ToolRequest(BaseModel):
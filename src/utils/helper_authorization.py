@@ -1,7 +1,7 @@
-import pickle
 
 import pandas as pd
 from database.redis_connection import r
+from database.dataset_partitions import get_dataset
 from config import settings
 
 def authorize_by_file(user_id:str, user_role:str, df: pd.DataFrame, row_rules:dict):
@@ -29,9 +29,9 @@ def authorize_by_db(user_id:str, user_role:str, df: pd.DataFrame, row_rules:dict
         return df
     elif user_role.upper() == "BM":
         # go to database to get the list of user_ids that this BM can see
-        bm_df = r.get(settings.OPC_DB_GSBH_CACHE_NAME)
+        # Only the two mapping columns are decoded, and kept decoded in this process
+        bm_df = get_dataset(settings.OPC_DB_GSBH_CACHE_NAME, columns=['NHANVIEN_FK', 'GSSBH_FK'])
         if bm_df is not None:
-            bm_df = pickle.loads(bm_df)
             list_user_under_id = bm_df[bm_df['NHANVIEN_FK'].astype(str).str.replace(r'\.0$', '', regex=True) == user_id]['GSSBH_FK'].tolist()
             # print("The list of user under this BM is ", list_user_under_id)
             # print("----------- debug ------------------")
@@ -1,15 +1,25 @@
-import requests
-
-from rag_components.chatbot_manager import get_chatbot_name_by_api_key
+from rag_components.chatbot_manager import get_chatbot_name_by_api_key, InvalidAPIKeyError
 from rag_components.llm_interface import reformulate_query_with_chain, get_final_answer_chain
-from database.typesense_search import get_all_chunks_of_page, perform_vector_search
+from database.typesense_search import get_all_chunks_of_page, get_chunks_of_page_window, get_chunk_embeddings, \
+    perform_vector_search, perform_hybrid_search, perform_keyword_search
+from rag_components.retrieval_config import aget_retrieval_config
+from rag_components.reranker import RERANK_CONTEXT_TOP_N, RERANK_MIN_SCORE, get_reranker_service
+from database.search_cache import aget_collection_version
+from database.vector_profile import aget_vector_profile, apply_vector_profile, encode_vector_query, project_vectors
 from typing_class.rag_type import *
 from processing.document_processor import *
+from processing.chunking import chunk_text
 from llm.ModelEmbedding import get_embedding_model_service
+from llm.query_embedding import embed_query, request_query_embedding
+from utils.trace_context import trace_stage, trace_value
 embeddings_service = get_embedding_model_service()
 
 from config import settings
+import asyncio
+import hashlib
+import json
 import math
+import numpy as np
 import sys, os
 from pathlib import Path
 
@@ -20,8 +30,10 @@ from loguru import logger
 import logging
 import os
 import re
+import time
 import uuid
-from typing import List, Dict, Any
+from contextlib import closing
+from typing import Callable, List, Dict, Any, Optional
 from fastapi import UploadFile, HTTPException
 
 from context_engine.rag_prompt import *
@@ -30,6 +42,12 @@ from context_engine.rag_prompt import *
 DEFAULT_SEARCH_LIMIT = 100
 MIN_QUESTION_LENGTH = 15
 MAX_CONTEXT_LENGTH_CHARS = 1000  # ~8k tokens
+CONTEXT_PAGE_WINDOW = 2  # pages on each side of the best hit used for context expansion
+# A token that looks like a product code / SKU: letters and digits mixed, optionally with - _ . /
+CODE_TOKEN_PATTERN = re.compile(r"^(?=.*\d)(?=.*[^\W\d_])[^\W_][\w\-./]{2,}$", re.UNICODE)
+MAX_CODE_LOOKUP_TOKENS = 3
+INGESTION_BATCH_RETRIES = getattr(settings, "INGESTION_BATCH_RETRIES", 3)
+INGESTION_RETRY_BACKOFF_SECONDS = getattr(settings, "INGESTION_RETRY_BACKOFF_SECONDS", 1.0)
 
 
 import nest_asyncio
@@ -39,129 +57,49 @@ logger = logging.getLogger(__name__)
 embedding_service = get_embedding_model_service()
 
 
-# Function để tính độ tương đồng giữa chunk và query embedding
-def compute_similarity(chunk_text, query_emb):
-    try:
-        chunk_emb = [temp.tolist() for temp in embedding_service.embed_batch(chunk_text)]
-        dot_product = sum(a * b for a, b in zip(chunk_emb, query_emb))
-        magnitude_a = math.sqrt(sum(a * a for a in chunk_emb))
-        magnitude_b = math.sqrt(sum(b * b for b in query_emb))
-        if magnitude_a * magnitude_b == 0:
-            return 0
-        return dot_product / (magnitude_a * magnitude_b)
-    except Exception as e:
-        print(f"Lỗi khi tính similarity: {str(e)}")
-        return 0
-
-
-# Function to chunk text into manageable pieces
-def chunk_text(text, max_chars=1000, overlap=200):
+# Function để tính độ tương đồng giữa các chunk và query embedding
+def score_chunks(chunks: List[Dict], query_emb: List[float], collection_name: str) -> List[tuple[str, float]]:
     """
-    Chia văn bản thành các đoạn nhỏ với kích thước phù hợp và có phần chồng lấp.
+    Scores unique chunks by cosine similarity to the query with one matrix-vector product.
 
-    Args:
-        text (str): Văn bản cần chia
-        max_chars (int): Số ký tự tối đa cho mỗi chunk
-        overlap (int): Số ký tự chồng lấp giữa các chunk
-
-    Returns:
-        tuple: (chunks, chunk_indices) - danh sách chunks và vị trí của chúng
+    Chunks are dicts with `text` and, when available, the stored `embedding`. Only chunks
+    without a stored embedding are embedded (in a single batch), then projected with the
+    collection's vector profile so every vector lives in the same space as `query_emb`.
+    Returns (text, score) pairs sorted by descending score.
     """
-    chunks = []
-    chunk_indices = []
-
-    # Nếu text rỗng, trả về list rỗng
-    if not text:
-        return [], []
-
-    # Nếu text ngắn hơn max_chars, trả về trực tiếp
-    if len(text) <= max_chars:
-        return [text], [(0, len(text))]
-
-    start = 0
-    previous_end = 0  # Lưu vị trí kết thúc trước đó để kiểm tra tiến triển
-    previous_chunks = set()  # Lưu các chunk đã xử lý để tránh lặp
-
-    max_iterations = min(1000, len(text) // max(1, (max_chars - overlap)) + 10)
-    iteration = 0
-
-    while start < len(text) and iteration < max_iterations:
-        iteration += 1
-        end = min(start + max_chars, len(text))
-
-        # Tìm điểm ngắt phù hợp nếu chưa đến cuối văn bản
-        if end < len(text):
-            # Ưu tiên ngắt tại đoạn văn
-            para_break = text.rfind('\n\n', start, end)
-            if para_break != -1 and para_break > start + (max_chars // 3):
-                end = para_break + 2
-            else:
-                # Ngắt tại dấu chấm kết thúc câu
-                sent_break = text.rfind('. ', start, end)
-                if sent_break != -1 and sent_break > start + (max_chars // 3):
-                    end = sent_break + 2
-                else:
-                    # Ngắt tại khoảng trắng
-                    space = text.rfind(' ', start, end)
-                    if space != -1 and space > start + (max_chars // 3):
-                        end = space + 1
-
-        # Kiểm tra xem có tiến triển không
-        if end <= start:
-            # Nếu không tìm được điểm ngắt phù hợp, cắt cứng tại max_chars
-            end = min(start + max_chars, len(text))
-            if end <= start:  # Vẫn không có tiến triển, thoát vòng lặp
-                break
-
-        # Đảm bảo có tiến triển so với vòng lặp trước
-        if end <= previous_end:
-            # Force tiến ít nhất 1 ký tự
-            start = previous_end + 1
-            if start >= len(text):
-                break
-            continue
-
-        chunk = text[start:end]
-
-        # Kiểm tra chunk trùng lặp
-        if chunk in previous_chunks:
-            # Vòng lặp đang lặp lại, hãy thoát
-            break
-
-        previous_chunks.add(chunk)
-        chunks.append(chunk)
-        chunk_indices.append((start, end))
-
-        previous_end = end
-
-        # Cập nhật vị trí bắt đầu mới, đảm bảo có tiến triển
-        if len(text) - end < overlap:  # Gần cuối văn bản
-            start = end  # Không chồng lấp nữa, lấy nốt đoạn cuối
-        else:
-            start = end - overlap
-
-        # Đảm bảo start tiến ít nhất 1 ký tự để tránh lặp vô hạn
-        start = max(start, previous_end - overlap, previous_end - max_chars // 2)
-
-        # Kiểm tra thêm: Nếu phần còn lại quá nhỏ, gộp vào chunk cuối
-        if len(text) - start < max_chars // 3:
-            last_chunk = text[start:]
-            if last_chunk.strip():  # Chỉ thêm nếu có nội dung có ý nghĩa
-                chunks[-1] = chunks[-1] + last_chunk
-                chunk_indices[-1] = (chunk_indices[-1][0], len(text))
-            break
-
-    # Xử lý trường hợp vẫn còn nội dung chưa xử lý sau khi đã đạt số vòng lặp tối đa
-    if start < len(text) and iteration >= max_iterations:
-        last_part = text[start:]
-        # Chỉ thêm nếu có nội dung có ý nghĩa và khác với chunk cuối cùng
-        if last_part.strip() and (not chunks or last_part != chunks[-1]):
-            chunks.append(last_part)
-            chunk_indices.append((start, len(text)))
-
-    return chunks, chunk_indices
+    embeddings_by_text = {}
+    for chunk in chunks:
+        text = chunk.get("text", "")
+        if text and embeddings_by_text.get(text) is None:
+            embeddings_by_text[text] = chunk.get("embedding")
+    if not embeddings_by_text:
+        return []
+
+    missing = [text for text, emb in embeddings_by_text.items() if emb is None]
+    if missing:
+        fresh = apply_vector_profile(np.vstack(embedding_service.embed_batch(missing)), collection_name)
+        embeddings_by_text.update(zip(missing, fresh))
+
+    texts = list(embeddings_by_text)
+    matrix = np.asarray([embeddings_by_text[text] for text in texts], dtype=np.float32)
+    query = np.asarray(query_emb, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query)
+    scores = (matrix @ query) / np.where(norms == 0, 1, norms)
+    return sorted(zip(texts, scores.tolist()), key=lambda x: x[1], reverse=True)
+
+
+def is_code_lookup(query: str) -> bool:
+    """
+    True when the query is clearly a code lookup (e.g. "SP-00123", "mã OPC2024A"):
+    a few tokens, at least one of which mixes letters and digits.
+    """
+    tokens = query.strip().split()
+    if not tokens or len(tokens) > MAX_CODE_LOOKUP_TOKENS:
+        return False
+    return any(CODE_TOKEN_PATTERN.match(token) for token in tokens)
 
 
+# Function to chunk text into manageable pieces
 # Get context for a chunk
 def get_context_for_chunk(hit, pdf_pages):
     page_num = hit['document']['page_num']
@@ -174,7 +112,7 @@ def get_context_for_chunk(hit, pdf_pages):
     if chunk_num == 0 and page_num > 0:
         context = pdf_pages[page_num - 1] + "\n\n" + page_text
     # If it's the last chunk of a page and not the last page, add next page
-    elif chunk_num == len(chunk_text(page_text)[0]) - 1 and page_num < len(pdf_pages) - 1:
+    elif hit['document'].get('end_index', 0) >= len(page_text.rstrip()) and page_num < len(pdf_pages) - 1:
         context = page_text + "\n\n" + pdf_pages[page_num + 1]
     else:
         context = page_text
@@ -182,44 +120,27 @@ def get_context_for_chunk(hit, pdf_pages):
     return context
 
 
-def search_documents(query_text, top_k=10):
+async def search_documents(query_text, typesense_client, collection_name="pdf_documents", top_k=10):
     # Generate embedding for query
-    query_embedding = embedding_service.embed(query_text).tolist()
-
-    # Perform vector search using multi_search
-    try:
-        # Search by vector embedding similarity using multi_search
-        vector_multi_search_params = {
-            'searches': [
-                {
-                    'collection': 'pdf_documents',
-                    'q': '*',  # Match all documents
-                    'vector_query': f'embedding:({str(query_embedding)}, k:{top_k * 3})',
-                    'limit': top_k * 2
-                }
-            ]
-        }
-
-        # Make the multi_search request for vector search
-        multi_search_url = 'http://localhost:6211/multi_search'
-        headers = {'X-TYPESENSE-API-KEY': settings.TYPESENSE_API_KEY}
-
-        vector_response = requests.post(multi_search_url, headers=headers, json=vector_multi_search_params)
-
-        # Check if the request was successful
-        if vector_response.status_code == 200:
-            vector_results = vector_response.json()['results'][0]
-            # vector_hits = vector_results.get('hits', [])
-            # print(f"==> Vector search found: {len(vector_hits)} embedding vectors")
-            # print("==> vector_results: ", vector_results)
+    query_embedding = (await embed_query(query_text)).tolist()
+
+    # Search by vector embedding similarity using multi_search
+    vector_multi_search_params = {
+        'searches': [
+            {
+                'collection': collection_name,
+                'q': '*',  # Match all documents
+                'vector_query': f'embedding:([{encode_vector_query(query_embedding)}], k:{top_k * 3})',
+                'limit': top_k * 2
+            }
+        ]
+    }
 
-            return vector_results
-        else:
-            print(f"Error with vector multi_search: {vector_response.text}")
-            return {'hits': []}  # Return empty results if search fails
-    except Exception as e:
-        print(f"Error during vector search: {str(e)}")
+    vector_response = await typesense_client.multi_search(vector_multi_search_params)
+    if "error" in vector_response:
+        logger.error(f"Vector multi_search on '{collection_name}' failed: {vector_response['error']}")
         return {'hits': []}  # Return empty results if search fails
+    return vector_response['results'][0]
 
 
 
@@ -282,61 +203,241 @@ class FollowUpRequestsResult(BaseModel):
     questions: List[str]
 
 # --- Custom Exceptions for clear error handling ---
-class InvalidAPIKeyError(Exception):
+class DocumentProcessingError(Exception):
     pass
 
 
-class DocumentProcessingError(Exception):
-    pass
 
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def file_content_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _load_existing_chunks(typesense_client: Any, chatbot_name: str, title: str) -> Dict[str, Dict]:
+    """
+    Exports the chunks already indexed for a document title (id -> chunk), including
+    their embeddings, so a re-upload can reuse them. Chunks indexed before
+    content_hash existed get it computed from their stored text.
+    """
+    escaped_title = title.replace("`", "")
+    # Whole documents: they are also what a failed re-upload is rolled back to
+    exported = typesense_client.client.collections[chatbot_name].documents.export({
+        "filter_by": f"title:=`{escaped_title}`"
+    })
+    existing = {}
+    for line in exported.splitlines():
+        if not line.strip():
+            continue
+        doc = json.loads(line)
+        doc.setdefault("content_hash", content_hash(doc.get("text", "")))
+        existing[doc["id"]] = doc
+    return existing
+
+
+def _import_with_retry(typesense_client: Any, chatbot_name: str, batch: List[Dict], start: int) -> None:
+    """Upserts one batch, retrying failed batches with backoff before giving up."""
+    for attempt in range(INGESTION_BATCH_RETRIES + 1):
+        try:
+            results = typesense_client.import_documents(chatbot_name, batch)
+            failed = [result for result in results if not result.get("success", True)]
+            if not failed:
+                return
+            raise DocumentProcessingError(f"{len(failed)} documents rejected, first error: {failed[0].get('error')}")
+        except Exception as e:
+            if attempt == INGESTION_BATCH_RETRIES:
+                raise DocumentProcessingError(f"Error importing batch starting at index {start}: {e}") from e
+            logger.warning(f"Import of batch starting at index {start} failed "
+                           f"(attempt {attempt + 1}/{INGESTION_BATCH_RETRIES + 1}): {e}")
+            time.sleep(INGESTION_RETRY_BACKOFF_SECONDS * (2 ** attempt))
+
+
+def _rollback_chunks(typesense_client: Any, chatbot_name: str, written_ids: List[str], existing: Dict[str, Dict],
+                     batch_size: int = 100) -> None:
+    """Undoes the upserts of a failed ingestion: new chunks are deleted, overwritten ones restored."""
+    new_ids = [chunk_id for chunk_id in written_ids if chunk_id not in existing]
+    restored = [existing[chunk_id] for chunk_id in written_ids if chunk_id in existing]
+    for i in range(0, len(new_ids), batch_size):
+        id_filter = ",".join(f"`{chunk_id}`" for chunk_id in new_ids[i:i + batch_size])
+        typesense_client.delete_documents(chatbot_name, f"id:[{id_filter}]")
+    for i in range(0, len(restored), batch_size):
+        _import_with_retry(typesense_client, chatbot_name, restored[i:i + batch_size], i)
+    logger.info(f"Rolled back {len(new_ids)} new and {len(restored)} overwritten chunks in '{chatbot_name}'")
+
+
+def index_pdf_file(chatbot_name: str, pdf_path: str, file_name: str, typesense_client: Any,
+                   on_progress: Optional[Callable[[str, int, int], None]] = None) -> Dict[str, Any]:
+    """
+    Extracts, chunks and indexes a PDF already saved on disk (synchronous; runs in ingestion workers).
+
+    Ingestion is keyed by content: re-uploading a file with the same name keeps its
+    document id, skips chunks whose id and content hash are unchanged, reuses the
+    stored embedding of any chunk whose text already existed, upserts only the
+    changed chunks and deletes the stale ones in bulk.
+
+    Pages are streamed from iter_pdf_pages (parallel extraction for large files) and
+    chunked, embedded and upserted in batches as they arrive, so memory stays flat.
+
+    If indexing fails midway, the chunks written so far are rolled back (see
+    _rollback_chunks) so the previous revision stays intact.
+
+    `on_progress(stage, done, total)` is called as pages and cleanup advance.
+    """
+    report = on_progress or (lambda stage, done, total: None)
+
+    page_count = pdf_page_count(pdf_path)
+    if not page_count:
+        raise DocumentProcessingError("Cannot extract text from PDF")
+
+    # Same bytes as the indexed revision: nothing to do
+    file_hash = file_content_hash(pdf_path)
+    catalog_entries = typesense_client.find_catalog_entries(chatbot_name, file_name)
+    for entry in catalog_entries:
+        if entry.get("content_hash") == file_hash and entry.get("status") == "ready":
+            logger.info(f"'{file_name}' is unchanged since its last upload, skipping")
+            return {
+                "document_id": entry["doc_uuid"],
+                "file_name": file_name,
+                "num_chunks": entry["chunk_count"],
+                "unchanged_chunks": entry["chunk_count"],
+                "embedded_chunks": 0,
+                "deleted_chunks": 0
+            }
+
+    existing = _load_existing_chunks(typesense_client, chatbot_name, file_name)
+    existing_uuids = [doc["doc_uuid"] for doc in existing.values() if doc.get("doc_uuid")]
+    # Keep the id of the previous revision (the most common one if duplicates were uploaded)
+    document_id = max(set(existing_uuids), key=existing_uuids.count) if existing_uuids else str(uuid.uuid4())
+    embeddings_by_hash = {doc["content_hash"]: doc["embedding"] for doc in existing.values() if doc.get("embedding")}
+    typesense_client.upsert_catalog_entry(chatbot_name, document_id, file_name, "pdf", page_count=page_count,
+                                          content_hash=file_hash, status="indexing")
+
+    try:
+        batch_size = 100
+        current_ids = set()
+        written_ids = []
+        pending = []
+        counts = {"written": 0, "embedded": 0, "unchanged": 0}
+
+        def flush() -> None:
+            # Embed the texts not seen before (once per distinct text), then upsert the batch
+            missing = {}
+            for doc in pending:
+                if doc["embedding"] is None:
+                    doc["embedding"] = embeddings_by_hash.get(doc["content_hash"])
+                if doc["embedding"] is None:
+                    missing.setdefault(doc["content_hash"], doc["text"])
+            if missing:
+                fresh = apply_vector_profile(np.vstack(embeddings_service.embed_batch(list(missing.values()))),
+                                             chatbot_name)
+                embeddings_by_hash.update(zip(missing.keys(), fresh))
+                for doc in pending:
+                    if doc["embedding"] is None:
+                        doc["embedding"] = embeddings_by_hash[doc["content_hash"]]
+                counts["embedded"] += len(missing)
+            if pending:
+                # Recorded before the import: a failed batch may still be partly written
+                written_ids.extend(doc["id"] for doc in pending)
+                _import_with_retry(typesense_client, chatbot_name, pending, counts["written"])
+                counts["written"] += len(pending)
+            pending.clear()
+
+        with closing(iter_pdf_pages(pdf_path)) as pages:
+            for page_index, page_text in enumerate(pages):
+                report("processing", page_index, page_count)
+                chunks, chunk_indices = chunk_text(page_text)
+                for chunk_index, (chunk, indices) in enumerate(zip(chunks, chunk_indices)):
+                    chunk_id = f"{document_id}_{page_index}_{chunk_index}"
+                    chunk_hash = content_hash(chunk)
+                    start_index, end_index = (indices[0], indices[1]) if indices else (0, 0)
+                    current_ids.add(chunk_id)
+
+                    previous = existing.get(chunk_id)
+                    if (previous and previous["content_hash"] == chunk_hash
+                            and previous.get("start_index") == start_index and previous.get("end_index") == end_index):
+                        counts["unchanged"] += 1
+                        continue
+
+                    pending.append({
+                        "id": chunk_id,
+                        "doc_uuid": document_id,
+                        "title": file_name,
+                        "text": chunk,
+                        "page_num": page_index + 1,
+                        "chunk_num": chunk_index,
+                        "start_index": start_index,
+                        "end_index": end_index,
+                        "content_hash": chunk_hash,
+                        "embedding": embeddings_by_hash.get(chunk_hash)
+                    })
+                if len(pending) >= batch_size:
+                    flush()
+        flush()
+
+        # Bulk delete chunks that no longer exist in the new revision
+        stale_ids = sorted(set(existing) - current_ids)
+        for i in range(0, len(stale_ids), batch_size):
+            report("cleanup", i, len(stale_ids))
+            id_filter = ",".join(f"`{chunk_id}`" for chunk_id in stale_ids[i:i + batch_size])
+            try:
+                typesense_client.delete_documents(chatbot_name, f"id:[{id_filter}]")
+            except Exception as e:
+                logger.error(f"Error deleting stale chunks starting at index {i}: {e}")
+    except Exception:
+        try:
+            _rollback_chunks(typesense_client, chatbot_name, written_ids, existing)
+        except Exception as e:
+            logger.error(f"Could not roll back the chunks of '{file_name}': {e}")
+        previous_entry = next((entry for entry in catalog_entries if entry["doc_uuid"] == document_id), None)
+        if previous_entry is not None:
+            # The previous revision is what the collection holds again
+            typesense_client.upsert_catalog_entry(
+                chatbot_name, document_id, file_name, "pdf", page_count=previous_entry.get("page_count", 0),
+                chunk_count=previous_entry.get("chunk_count", 0), content_hash=previous_entry.get("content_hash"),
+                status=previous_entry.get("status", "ready"), uploaded_at=previous_entry.get("uploaded_at"))
+        else:
+            typesense_client.upsert_catalog_entry(chatbot_name, document_id, file_name, "pdf", page_count=page_count,
+                                                  content_hash=file_hash, status="failed")
+        raise
+
+    typesense_client.upsert_catalog_entry(chatbot_name, document_id, file_name, "pdf", page_count=page_count,
+                                          chunk_count=len(current_ids), content_hash=file_hash, status="ready")
+    # Entries of duplicate uploads folded into this revision
+    for entry in catalog_entries:
+        if entry["doc_uuid"] != document_id:
+            typesense_client.delete_catalog_entry(chatbot_name, entry["doc_uuid"])
+
+    logger.info(f"Indexed '{file_name}': {counts['unchanged']} unchanged, {counts['written']} written "
+                f"({counts['embedded']} newly embedded texts), {len(stale_ids)} stale removed")
+    return {
+        "document_id": document_id,
+        "file_name": file_name,
+        "num_chunks": len(current_ids),
+        "unchanged_chunks": counts["unchanged"],
+        "embedded_chunks": counts["embedded"],
+        "deleted_chunks": len(stale_ids)
+    }
 
 
 async def process_and_index_pdf(chatbot_name: str, file: UploadFile, typesense_client: Any) -> Dict[str, Any]:
-    """Saves, processes, chunks, and indexes a PDF file into Typesense."""
+    """Saves, processes, chunks, and indexes a PDF file into Typesense (inline, see index_pdf_file)."""
     temp_dir = "./temp"
     os.makedirs(temp_dir, exist_ok=True)
-    document_id = str(uuid.uuid4())
-    temp_path = os.path.join(temp_dir, f"{document_id}.pdf")
+    temp_path = os.path.join(temp_dir, f"{uuid.uuid4()}.pdf")
 
     try:
         content = await file.read()
         with open(temp_path, "wb") as f:
             f.write(content)
-
-        pages = extract_text_from_pdf(temp_path)
-        if not pages:
-            raise DocumentProcessingError("Cannot extract text from PDF")
-
-        documents = []
-        for page_index, page_text in enumerate(pages):
-            chunks, chunk_indices = chunk_text(page_text)
-            for chunk_index, (chunk, indices) in enumerate(zip(chunks, chunk_indices)):
-                doc = {
-                    "id": f"{document_id}_{page_index}_{chunk_index}",
-                    "title": file.filename,
-                    "text": chunk,
-                    "page_num": page_index + 1,
-                    "chunk_num": chunk_index,
-                    "start_index": indices[0] if indices else 0,
-                    "end_index": indices[1] if indices else 0,
-                    "embedding": embeddings_service.embed(chunk).tolist()
-                }
-                documents.append(doc)
-
-        # Bulk import in batches
-        batch_size = 100
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i + batch_size]
-            try:
-                typesense_client.client.collections[chatbot_name].documents.import_(batch)
-            except Exception as e:
-                logger.error(f"Error importing batch starting at index {i}: {e}")
-
-        return {
-            "document_id": document_id,
-            "file_name": file.filename,
-            "num_chunks": len(documents)
-        }
+        return await asyncio.to_thread(index_pdf_file, chatbot_name, temp_path, file.filename, typesense_client)
+    except DocumentProcessingError:
+        raise
     except Exception as e:
         logger.error(f"Error processing PDF '{file.filename}': {e}", exc_info=True)
         raise DocumentProcessingError(f"Failed to process and index PDF: {e}") from e
@@ -348,18 +449,31 @@ async def process_and_index_pdf(chatbot_name: str, file: UploadFile, typesense_c
             except OSError as e:
                 logger.warning(f"Could not remove temp file {temp_path}: {e}")
 
-def _build_rag_context(hits: List[Dict], query_embedding: List[float], typesense_client: Any, collection_name: str) -> \
-tuple[str, List[Dict]]:
-    """Builds a comprehensive context from search results for the LLM."""
+
+async def _build_rag_context(hits: List[Dict], query_embedding: Optional[List[float]], typesense_client: Any,
+                             collection_name: str) -> tuple[str, List[Dict]]:
+    """
+    Builds a comprehensive context from search results for the LLM.
+    With no query embedding (keyword-only retrieval) chunks keep their retrieval order.
+    Reranked hits: the top RERANK_CONTEXT_TOP_N (above RERANK_MIN_SCORE) go first, in
+    cross-encoder order, followed by the page window of the best one.
+    """
     if not hits:
         return "", []
 
+    reranked = "rerank_score" in hits[0]
+    if reranked:
+        other_hits = [hit for hit in hits[1:RERANK_CONTEXT_TOP_N]
+                      if RERANK_MIN_SCORE is None or hit.get("rerank_score", float("-inf")) >= RERANK_MIN_SCORE]
+    else:
+        other_hits = hits[1:3]
+
     top_hit_doc = hits[0].get("document", {})
     top_document_id = top_hit_doc.get("id", "")
 
     sources = [{
         "document_id": top_document_id,
-        "score": hits[0].get("vector_distance"),
+        "score": hits[0].get("rerank_score", hits[0].get("vector_distance")),
         "file_name": top_hit_doc.get("title")
     }]
 
@@ -367,38 +481,68 @@ tuple[str, List[Dict]]:
 
     # Attempt to expand context around the best hit
     try:
-        parts = top_document_id.rsplit("_", 2)
-        if len(parts) == 3:
-            doc_uuid, page_num_str, _ = parts
-            page_num = int(page_num_str)
-
-            # 1. Get all chunks from the hit's page
-            context_chunks.extend(get_all_chunks_of_page(doc_uuid, page_num, typesense_client, collection_name))
-
-            # 2. Get chunks from surrounding pages
-            for offset in [-2, -1, 1, 2]:
-                neighbor_page_num = page_num + offset
-                if neighbor_page_num >= 0:
-                    context_chunks.extend(
-                        get_all_chunks_of_page(doc_uuid, neighbor_page_num, typesense_client, collection_name))
-    except (ValueError, IndexError) as e:
-        logger.warning(f"Could not parse doc ID '{top_document_id}' for context expansion: {e}")
-        context_chunks.append(top_hit_doc.get("text", ""))
+        if top_hit_doc.get("doc_uuid"):
+            # Hit's page and its neighbours in one filtered search
+            context_chunks.extend(await get_chunks_of_page_window(
+                top_hit_doc["doc_uuid"], int(top_hit_doc.get("page_num", 0)), CONTEXT_PAGE_WINDOW,
+                typesense_client, collection_name
+            ))
+        else:
+            # Collections indexed before doc_uuid existed: per-chunk id lookups.
+            # Run `typesense_declare.py --action migrate_schema` to move them to the fast path.
+            logger.warning(f"Collection '{collection_name}' has no doc_uuid field; using per-chunk context lookups")
+            parts = top_document_id.rsplit("_", 2)
+            if len(parts) == 3:
+                doc_uuid, page_num_str, _ = parts
+                page_num = int(page_num_str)
+
+                # Hit's page and surrounding pages, fetched concurrently
+                pages = [page_num] + [page_num + offset for offset in [-2, -1, 1, 2] if page_num + offset >= 0]
+                page_chunks = await asyncio.gather(*(
+                    get_all_chunks_of_page(doc_uuid, page, typesense_client, collection_name) for page in pages
+                ))
+                for texts in page_chunks:
+                    context_chunks.extend({"text": text} for text in texts)
+    except Exception as e:
+        logger.warning(f"Could not expand context around doc ID '{top_document_id}': {e}")
+        context_chunks.append({"id": top_document_id, "text": top_hit_doc.get("text", "")})
 
     # Add text from other top hits to the context pool
-    for hit in hits[1:3]:
+    for hit in other_hits:
         doc = hit.get("document", {})
-        context_chunks.append(doc.get("text", ""))
+        context_chunks.append({"id": doc.get("id"), "text": doc.get("text", "")})
         sources.append({
             "document_id": doc.get("id"),
-            "score": hit.get("vector_distance"),
+            "score": hit.get("rerank_score", hit.get("vector_distance")),
             "file_name": doc.get("title")
         })
 
-    # De-duplicate, score, and rank chunks to build final context
-    unique_chunks = list(dict.fromkeys(context_chunks))
-    scored_chunks = [(chunk, compute_similarity(chunk, query_embedding)) for chunk in unique_chunks]
-    scored_chunks.sort(key=lambda x: x[1], reverse=True)
+    if query_embedding is None:
+        # Keyword-only fast path: keep retrieval order, no embeddings involved
+        unique_texts = dict.fromkeys(chunk["text"] for chunk in context_chunks if chunk.get("text"))
+        scored_chunks = [(text, 0.0) for text in unique_texts]
+    else:
+        # Stored embeddings for candidates outside the fetched page window, in one request
+        missing_ids = [chunk["id"] for chunk in context_chunks if chunk.get("id") and chunk.get("embedding") is None]
+        try:
+            stored = await get_chunk_embeddings(missing_ids, typesense_client, collection_name)
+            for chunk in context_chunks:
+                if chunk.get("embedding") is None and chunk.get("id") in stored:
+                    chunk["embedding"] = stored[chunk["id"]]
+        except Exception as e:
+            logger.warning(f"Could not fetch stored embeddings for {missing_ids}: {e}")
+
+        # De-duplicate, score, and rank chunks to build final context
+        # Embedding the chunks without a stored vector is blocking model / HTTP work
+        scored_chunks = await asyncio.to_thread(score_chunks, context_chunks, query_embedding, collection_name)
+
+    if reranked:
+        # The cross-encoder's choice outranks the bi-encoder similarity of the window chunks
+        ranked_texts = [hit.get("document", {}).get("text", "") for hit in [hits[0]] + other_hits]
+        ranked_texts = [text for text in dict.fromkeys(ranked_texts) if text]
+        ranked = set(ranked_texts)
+        scored_chunks = ([(text, float("inf")) for text in ranked_texts]
+                         + [(text, score) for text, score in scored_chunks if text not in ranked])
 
     # Build final context string, respecting token limits
     final_context_parts = []
@@ -412,32 +556,61 @@ tuple[str, List[Dict]]:
             break
 
     combined_context = "\n\n---\n\n".join(final_context_parts)
-    print(combined_context)
-    print(len(combined_context.split(" ")), "chars in combined context")
+    logger.debug(f"Combined context ({len(combined_context)} chars):\n{combined_context}")
     return combined_context, sources
 
 
 async def process_rag_query(request, api_key, typesense_client) -> Dict[str, Any]:
-    """Orchestrates the entire RAG query process."""
+    """Orchestrates the entire RAG query process (typesense_client is an AsyncTypesenseClient)."""
     try:
-        collection_name = get_chatbot_name_by_api_key(typesense_client, api_key)
+        with trace_stage("auth"):
+            collection_name = await get_chatbot_name_by_api_key(typesense_client, api_key)
 
-        query_embedding = embeddings_service.embed(request.query).tolist()
+        retrieval_config = await aget_retrieval_config(collection_name)
 
-        hits = perform_vector_search(collection_name, query_embedding, request.top_k, typesense_client)
+        if retrieval_config.mode == "hybrid" and is_code_lookup(request.query):
+            # Exact codes / SKUs: keyword search alone, skip embedding entirely
+            search_embedding = None
+            with trace_stage("search"):
+                hits = await perform_keyword_search(collection_name, request.query, request.top_k, typesense_client)
+        else:
+            with trace_stage("embed"):
+                # Reuses the vector shipped by the orchestrator when it comes from the same model
+                query_embedding = (await request_query_embedding(request)).tolist()
+                # The version drops a cached profile as soon as the collection is re-indexed under a new one
+                profile = await aget_vector_profile(collection_name, await aget_collection_version(collection_name))
+                search_embedding = project_vectors(query_embedding, profile)
+            with trace_stage("search"):
+                if retrieval_config.mode == "hybrid":
+                    hits = await perform_hybrid_search(collection_name, request.query, search_embedding,
+                                                       request.top_k, typesense_client, alpha=retrieval_config.alpha,
+                                                       fusion=retrieval_config.fusion)
+                else:
+                    hits = await perform_vector_search(collection_name, search_embedding, request.top_k,
+                                                       typesense_client)
         if not hits:
+            trace_value("hits", [])
             return {"answer": "I could not find an answer in the provided documents. Please try a different question.",
                     "sources": []}
 
-        combined_context, sources = _build_rag_context(hits, query_embedding, typesense_client, collection_name)
+        reranker = get_reranker_service()
+        if reranker is not None:
+            with trace_stage("rerank"):
+                hits = await asyncio.to_thread(reranker.rerank, request.query, hits)
+        trace_value("hits", [hit.get("document", {}) for hit in hits])
+
+        with trace_stage("context"):
+            combined_context, sources = await _build_rag_context(hits, search_embedding, typesense_client,
+                                                                 collection_name)
 
         final_answer_chain = get_final_answer_chain(use_cloud=request.cloud_call)
 
-        final_answer = await final_answer_chain.ainvoke({
-            "knowledge_chunk": combined_context,
-            "task_prompt": FINAL_ANSWER_PROMPT,
-            "user_query": request.query
-        })
+        with trace_stage("llm"):
+            final_answer = await final_answer_chain.ainvoke({
+                "knowledge_chunk": combined_context,
+                "task_prompt": FINAL_ANSWER_PROMPT,
+                "user_query": request.query
+            })
 
         return {
             "query": request.query,
@@ -1,7 +1,33 @@
+import time
+from contextlib import contextmanager
 from contextvars import ContextVar
-from typing import Optional
+from typing import Any, Dict, Optional
 from uuid import UUID
 
 # This context variable will hold the parent run ID from the orchestrator
 # for the duration of a single incoming API request.
-parent_run_id_var: ContextVar[Optional[UUID]] = ContextVar("parent_run_id_var", default=None)
\ No newline at end of file
+parent_run_id_var: ContextVar[Optional[UUID]] = ContextVar("parent_run_id_var", default=None)
+
+# Optional per-query trace (stage timings in ms and retrieved chunk ids), filled by
+# process_rag_query when a caller such as a benchmark sets it; None means tracing is off.
+rag_trace_var: ContextVar[Optional[Dict[str, Any]]] = ContextVar("rag_trace_var", default=None)
+
+
+@contextmanager
+def trace_stage(name: str):
+    trace = rag_trace_var.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = trace.setdefault("stages", {})
+        stages[name] = stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def trace_value(name: str, value: Any) -> None:
+    trace = rag_trace_var.get()
+    if trace is not None:
+        trace[name] = value